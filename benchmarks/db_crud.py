@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""
+Microbenchmark of the generic DB CRUD paths.
+
+Compares the per-call `session.query(model).filter_by(**kwargs)` queries the
+DB class used to build with the cached statements in vaultShare.db.statements.
+
+Usage:
+    python -m benchmarks.db_crud [iterations]
+"""
+import sys
+import timeit
+from vaultShare.db import UserDB
+from vaultShare.db.models import User
+
+
+def setup_db(num_users: int = 1000) -> UserDB:
+    db = UserDB(database_url="sqlite:///:memory:")
+    db._session.add_all([
+        User(id=str(i), username=f"user{i}", email=f"user{i}@x.io", hashed_password="x")
+        for i in range(num_users)
+    ])
+    db._session.commit()
+    return db
+
+
+def legacy_validate_attr(model, passed_attr, excluded_attr=[]):
+    for key in passed_attr:
+        if key not in model.__table__.columns.keys() or key in excluded_attr:
+            raise ValueError(key)
+
+
+def main(iterations: int = 5000):
+    db = setup_db()
+    session = db._session
+    cases = {
+        "retrieve": (
+            lambda: session.query(User).filter_by(username="user500").first(),
+            lambda: db.retrieve(User, username="user500"),
+        ),
+        "update": (
+            lambda: (session.query(User).filter_by(username="user500").update(
+                {"role": "user"}, synchronize_session=False), session.commit()),
+            lambda: db.update(User, {"username": "user500"}, role="user"),
+        ),
+        "delete (no match)": (
+            lambda: (session.query(User).filter_by(username="nobody").delete(
+                synchronize_session=False), session.commit()),
+            lambda: db.delete(User, username="nobody"),
+        ),
+        "validate_attr": (
+            lambda: legacy_validate_attr(User, {"username": 1, "email": 1}, ["id"]),
+            lambda: db.validate_attr(User, {"username": 1, "email": 1}, ["id"]),
+        ),
+    }
+
+    print(f"{'operation':<20}{'filter_by (us)':>16}{'cached (us)':>14}{'speedup':>10}")
+    for name, (legacy, cached) in cases.items():
+        legacy_us = min(timeit.repeat(legacy, number=iterations, repeat=3)) / iterations * 1e6
+        cached_us = min(timeit.repeat(cached, number=iterations, repeat=3)) / iterations * 1e6
+        print(f"{name:<20}{legacy_us:>16.1f}{cached_us:>14.1f}{legacy_us / cached_us:>9.2f}x")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 5000)
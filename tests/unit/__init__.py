@@ -0,0 +1,65 @@
+"""
+Helpers shared by the unit tests.
+"""
+import os
+import tempfile
+import unittest
+from vaultShare.app import create_app
+from vaultShare.db import UserDB
+from vaultShare.db.models import User
+
+
+def log_in(client, username: str = "john", password: str = "Pass1234") -> str:
+    """
+    Signs up `username` and logs in, the client keeps the session cookie.
+
+    Returns:
+        str: Session id of the login
+    """
+    client.post("/signup", data={
+        "username": username, "email": f"{username}@x.io", "password": password
+    })
+    token = client.post("/login", data={
+        "username": username, "password": password
+    }).get_json()["session_id"]
+    client.set_cookie("session_id", token)
+    return token
+
+
+class AppTestCase(unittest.TestCase):
+    """
+    Runs an app on a temporary database and storage directory, with
+    `self.client` logged in as `USERNAME`.
+    """
+    USERNAME = "john"
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.make_app()
+
+    def tearDown(self):
+        self.app.extensions["vaultshare"].close()
+        self.app.extensions["vaultshare"].engine.dispose()
+        self.tmp.cleanup()
+
+    def app_config(self) -> dict:
+        return {
+            "DATABASE_URL": f"sqlite:///{os.path.join(self.tmp.name, 'test.db')}",
+            "FILE_STORAGE_ROOT": os.path.join(self.tmp.name, "storage"),
+        }
+
+    def make_app(self, **config):
+        """Creates `self.app` with `config` over `app_config()` and logs in."""
+        self.app = create_app({**self.app_config(), **config})
+        self.client = self.app.test_client()
+        log_in(self.client, self.USERNAME)
+
+    def make_admin(self):
+        """Makes the logged in user a site admin."""
+        with self.app.app_context():
+            from vaultShare.resources import get_db
+            user_db = get_db(UserDB)
+            user_db._session.query(User).filter_by(username=self.USERNAME).update(
+                {"role": "admin"}
+            )
+            user_db._session.commit()
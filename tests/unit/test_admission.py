@@ -0,0 +1,130 @@
+"""
+Test adaptive admission control of requests.
+"""
+import os
+import tempfile
+import unittest
+from vaultShare.admission import AIMDLimit, AdmissionController, request_lane
+from vaultShare.app import create_app
+from vaultShare.exceptions import ServiceUnavailable
+
+
+class FakeClock:
+    """Manually advanced monotonic clock."""
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestAIMDLimit(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.limit = AIMDLimit(4, 100, target=0.1, clock=self.clock)
+
+    def fill(self) -> list:
+        started = []
+        while True:
+            token = self.limit.acquire()
+            if token is None:
+                return started
+            started.append(token)
+
+    def test_rejects_over_limit(self):
+        self.assertEqual(len(self.fill()), 4)
+        self.assertIsNone(self.limit.acquire())
+
+    def test_fast_requests_raise_limit(self):
+        for _ in range(20):
+            for started in self.fill():
+                self.clock.now += 0.01
+                self.limit.release(started)
+        self.assertGreater(self.limit.limit, 8)
+
+    def test_slow_burst_cuts_once(self):
+        started = self.fill()
+        self.clock.now += 1.0
+        for token in started:
+            self.limit.release(token)
+        self.assertAlmostEqual(self.limit.limit, 3.6)
+        # Failures count as slow
+        token = self.limit.acquire()
+        self.limit.release(token, failed=True)
+        self.assertAlmostEqual(self.limit.limit, 3.24)
+
+    def test_converges_under_overload(self):
+        # Latency grows with concurrency, 20ms per request in flight
+        for _ in range(500):
+            started = self.fill()
+            self.clock.now += 0.02 * len(started)
+            for token in started:
+                self.limit.release(token)
+        # Settles around the 5 requests meeting the 100ms target
+        self.assertIn(int(self.limit.limit), range(3, 7))
+
+    def test_fixed_limit(self):
+        limit = AIMDLimit(2, 2, target=None, clock=self.clock)
+        token = limit.acquire()
+        self.clock.now += 60
+        limit.release(token)
+        self.assertEqual(limit.limit, 2)
+
+
+class TestAdmissionController(unittest.TestCase):
+    def test_lanes(self):
+        controller = AdmissionController({"auth": (1, 4, 0.5), "read": (2, 4, 0.1)},
+                                         retry_after=3)
+        token = controller.admit("auth")
+        with self.assertRaises(ServiceUnavailable) as e:
+            controller.admit("auth")
+        self.assertEqual(e.exception.retry_after, 3)
+        # Other lanes and the health lane are unaffected
+        self.assertIsNotNone(controller.admit("read"))
+        self.assertIsNone(controller.admit("health"))
+        controller.release(token)
+        self.assertIsNotNone(controller.admit("auth"))
+        self.assertEqual(controller.stats()["auth"]["rejected"], 1)
+
+    def test_request_lane(self):
+        self.assertEqual(request_lane("main.status", "GET", {}), "health")
+        self.assertEqual(request_lane("main.login", "POST", {}), "auth")
+        self.assertEqual(request_lane("workspaces.workspace_changes", "GET", {"wait": "30"}),
+                         "poll")
+        self.assertEqual(request_lane("workspaces.workspace_changes", "GET", {}), "read")
+        self.assertEqual(request_lane(None, "DELETE", {}), "write")
+
+
+class TestAdmissionRoutes(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.app = create_app({
+            "DATABASE_URL": f"sqlite:///{os.path.join(self.tmp.name, 'test.db')}",
+            "FILE_STORAGE_ROOT": os.path.join(self.tmp.name, "storage"),
+            "ADMISSION_LANES": {"auth": (1, 1, None), "read": (8, 8, None)},
+            "ADMISSION_RETRY_AFTER": 2,
+        })
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        self.app.extensions["vaultshare"].close()
+        self.app.extensions["vaultshare"].engine.dispose()
+        self.tmp.cleanup()
+
+    def test_shed_saturated_lane(self):
+        from vaultShare.app import _admission
+        with self.app.app_context():
+            controller = _admission()
+        # A login holds the only auth slot
+        controller.lanes["auth"].acquire()
+        response = self.client.post("/login", data={"username": "john", "password": "x"})
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.headers["Retry-After"], "2")
+        self.assertEqual(self.client.get("/status").status_code, 200)
+        self.assertEqual(self.client.get("/users/nobody").status_code, 400)
+        # Finished requests hand their slot back
+        self.assertEqual(controller.lanes["read"].in_flight, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
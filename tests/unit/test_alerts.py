@@ -0,0 +1,101 @@
+"""
+Test alert feed, unread counters and the notification broker.
+"""
+import threading
+import unittest
+from vaultShare.db import AlertDB
+from vaultShare.db.models import User
+from vaultShare.notifications import Broker
+from tests.unit import AppTestCase
+
+
+class TestAlertDB(unittest.TestCase):
+    """Test AlertDB class."""
+    def setUp(self):
+        self.db = AlertDB(database_url="sqlite:///:memory:", echo=False)
+        for user_id in ("user-1", "user-2"):
+            self.db.create(User, id=user_id, username=user_id, email=f"{user_id}@x.io",
+                           hashed_password=b"x")
+        for i in range(5):
+            self.db.add_alert(
+                id=f"alert-{i}", alert_type="invite",
+                user_id="user-1", message=f"message {i}"
+            )
+
+    def test_unread_counter(self):
+        """Test unread counter follows inserts without counting rows."""
+        self.assertEqual(self.db.unread_count("user-1"), 5)
+        self.assertEqual(self.db.unread_count("user-2"), 0)
+
+    def test_feed_pagination(self):
+        """Test keyset pages cover every alert exactly once."""
+        seen = []
+        cursor = None
+        while True:
+            alerts, cursor = self.db.find_alerts("user-1", limit=2, cursor=cursor)
+            seen.extend(alert.id for alert in alerts)
+            if cursor is None:
+                break
+        self.assertEqual(sorted(seen), [f"alert-{i}" for i in range(5)])
+        self.assertEqual(len(seen), len(set(seen)))
+
+    def test_mark_read(self):
+        """Test bulk mark as read keeps the counter in step."""
+        self.assertEqual(self.db.mark_read("user-1", ["alert-0", "alert-1"]), 2)
+        self.assertEqual(self.db.mark_read("user-1", ["alert-0"]), 0)
+        self.assertEqual(self.db.unread_count("user-1"), 3)
+
+        alerts, _ = self.db.find_alerts("user-1", unread_only=True)
+        self.assertEqual(len(alerts), 3)
+
+        self.assertEqual(self.db.mark_read("user-1"), 3)
+        self.assertEqual(self.db.unread_count("user-1"), 0)
+
+    def test_invalid_cursor(self):
+        with self.assertRaises(ValueError):
+            self.db.find_alerts("user-1", cursor="not-a-date_id")
+
+
+class TestAlertRoutes(AppTestCase):
+    """Test the alert feed route."""
+    def test_invalid_cursor(self):
+        self.assertEqual(self.client.get("/alerts/").status_code, 200)
+        response = self.client.get("/alerts/?cursor=garbage")
+        self.assertEqual(response.status_code, 422)
+        self.assertIn("Invalid cursor", response.get_json()["error"])
+
+    def test_invalid_ids(self):
+        for ids in ("alert-0", [1, 2], {"id": "alert-0"}):
+            response = self.client.put("/alerts/read", json={"ids": ids})
+            self.assertEqual(response.status_code, 422, ids)
+        response = self.client.put("/alerts/read", json={"ids": []})
+        self.assertEqual(response.get_json(), {"updated": 0, "unread": 0})
+
+
+class TestBroker(unittest.TestCase):
+    """Test in-process pub/sub broker."""
+    def test_wait_timeout(self):
+        broker = Broker()
+        version, messages, complete = broker.wait("topic", 0, timeout=0.01)
+        self.assertEqual((version, messages, complete), (0, [], True))
+
+    def test_wait_wakes_on_publish(self):
+        """Test a waiting subscriber is woken by a publish."""
+        broker = Broker()
+        timer = threading.Timer(0.05, broker.publish, args=("topic", {"unread": 1}))
+        timer.start()
+        version, messages, complete = broker.wait("topic", 0, timeout=5)
+        timer.join()
+        self.assertEqual(version, 1)
+        self.assertEqual(messages, [{"unread": 1}])
+        self.assertTrue(complete)
+
+    def test_history_overflow(self):
+        """Test subscribers are told when messages fell out of the history."""
+        broker = Broker(history=2)
+        for i in range(5):
+            broker.publish("topic", i)
+        version, messages, complete = broker.wait("topic", 1, timeout=0)
+        self.assertEqual(messages, [3, 4])
+        self.assertFalse(complete)
+        self.assertTrue(broker.wait("topic", 3, timeout=0)[2])
@@ -0,0 +1,93 @@
+"""
+Test the app factory and import time budget.
+"""
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import unittest
+from vaultShare.app import create_app
+from tests.unit import log_in
+
+PACKAGE_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Cumulative import time of vaultShare.app, Flask and SQLAlchemy included
+IMPORT_BUDGET_US = 2_000_000
+# Self import time of the vaultShare modules alone
+OWN_IMPORT_BUDGET_US = 150_000
+
+
+class TestImportTime(unittest.TestCase):
+    """Test importing the app is cheap and side-effect free."""
+    def test_import_budget(self):
+        with tempfile.TemporaryDirectory() as cwd:
+            env = dict(os.environ, PYTHONPATH=PACKAGE_ROOT)
+            result = subprocess.run(
+                [sys.executable, "-X", "importtime", "-c", "import vaultShare.app"],
+                cwd=cwd, env=env, capture_output=True, text=True
+            )
+            self.assertEqual(result.returncode, 0, result.stderr)
+            self.assertEqual(os.listdir(cwd), [], "import must not create a database")
+
+        own, total = 0, None
+        for line in result.stderr.splitlines():
+            if not line.startswith("import time:") or "|" not in line:
+                continue
+            self_us, cumulative_us, name = line[len("import time:"):].split("|")
+            if not self_us.strip().isdigit():
+                continue
+            if name.strip().startswith("vaultShare"):
+                own += int(self_us)
+            if name.strip() == "vaultShare.app":
+                total = int(cumulative_us)
+        self.assertIsNotNone(total)
+        self.assertLess(total, IMPORT_BUDGET_US)
+        self.assertLess(own, OWN_IMPORT_BUDGET_US)
+
+
+class TestCreateApp(unittest.TestCase):
+    """Test create_app initializes resources lazily."""
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.tmp.name, "test.db")
+        self.app = create_app({"DATABASE_URL": f"sqlite:///{self.db_path}"})
+        self.resources = self.app.extensions["vaultshare"]
+
+    def tearDown(self):
+        self.resources.close()
+        if self.resources._router is not None:
+            self.resources._router.dispose()
+        self.tmp.cleanup()
+
+    def test_no_engine_until_needed(self):
+        client = self.app.test_client()
+        self.assertEqual(client.get("/status").status_code, 200)
+        self.assertIsNone(self.resources._router)
+        self.assertFalse(os.path.exists(self.db_path))
+
+        client.get("/users/")
+        self.assertIsNotNone(self.resources._router)
+        self.assertTrue(os.path.exists(self.db_path))
+
+    def test_close_stops_threads(self):
+        running = set(threading.enumerate())
+        log_in(self.app.test_client())
+        with self.app.app_context():
+            from vaultShare.resources import get_scrubbers
+            get_scrubbers()[0].start()
+        names = {"vaultshare-sessions", "vaultshare-audit", "vaultshare-scrubber"}
+        threads = [t for t in set(threading.enumerate()) - running if t.name in names]
+        self.assertEqual({t.name for t in threads}, names)
+        self.resources.close()
+        self.assertFalse(any(t.is_alive() for t in threads))
+
+    def test_apps_are_isolated(self):
+        """Test each app gets its own resources and config."""
+        other = create_app({"DATABASE_URL": "sqlite:///:memory:"})
+        self.assertIsNot(other.extensions["vaultshare"], self.resources)
+        self.assertEqual(other.config["DATABASE_URL"], "sqlite:///:memory:")
+
+    def test_signed_sessions_need_secret_key(self):
+        with self.assertRaises(ValueError):
+            create_app({"SESSION_MODE": "signed", "SECRET_KEY": None})
+        create_app({"SESSION_MODE": "signed", "SECRET_KEY": "test-secret"})
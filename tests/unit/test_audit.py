@@ -0,0 +1,133 @@
+"""
+Test the group-committed audit log.
+"""
+import os
+import tempfile
+import threading
+import unittest
+from datetime import datetime, timedelta
+from sqlalchemy import event
+from vaultShare.audit import AuditLog
+from vaultShare.db import AuditDB
+from tests.unit import AppTestCase
+
+
+class AuditTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        url = f"sqlite:///{os.path.join(self.tmp.name, 'test.db')}"
+        self.audit_db = AuditDB(database_url=url, echo=False)
+        self.commits = 0
+
+        @event.listens_for(self.audit_db._engine, "commit")
+        def count(conn):
+            self.commits += 1
+
+    def tearDown(self):
+        self.audit_db.close_session()
+        self.audit_db._engine.dispose()
+        self.tmp.cleanup()
+
+    def events(self, **filters):
+        self.audit_db.close_session()
+        return self.audit_db.find_events(limit=1000, **filters)[0]
+
+
+class TestAuditLog(AuditTestCase):
+    def test_group_commit(self):
+        audit_log = AuditLog(self.audit_db, batch_size=50, flush_interval=5)
+        for i in range(120):
+            audit_log.record("login", user_id=f"u{i}", ip="10.0.0.1", detail={"i": i})
+        audit_log.start()
+        audit_log.stop()
+        events = self.events()
+        self.assertEqual(len(events), 120)
+        # 50 + 50 + 20, one transaction per batch
+        self.assertEqual(self.commits, 3)
+        self.assertEqual(AuditDB.to_dict(events[7])["detail"], {"i": 7})
+        self.assertEqual(len(audit_log), 0)
+
+    def test_flush_interval(self):
+        audit_log = AuditLog(self.audit_db, batch_size=500, flush_interval=0.05)
+        audit_log.start()
+        written = threading.Event()
+
+        @event.listens_for(self.audit_db._engine, "commit")
+        def done(conn):
+            written.set()
+        audit_log.record("signup", user_id="u1")
+        # Written before the batch filled up
+        self.assertTrue(written.wait(5))
+        audit_log.stop()
+        self.assertEqual(len(self.events()), 1)
+
+    def test_backpressure(self):
+        audit_log = AuditLog(self.audit_db, max_queue=3, block_timeout=0.01)
+        results = [audit_log.record("login", user_id="u1") for _ in range(5)]
+        self.assertEqual(results, [True] * 3 + [False] * 2)
+        self.assertEqual(audit_log.dropped, 2)
+        # The writer was never started, stopping writes the queue
+        audit_log.stop()
+        self.assertEqual(len(self.events()), 3)
+
+
+class TestFindEvents(AuditTestCase):
+    def setUp(self):
+        super().setUp()
+        self.start = datetime(2024, 5, 1)
+        self.audit_db.add_events([
+            {"created_at": self.start + timedelta(minutes=i), "event_type": event_type,
+             "user_id": user_id, "workspace_id": None, "ip": None, "detail": None}
+            for i, (event_type, user_id) in enumerate(
+                [("login", "u1"), ("logout", "u1"), ("login", "u2"), ("file_updated", "u1"),
+                 ("login", "u1")]
+            )
+        ])
+
+    def test_filters(self):
+        events = self.events(user_id="u1", event_type="login")
+        self.assertEqual([e.created_at.minute for e in events], [0, 4])
+        events = self.events(since=self.start + timedelta(minutes=1),
+                             until=self.start + timedelta(minutes=3))
+        self.assertEqual([e.event_type for e in events], ["logout", "login"])
+
+    def test_pages(self):
+        seen, cursor = [], None
+        while True:
+            events, cursor = self.audit_db.find_events(cursor=cursor, limit=2)
+            seen.extend(e.id for e in events)
+            if cursor is None:
+                break
+        self.assertEqual(seen, [1, 2, 3, 4, 5])
+        with self.assertRaises(ValueError):
+            self.audit_db.find_events(cursor="nope")
+
+
+class TestAuditRoutes(AppTestCase):
+    def test_account_events(self):
+        self.app.test_client().post("/login", data={"username": "john", "password": "wrong"})
+        # Only site admins read the log
+        self.assertEqual(self.client.get("/audit/").status_code, 403)
+
+        with self.app.app_context():
+            from vaultShare.resources import get_audit_log
+            get_audit_log().stop()
+        self.make_admin()
+        response = self.client.get("/audit/?since=2000-01-01T00:00:00%2B02:00")
+        self.assertEqual(response.status_code, 200)
+        events = response.get_json()["events"]
+        self.assertEqual([e["event_type"] for e in events], ["signup", "login", "login_failed"])
+        self.assertEqual(events[2]["detail"], {"account": "john"})
+        self.assertEqual(events[1]["ip"], "127.0.0.1")
+        self.assertEqual(self.client.get("/audit/?since=yesterday").status_code, 422)
+        self.assertEqual(self.client.get("/audit/?cursor=garbage").status_code, 422)
+
+
+class TestAuditRoutesSigned(TestAuditRoutes):
+    """Signed sessions carry no role, admins are looked up."""
+    def app_config(self):
+        return {**super().app_config(), "SESSION_MODE": "signed", "SECRET_KEY": "test"}
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,74 @@
+"""
+Test the workspace authorization cache.
+"""
+import os
+import tempfile
+import unittest
+from vaultShare.auth.authz import Membership, MembershipCache
+from vaultShare.db import WorkspaceDB, WorkspaceUserDB
+from vaultShare.db.models import User, Workspace
+
+
+class TestMembershipCache(unittest.TestCase):
+    """Test MembershipCache invalidation."""
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        url = f"sqlite:///{os.path.join(self.tmp.name, 'test.db')}"
+        self.db = WorkspaceUserDB(database_url=url, echo=False)
+        self.db._session.add_all([
+            User(id="u1", username="u1", email="u1@x.io", hashed_password="x"),
+            User(id="u2", username="u2", email="u2@x.io", hashed_password="x"),
+            Workspace(id="ws1", name="design", admin_id="u1", total_memory=10.0),
+        ])
+        self.db._session.commit()
+
+        self.loads = 0
+        self.workspace_db = workspace_db = WorkspaceDB(database_url=url, echo=False)
+
+        def loader(user_id):
+            self.loads += 1
+            return {
+                workspace_id: Membership(*membership)
+                for workspace_id, membership in workspace_db.find_memberships(user_id).items()
+            }
+        self.cache = MembershipCache(loader)
+
+    def tearDown(self):
+        self.db.close_session()
+        self.workspace_db.close_session()
+        self.db._engine.dispose()
+        self.workspace_db._engine.dispose()
+        self.tmp.cleanup()
+
+    def test_admin_membership(self):
+        self.assertEqual(self.cache.get("u1", "ws1"), Membership("admin", 10.0))
+        self.assertIsNone(self.cache.get("u2", "ws1"))
+
+    def test_admin_wins_over_membership_row(self):
+        """Test the workspace admin keeps the admin role with a "user" row."""
+        self.db.add_member(id="wu1", workspace_id="ws1", user_id="u1", memory_allocated=2.0)
+        self.assertEqual(self.workspace_db.find_memberships("u1"), {"ws1": ("admin", 10.0)})
+
+    def test_hits_do_not_reload(self):
+        for _ in range(5):
+            self.cache.get("u1", "ws1")
+        self.assertEqual(self.loads, 1)
+
+    def test_insert_and_update_invalidate(self):
+        """Test committed membership writes reload only the touched user."""
+        self.cache.get("u1", "ws1")
+        self.assertIsNone(self.cache.get("u2", "ws1"))
+
+        self.db.add_member(id="wu1", workspace_id="ws1", user_id="u2", memory_allocated=2.0)
+        self.assertEqual(self.cache.get("u2", "ws1"), Membership("user", 2.0))
+        self.cache.get("u1", "ws1")
+        self.assertEqual(self.loads, 3)
+
+        self.db.update_member({"id": "wu1"}, role="editor")
+        self.assertEqual(self.cache.get("u2", "ws1").role, "editor")
+
+    def test_bulk_delete_invalidates(self):
+        self.db.add_member(id="wu1", workspace_id="ws1", user_id="u2")
+        self.assertIsNotNone(self.cache.get("u2", "ws1"))
+        self.db.remove_member(workspace_id="ws1")
+        self.assertIsNone(self.cache.get("u2", "ws1"))
@@ -0,0 +1,159 @@
+"""
+Test the workspace change log, its compaction and the changes route.
+"""
+import os
+import tempfile
+import threading
+import time
+import unittest
+from vaultShare.db import FolderDB, FileDB, WorkspaceChangeDB
+from vaultShare.db.db import compactor
+from vaultShare.db.models import User, Workspace, WorkspaceUser
+from vaultShare.notifications import broker, dispatcher
+from tests.unit import AppTestCase
+
+
+class TestWorkspaceChangeDB(unittest.TestCase):
+    """Test changes recorded by FolderDB and FileDB."""
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        url = f"sqlite:///{os.path.join(self.tmp.name, 'test.db')}"
+        self.folder_db = FolderDB(database_url=url, echo=False)
+        self.file_db = FileDB(engine=self.folder_db._engine)
+        self.change_db = WorkspaceChangeDB(engine=self.folder_db._engine)
+        session = self.folder_db._session
+        session.add(User(id="admin", username="admin", email="a@x.io", hashed_password=b"x"))
+        session.add_all([
+            Workspace(id=workspace_id, name=workspace_id, admin_id="admin")
+            for workspace_id in ("ws", "ws-2")
+        ])
+        session.commit()
+
+    def tearDown(self):
+        for db in (self.folder_db, self.file_db, self.change_db):
+            db.close_session()
+        self.folder_db._engine.dispose()
+        self.tmp.cleanup()
+
+    def _ops(self, workspace_id="ws", since=0):
+        page = self.change_db.find_changes(workspace_id, since, limit=100)
+        return [(c["seq"], c["entity_id"], c["op"]) for c in page["changes"]]
+
+    def test_changes_recorded_in_order(self):
+        self.folder_db.add_folder("d1", "docs", "ws", is_root=True)
+        self.folder_db.add_folder("d2", "archive", "ws", is_root=True)
+        self.file_db.add_file("f1", "a.txt", "a", "ws", 0.1, folder_id="d1")
+        self.file_db.add_file("g1", "b.txt", "b", "ws-2", 0.1)
+        self.assertEqual(self.file_db.update_file({"id": "f1"}, name="b.txt"), 1)
+        self.assertEqual(self.file_db.update_file({"id": "f1"}, folder_id="d2"), 1)
+        self.assertEqual(self.file_db.remove_file(id="f1"), 1)
+        self.assertEqual(self.folder_db.remove_folder(workspace_id="ws"), 2)
+
+        ops = self._ops()
+        self.assertEqual([seq for seq, _, _ in ops], list(range(1, 9)))
+        self.assertEqual([op for _, _, op in ops], [
+            "create", "create", "create", "update", "move", "delete", "delete", "delete"
+        ])
+        self.assertEqual(self._ops("ws-2"), [(1, "g1", "create")])
+        self.assertEqual(self._ops(since=6), ops[6:])
+        moved = self.change_db.find_changes("ws", 4, 1)
+        self.assertEqual(moved["changes"][0]["parent_id"], "d2")
+        self.assertEqual(moved["changes"][0]["name"], "b.txt")
+        self.assertTrue(moved["has_more"])
+        self.assertEqual(moved["next"], 5)
+
+    def test_no_change_without_rows(self):
+        self.assertEqual(self.file_db.update_file({"id": "nope"}, name="x"), 0)
+        self.assertEqual(self.file_db.remove_file(id="nope"), 0)
+        self.assertEqual(self.change_db.latest_seq("ws"), 0)
+
+    def test_failed_update_records_nothing(self):
+        self.file_db.add_file("f1", "a.txt", "a", "ws", 0.1)
+
+        def replace(path):
+            raise OSError("disk full")
+        with self.assertRaises(OSError):
+            self.file_db.update_file_content("f1", 0.2, replace)
+        self.assertEqual(self._ops(), [(1, "f1", "create")])
+
+    def test_compaction(self):
+        """Test superseded changes are dropped, the latest per entity kept."""
+        self.file_db.add_file("f1", "a.txt", "a", "ws", 0.1)
+        self.file_db.add_file("f2", "b.txt", "b", "ws", 0.1)
+        for i in range(5):
+            self.file_db.update_file({"id": "f1"}, name=f"a{i}.txt")
+        self.file_db.remove_file(id="f2")
+
+        self.assertEqual(self.change_db.compact_changes("ws", keep=0, tombstone_ttl=3600), 6)
+        self.assertEqual(self._ops(), [(7, "f1", "update"), (8, "f2", "delete")])
+        self.assertFalse(self.change_db.find_changes("ws", 0)["resync"])
+
+        # Expired tombstones go too, clients behind them must resync
+        self.change_db.compact_changes("ws", keep=0, tombstone_ttl=-1)
+        self.assertEqual(self._ops(), [(7, "f1", "update")])
+        self.assertTrue(self.change_db.find_changes("ws", 7)["resync"])
+        self.assertFalse(self.change_db.find_changes("ws", 8)["resync"])
+
+    def test_compaction_in_background(self):
+        every = WorkspaceChangeDB.COMPACT_EVERY, WorkspaceChangeDB.KEEP
+        WorkspaceChangeDB.COMPACT_EVERY, WorkspaceChangeDB.KEEP = 4, 0
+        # A busy notification worker does not hold the compaction up
+        busy = threading.Event()
+        dispatcher.submit(busy.wait, 5)
+        try:
+            self.file_db.add_file("f1", "a.txt", "a", "ws", 0.1)
+            for i in range(3):
+                self.file_db.update_file({"id": "f1"}, name=f"a{i}.txt")
+            compactor.submit(lambda: None).result()
+            self.assertEqual(self._ops(), [(4, "f1", "update")])
+        finally:
+            busy.set()
+            WorkspaceChangeDB.COMPACT_EVERY, WorkspaceChangeDB.KEEP = every
+
+    def test_changes_published(self):
+        topic = WorkspaceChangeDB.topic("ws")
+        version = broker.version(topic)
+        self.folder_db.add_folder("d1", "docs", "ws", is_root=True)
+        _, messages, _ = broker.wait(topic, version, timeout=0)
+        self.assertEqual(messages, [{"seq": 1}])
+
+
+class TestChangesRoute(AppTestCase):
+    """Test the changes route and its long-poll."""
+    def setUp(self):
+        super().setUp()
+        with self.app.app_context():
+            from vaultShare.resources import get_db
+            self.folder_db = get_db(FolderDB)
+            user_id = self.folder_db._session.query(User.id).scalar()
+            self.folder_db._session.add_all([
+                Workspace(id="ws-route", name="design", admin_id=user_id),
+                WorkspaceUser(id="wu", workspace_id="ws-route", user_id=user_id, role="user"),
+            ])
+            self.folder_db._session.commit()
+            self.folder_db.add_folder("d1", "docs", "ws-route", is_root=True)
+
+    def test_page(self):
+        page = self.client.get("/workspaces/ws-route/changes?since=0").get_json()
+        self.assertEqual(page["next"], 1)
+        self.assertEqual(page["changes"][0]["op"], "create")
+        page = self.client.get("/workspaces/ws-route/changes?since=1").get_json()
+        self.assertEqual(page["changes"], [])
+
+    def test_long_poll(self):
+        """Test an empty page waits and returns the change once recorded."""
+        def later():
+            time.sleep(0.2)
+            self.folder_db.add_folder("d2", "music", "ws-route", is_root=True)
+            self.folder_db.close_session()
+        writer = threading.Thread(target=later)
+        writer.start()
+        started = time.monotonic()
+        page = self.client.get("/workspaces/ws-route/changes?since=1&wait=10").get_json()
+        writer.join()
+        self.assertLess(time.monotonic() - started, 5)
+        self.assertEqual([c["entity_id"] for c in page["changes"]], ["d2"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,255 @@
+"""
+Test copy on write cloning of workspaces and folders.
+"""
+import io
+import os
+import tempfile
+import unittest
+from sqlalchemy import select
+from vaultShare.db import (
+    FileDB, FolderDB, ShardRouter, UserDB, WorkspaceChangeDB, WorkspaceDB
+)
+from vaultShare.db.models import ContentRef, File, Folder, User, Workspace, WorkspaceUser
+from vaultShare.file_mangager import compute_delta, encode_delta
+from tests.unit import AppTestCase
+
+
+class CloneTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        url = f"sqlite:///{os.path.join(self.tmp.name, 'test.db')}"
+        self.workspace_db = WorkspaceDB(database_url=url, echo=False)
+        engine = self.workspace_db._engine
+        self.folder_db = FolderDB(engine=engine)
+        self.file_db = FileDB(engine=engine)
+        self.change_db = WorkspaceChangeDB(engine=engine)
+        self.seed(self.file_db)
+
+    def tearDown(self):
+        for db in (self.workspace_db, self.folder_db, self.file_db, self.change_db):
+            db.close_session()
+        self.workspace_db._engine.dispose()
+        self.tmp.cleanup()
+
+    @staticmethod
+    def seed(file_db, workspace_id="ws"):
+        session = file_db._session
+        if session.get(User, "admin") is None:
+            session.add(User(id="admin", username="admin", email="a@x.io", hashed_password=b"x"))
+        session.add_all([
+            Workspace(id=workspace_id, name="template", admin_id="admin", max_users=9),
+            Folder(id=f"{workspace_id}-root", name="docs", workspace_id=workspace_id,
+                   is_root=True),
+            Folder(id=f"{workspace_id}-sub", name="specs", workspace_id=workspace_id,
+                   parent_folder_id=f"{workspace_id}-root"),
+        ])
+        session.commit()
+        file_db.add_file(f"{workspace_id}-f1", "a.txt", "blobs/a", workspace_id, 1.0,
+                         folder_id=f"{workspace_id}-root", checksum="aa")
+        file_db.add_file(f"{workspace_id}-f2", "b.txt", "blobs/b", workspace_id, 2.0,
+                         folder_id=f"{workspace_id}-sub")
+        file_db.add_file(f"{workspace_id}-f3", "top.txt", "blobs/top", workspace_id, 0.5)
+
+    def tree(self, workspace_id):
+        """Paths of the workspace's files, from the root of their folder tree."""
+        self.file_db.close_session()
+        session = self.file_db._session
+        folders = {f.id: f for f in session.query(Folder).filter_by(workspace_id=workspace_id)}
+
+        def folder_path(folder_id):
+            parts = []
+            while folder_id:
+                parts.append(folders[folder_id].name)
+                folder_id = folders[folder_id].parent_folder_id
+            return "/".join(reversed(parts))
+        return sorted(
+            (folder_path(f.folder_id), f.name, f.path, f.size, f.checksum)
+            for f in session.query(File).filter_by(workspace_id=workspace_id)
+        )
+
+    def refs(self):
+        self.file_db.close_session()
+        return dict(self.file_db._session.execute(select(ContentRef.path, ContentRef.refs)).all())
+
+
+class TestCloneWorkspace(CloneTestCase):
+    def test_clone(self):
+        copied = self.workspace_db.clone_workspace("ws", "copy", "project", "admin")
+        self.assertEqual(copied, {"folders": 2, "files": 3})
+        self.assertEqual(self.tree("copy"), self.tree("ws"))
+        workspace = self.workspace_db.find_workspace(id="copy")
+        self.assertEqual((workspace.name, workspace.max_users), ("project", 9))
+        # Content is shared, not copied
+        self.assertEqual(self.refs(), {"blobs/a": 2, "blobs/b": 2, "blobs/top": 2})
+        ops = [c["op"] for c in self.change_db.find_changes("copy")["changes"]]
+        self.assertEqual(ops, ["create"] * 5)
+
+    def test_clone_of_clone(self):
+        self.workspace_db.clone_workspace("ws", "copy", "project", "admin")
+        self.workspace_db.clone_workspace("copy", "copy2", "project 2", "admin")
+        self.assertEqual(self.refs(), {"blobs/a": 3, "blobs/b": 3, "blobs/top": 3})
+
+    def test_missing_source(self):
+        from sqlalchemy.exc import NoResultFound
+        with self.assertRaises(NoResultFound):
+            self.workspace_db.clone_workspace("nope", "copy", "project", "admin")
+        self.assertEqual(self.refs(), {})
+
+    def test_copy_on_write(self):
+        self.workspace_db.clone_workspace("ws", "copy", "project", "admin")
+        copy_id = self.file_db._session.scalar(
+            select(File.id).where(File.workspace_id == "copy", File.name == "a.txt")
+        )
+        written = []
+        self.file_db.update_file_content(copy_id, 1.5, written.append, checksum="bb")
+        self.file_db.close_session()
+        copy = self.file_db.find_file(id=copy_id)
+        self.assertEqual(written, [copy.path])
+        self.assertTrue(copy.path.startswith("copy/"))
+        self.assertEqual(self.file_db.find_file(id="ws-f1").path, "blobs/a")
+        self.assertNotIn("blobs/a", self.refs())
+
+        # The original is the only owner left and is written in place
+        self.file_db.update_file_content("ws-f1", 1.5, written.append)
+        self.assertEqual(written[-1], "blobs/a")
+
+    def test_remove_releases_content(self):
+        self.workspace_db.clone_workspace("ws", "copy", "project", "admin")
+        self.file_db.remove_file(workspace_id="copy")
+        self.assertEqual(self.refs(), {})
+
+    def test_remove_admin_releases_content(self):
+        user_db = UserDB(engine=self.workspace_db._engine)
+        user_db._session.add(User(id="bob", username="bob", email="b@x.io",
+                                  hashed_password=b"x"))
+        user_db._session.commit()
+        self.workspace_db.clone_workspace("ws", "copy", "project", "bob")
+        self.assertEqual(user_db.remove_user(id="bob"), 1)
+        self.assertEqual(self.refs(), {})
+        self.assertEqual(self.tree("copy"), [])
+        user_db.close_session()
+
+    def test_remove_folder_releases_content(self):
+        self.workspace_db.clone_workspace("ws", "copy", "project", "admin")
+        root_id = self.folder_db._session.scalar(
+            select(Folder.id).where(Folder.workspace_id == "copy", Folder.is_root)
+        )
+        self.assertEqual(self.folder_db.remove_folder(id=root_id), 2)
+        self.assertEqual(self.refs(), {"blobs/top": 2})
+        self.assertEqual([path for _, _, path, *_ in self.tree("copy")], ["blobs/top"])
+        changes = self.change_db.find_changes("copy", 5)["changes"]
+        self.assertEqual(sorted((c["entity_type"], c["op"]) for c in changes),
+                         [("file", "delete")] * 2 + [("folder", "delete")] * 2)
+
+
+class TestCloneFolder(CloneTestCase):
+    def test_clone_in_place(self):
+        copied = self.folder_db.clone_folder("ws", "ws-root", name="docs 2")
+        self.assertEqual((copied["folders"], copied["files"]), (2, 2))
+        tree = self.tree("ws")
+        self.assertIn(("docs 2/specs", "b.txt", "blobs/b", 2.0, None), tree)
+        self.assertEqual(self.refs(), {"blobs/a": 2, "blobs/b": 2})
+
+    def test_clone_into_own_subtree(self):
+        copied = self.folder_db.clone_folder("ws", "ws-root", parent_folder_id="ws-sub")
+        self.assertEqual((copied["folders"], copied["files"]), (2, 2))
+        paths = [(folder, name) for folder, name, *_ in self.tree("ws")]
+        self.assertIn(("docs/specs/docs/specs", "b.txt"), paths)
+        self.assertEqual(len(paths), 5)
+        self.assertFalse(self.folder_db.find_folder(id=copied["id"]).is_root)
+
+    def test_missing_folder(self):
+        from sqlalchemy.exc import NoResultFound
+        for folder_id, parent_id in (("nope", None), ("ws-root", "nope")):
+            with self.assertRaises(NoResultFound):
+                self.folder_db.clone_folder("ws", folder_id, parent_id)
+
+
+class TestCloneAcrossShards(unittest.TestCase):
+    def test_clone(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            router = ShardRouter(f"sqlite:///{tmp}/primary.db",
+                                 [f"sqlite:///{tmp}/shard{i}.db" for i in range(2)])
+            source = "ws"
+            target = next(f"copy-{i}" for i in range(100)
+                          if router.shard_for(f"copy-{i}") != router.shard_for(source))
+            CloneTestCase.seed(router.db(FileDB, source), source)
+            copied = router.db(WorkspaceDB, target).clone_workspace(
+                source, target, "project", "admin", source_path=router.database_path(source)
+            )
+            self.assertEqual(copied, {"folders": 2, "files": 3})
+            file_db = router.db(FileDB, target)
+            names = sorted(f.name for f in file_db._session.query(File))
+            self.assertEqual(names, ["a.txt", "b.txt", "top.txt"])
+            with router.primary.connect() as conn:
+                self.assertEqual(conn.scalar(select(ContentRef.refs).where(
+                    ContentRef.path == "blobs/a"
+                )), 2)
+            router.close_sessions()
+            router.dispose()
+
+
+class TestCloneRoutes(AppTestCase):
+    """Test the clone routes and copy on write of delta updates."""
+    CONTENT = os.urandom(50_000)
+
+    def setUp(self):
+        super().setUp()
+        with self.app.app_context():
+            from vaultShare.resources import get_db, get_storage
+            get_storage().put("ws/f1", io.BytesIO(self.CONTENT))
+            file_db = get_db(FileDB, "ws")
+            user_id = file_db._session.query(User.id).scalar()
+            file_db._session.add_all([
+                Workspace(id="ws", name="template", admin_id=user_id),
+                WorkspaceUser(id="wu", workspace_id="ws", user_id=user_id, role="user"),
+                Folder(id="d1", name="docs", workspace_id="ws"),
+            ])
+            file_db._session.commit()
+            file_db.add_file("f1", "report.bin", "ws/f1", "ws", len(self.CONTENT) / 2**20,
+                             folder_id="d1")
+
+    def download(self, workspace_id, file_id):
+        response = self.client.get(f"/workspaces/{workspace_id}/files/{file_id}/download")
+        data = response.get_data()
+        response.close()
+        return data
+
+    def test_clone_and_modify(self):
+        response = self.client.post("/workspaces/ws/clone", json={"name": "project"})
+        self.assertEqual(response.status_code, 201)
+        body = response.get_json()
+        self.assertEqual((body["folders"], body["files"]), (1, 1))
+        copy_id = body["workspace_id"]
+        with self.app.app_context():
+            from vaultShare.resources import get_db
+            copy_file = get_db(FileDB, copy_id).find_file(workspace_id=copy_id).id
+        # The new admin is authorized right away
+        self.assertEqual(self.download(copy_id, copy_file), self.CONTENT)
+
+        signature = self.client.get(f"/workspaces/{copy_id}/files/{copy_file}/signature")
+        signature = signature.get_json()
+        new = self.CONTENT + b"appended"
+        body = b"".join(encode_delta({
+            "version": signature["version"], "block_size": signature["block_size"],
+            "size": len(new)
+        }, list(compute_delta(signature, io.BytesIO(new)))))
+        response = self.client.patch(f"/workspaces/{copy_id}/files/{copy_file}/delta", data=body)
+        self.assertEqual(response.status_code, 200, response.get_json())
+        self.assertEqual(self.download(copy_id, copy_file), new)
+        self.assertEqual(self.download("ws", "f1"), self.CONTENT)
+
+    def test_clone_folder(self):
+        response = self.client.post("/workspaces/ws/folders/d1/clone", data={"name": "docs 2"})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.get_json()["files"], 1)
+        self.assertEqual(
+            self.client.post("/workspaces/ws/folders/nope/clone").status_code, 404
+        )
+
+    def test_clone_needs_name(self):
+        self.assertEqual(self.client.post("/workspaces/ws/clone").status_code, 402)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,171 @@
+"""
+Test transparent compression of stored files.
+"""
+import io
+import random
+import tempfile
+import unittest
+from parameterized import parameterized
+from vaultShare.db import FileDB
+from vaultShare.db.models import User, Workspace, WorkspaceUser, File
+from vaultShare.file_mangager import (
+    CompressedStorage, LocalStorage, apply_delta, compute_delta, encode_delta,
+    file_signature, read_manifest, sniff_codec
+)
+from vaultShare.file_mangager.compression import MAGIC
+from tests.unit import AppTestCase
+
+FRAME = 16 * 1024
+rng = random.Random(3)
+LOG = b"".join(
+    b"2024-10-30T12:%02d:%02d INFO request path=/workspaces/%d status=200\n"
+    % (i // 60 % 60, i % 60, rng.randrange(1000))
+    for i in range(20_000)
+)
+NOISE = rng.randbytes(100_000)
+
+
+class TestCompressedStorage(unittest.TestCase):
+    """Test CompressedStorage over a local backend."""
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.inner = LocalStorage(self.tmp.name)
+        self.storage = CompressedStorage(self.inner, frame_size=FRAME)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    @parameterized.expand([
+        ("text", LOG, "zlib"),
+        ("random", NOISE, "none"),
+        ("png", b"\x89PNG\r\n\x1a\n" + LOG, "none"),
+        ("small", LOG[:1000], "none"),
+    ])
+    def test_sniff(self, _, content, codec):
+        self.assertEqual(sniff_codec(content), codec)
+
+    def test_text_compressed(self):
+        stat = self.storage.put("app.log", io.BytesIO(LOG))
+        self.assertEqual((stat.size, stat.codec), (len(LOG), "zlib"))
+        self.assertLess(stat.stored_size * 4, stat.size)
+        self.assertEqual(self.inner.stat("app.log").size, stat.stored_size)
+        self.assertEqual(self.storage.stat("app.log"), stat)
+        _, source = self.storage.get("app.log")
+        with source:
+            self.assertEqual(source.read(), LOG)
+        # Compressed objects are never served as they are stored
+        self.assertIsNone(self.storage.local_path("app.log"))
+
+    def test_incompressible_stored_raw(self):
+        stat = self.storage.put("noise", io.BytesIO(NOISE))
+        self.assertEqual((stat.size, stat.stored_size, stat.codec), (len(NOISE),) * 2 + ("none",))
+        self.assertIsNotNone(self.storage.local_path("noise"))
+        with open(self.inner.local_path("noise"), "rb") as f:
+            self.assertEqual(f.read(), NOISE)
+
+    def test_magic_prefixed_content(self):
+        content = MAGIC + NOISE
+        self.storage.put("tricky", io.BytesIO(content))
+        self.assertEqual(self.storage.stat("tricky").size, len(content))
+        self.assertEqual(self.storage.read_range("tricky", 0, len(content)), content)
+
+    @parameterized.expand([
+        ("start", 0, 100),
+        ("frame_boundary", FRAME - 10, 20),
+        ("many_frames", 5000, 3 * FRAME),
+        ("tail", len(LOG) - 50, 100),
+        ("past_end", len(LOG) + 1, 10),
+        ("last_frame_exactly", (len(LOG) // FRAME) * FRAME, FRAME),
+    ])
+    def test_read_range(self, _, offset, length):
+        self.storage.put("app.log", io.BytesIO(LOG))
+        self.assertEqual(self.storage.read_range("app.log", offset, length),
+                         LOG[offset:offset + length])
+
+    def test_seek(self):
+        self.storage.put("app.log", io.BytesIO(LOG))
+        _, source = self.storage.get("app.log")
+        with source:
+            source.seek(3 * FRAME + 7)
+            self.assertEqual(source.read(100), LOG[3 * FRAME + 7:3 * FRAME + 107])
+            source.seek(-10, io.SEEK_END)
+            self.assertEqual(source.read(), LOG[-10:])
+
+    def test_version_pinned(self):
+        old = self.storage.put("app.log", io.BytesIO(LOG))
+        self.storage.put("app.log", io.BytesIO(LOG[::-1]))
+        with self.assertRaises(FileNotFoundError):
+            self.storage.read_range("app.log", 0, 10, version=old.version)
+
+    def test_delta_on_compressed_file(self):
+        self.storage.put("app.log", io.BytesIO(LOG))
+        signature = file_signature(self.storage, "app.log")
+        new = LOG[:200_000] + b"a new line\n" + LOG[200_000:]
+        ops = list(compute_delta(signature, io.BytesIO(new)))
+        stream = io.BytesIO(b"".join(encode_delta({
+            "version": signature["version"], "block_size": signature["block_size"],
+            "size": len(new)
+        }, ops)))
+        stats = apply_delta(self.storage, "app.log", stream, read_manifest(stream))
+        stat = self.storage.put_file("app.log", stats["temp_path"])
+        self.assertEqual(stat.codec, "zlib")
+        self.assertEqual(self.storage.read_range("app.log", 0, len(new)), new)
+
+
+class TestCompressedDownload(AppTestCase):
+    """Test downloads of compressed files, ranges included."""
+    def app_config(self):
+        return {
+            **super().app_config(),
+            "STORAGE_COMPRESSION": True,
+            "COMPRESSION_FRAME_SIZE": FRAME,
+        }
+
+    def setUp(self):
+        super().setUp()
+        with self.app.app_context():
+            from vaultShare.resources import get_db, get_storage
+            stat = get_storage().put("ws/log", io.BytesIO(LOG))
+            file_db = get_db(FileDB)
+            user_id = file_db._session.query(User.id).scalar()
+            file_db._session.add_all([
+                Workspace(id="ws", name="design", admin_id=user_id),
+                WorkspaceUser(id="wu", workspace_id="ws", user_id=user_id, role="user"),
+            ])
+            file_db._session.commit()
+            file_db.add_file("f1", "app.log", "ws/log", "ws", stat.size / 2**20,
+                             stored_size=stat.stored_size / 2**20, codec=stat.codec)
+
+    def test_download(self):
+        response = self.client.get("/workspaces/ws/files/f1/download")
+        self.assertEqual(response.get_data(), LOG)
+        self.assertEqual(response.headers["Content-Length"], str(len(LOG)))
+        response.close()
+
+    def test_range(self):
+        response = self.client.get("/workspaces/ws/files/f1/download",
+                                   headers={"Range": "bytes=100000-100099"})
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response.get_data(), LOG[100_000:100_100])
+        response.close()
+
+    def test_delta_records_stored_size(self):
+        signature = self.client.get("/workspaces/ws/files/f1/signature").get_json()
+        new = LOG + b"appended line\n"
+        ops = list(compute_delta(signature, io.BytesIO(new)))
+        body = b"".join(encode_delta({
+            "version": signature["version"], "block_size": signature["block_size"],
+            "size": len(new)
+        }, ops))
+        response = self.client.patch("/workspaces/ws/files/f1/delta", data=body)
+        self.assertEqual(response.status_code, 200, response.get_json())
+        with self.app.app_context():
+            from vaultShare.resources import get_db
+            file = get_db(FileDB)._session.get(File, "f1")
+            self.assertAlmostEqual(file.size, len(new) / 2**20)
+            self.assertLess(file.stored_size * 4, file.size)
+            self.assertEqual(file.codec, "zlib")
+
+
+if __name__ == "__main__":
+    unittest.main()
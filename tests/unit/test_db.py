@@ -4,9 +4,9 @@ Test database interactions using the DB class.
 import unittest
 from unittest.mock import patch, MagicMock
 from vaultShare.db.models import User
-from vaultShare.db import DB
+from vaultShare.db import DB, statements
 from parameterized import parameterized
-from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.exc import SQLAlchemyError, NoResultFound
 
 class TestDBModule(unittest.TestCase):
     """Test DB class."""
@@ -40,3 +40,35 @@ class TestDBModule(unittest.TestCase):
         # Assert that the session's add and commit methods were called
         mock_session.add.assert_called_once_with(user)
         mock_session.commit.assert_called_once()
+
+
+class TestStatementCache(unittest.TestCase):
+    """Test generic CRUD methods on cached statements."""
+    def setUp(self):
+        self.db = DB(database_url="sqlite:///:memory:", echo=False)
+        for name in ("bob", "john"):
+            self.db.create(User, id=name, username=name, email=f"{name}@x.io",
+                           hashed_password="x", session_id=f"{name}-session")
+
+    def test_statement_reused(self):
+        """Test the same filter shape reuses one statement object."""
+        key = statements.filter_key({"username": "bob"})
+        self.assertIs(
+            statements.select_first(User, key),
+            statements.select_first(User, statements.filter_key({"username": "john"}))
+        )
+
+    def test_retrieve_update_delete(self):
+        self.assertEqual(self.db.retrieve(User, username="john").id, "john")
+        self.assertEqual(self.db.update(User, {"username": "bob"}, role="admin"), 1)
+        self.assertEqual(self.db.retrieve(User, id="bob").role, "admin")
+        self.assertEqual(self.db.delete(User, username="john"), 1)
+        with self.assertRaises(NoResultFound):
+            self.db.retrieve(User, username="john")
+
+    def test_none_values(self):
+        """Test None filters match NULL and None values set NULL, as filter_by does."""
+        self.assertEqual(self.db.update(User, {"username": "bob"}, session_id=None), 1)
+        self.assertEqual(self.db.retrieve(User, session_id=None).id, "bob")
+        self.assertEqual(self.db.delete(User, session_id=None), 1)
+        self.assertEqual(self.db.retrieve(User, session_id="john-session").id, "john")
@@ -33,8 +33,8 @@ EXPECTED_FOLDER_COLUMNS = [
 ]
 EXPECTED_FILE_COLUMNS = [
     "id", "name", "path", "workspace_id",
-    "user_id", "folder_id", "size", "is_directory",
-    "created_at", "updated_at"
+    "user_id", "folder_id", "size", "stored_size", "codec", "checksum",
+    "is_directory", "created_at", "updated_at"
 ]
 EXPECTED_INVITE_COLUMNS = [
     "id", "invite_type", "workspace_id", "inviter_id",
@@ -194,6 +194,9 @@ class TestFileSchema(unittest.TestCase):
         check_column(self, File, "user_id", String)
         check_column(self, File, "folder_id", String)
         check_column(self, File, "size", Float, nullable=False)
+        check_column(self, File, "stored_size", Float)
+        check_column(self, File, "codec", String)
+        check_column(self, File, "checksum", String)
         check_column(self, File, "is_directory", Boolean)
         check_column(self, File, "created_at", DateTime)
         check_column(self, File, "updated_at", DateTime)
@@ -0,0 +1,253 @@
+"""
+Test rsync style delta sync of stored files.
+"""
+import io
+import os
+import random
+import tempfile
+import unittest
+import zlib
+from parameterized import parameterized
+from vaultShare.db import FileDB
+from vaultShare.db.models import User, Workspace, WorkspaceUser, File
+from vaultShare.file_mangager import (
+    LocalStorage, SignatureCache, apply_delta, compute_delta, encode_delta,
+    file_signature, read_manifest
+)
+from vaultShare.file_mangager.delta import _MOD
+from tests.unit import AppTestCase, log_in
+
+OLD = random.Random(7).randbytes(1_000_000)
+
+
+def _edit(data: bytes, kind: str) -> bytes:
+    if kind == "unchanged":
+        return data
+    if kind == "overwrite":
+        return data[:400_000] + b"x" * 100 + data[400_100:]
+    if kind == "insert":
+        return data[:300_000] + b"inserted bytes" + data[300_000:]
+    if kind == "delete":
+        return data[:500_000] + data[520_000:]
+    if kind == "append":
+        return data + b"appended"
+    if kind == "truncate":
+        return data[:123_457]
+    return b"".join(data[i:i + 4096] for i in reversed(range(0, len(data), 4096)))
+
+
+def _delta(signature: dict, new: bytes) -> tuple:
+    ops = list(compute_delta(signature, io.BytesIO(new)))
+    body = b"".join(encode_delta({
+        "version": signature["version"], "block_size": signature["block_size"],
+        "size": len(new)
+    }, ops))
+    return ops, body
+
+
+class TestDelta(unittest.TestCase):
+    """Test signatures, client deltas and server reconstruction."""
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.storage = LocalStorage(self.tmp.name)
+        self.path = os.path.join(self.tmp.name, "file")
+        with open(self.path, "wb") as f:
+            f.write(OLD)
+        self.signature = file_signature(self.storage, "file")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_rolling_checksum_matches_adler32(self):
+        data = OLD[:10_000]
+        n = 2048
+        weak = zlib.adler32(data[:n])
+        for pos in range(1, 200):
+            out_byte, in_byte = data[pos - 1], data[pos - 1 + n]
+            a = ((weak & 0xffff) - out_byte + in_byte) % _MOD
+            b = ((weak >> 16) - n * out_byte + a - 1) % _MOD
+            weak = (b << 16) | a
+            self.assertEqual(weak, zlib.adler32(data[pos:pos + n]))
+
+    @parameterized.expand([
+        ("unchanged",), ("overwrite",), ("insert",), ("delete",),
+        ("append",), ("truncate",), ("reorder",),
+    ])
+    def test_round_trip(self, kind):
+        new = _edit(OLD, kind)
+        ops, body = _delta(self.signature, new)
+        stream = io.BytesIO(body)
+        stats = apply_delta(self.storage, "file", stream, read_manifest(stream))
+        with open(stats["temp_path"], "rb") as f:
+            self.assertEqual(f.read(), new)
+        self.assertEqual(stats["size"], len(new))
+
+    def test_small_edit_sends_little(self):
+        new = _edit(OLD, "insert")
+        _, body = _delta(self.signature, new)
+        self.assertLess(len(body), 3 * self.signature["block_size"])
+
+    @parameterized.expand([
+        ("truncated", lambda body: body[:-1]),
+        ("bad_block", lambda body: body.replace(b"C", b"L", 1)),
+        ("wrong_size", lambda body: body.replace(b'"size": 1000014', b'"size": 1000015')),
+    ])
+    def test_malformed_delta(self, _, corrupt):
+        _, body = _delta(self.signature, _edit(OLD, "insert"))
+        stream = io.BytesIO(corrupt(body))
+        with self.assertRaises(ValueError):
+            apply_delta(self.storage, "file", stream, read_manifest(stream))
+        self.assertEqual(os.listdir(self.storage.temp_dir), [])
+
+    def test_signature_cache(self):
+        cache = SignatureCache()
+        self.assertIs(cache.get(self.storage, "file"), cache.get(self.storage, "file"))
+        with open(self.path, "ab") as f:
+            f.write(b"changed")
+        self.assertEqual(cache.get(self.storage, "file")["size"], len(OLD) + 7)
+
+
+class TestDeltaRoutes(AppTestCase):
+    """Test the signature and delta routes."""
+    def app_config(self):
+        return {**super().app_config(), "FILE_STORAGE_ROOT": self.tmp.name}
+
+    def setUp(self):
+        super().setUp()
+        with open(os.path.join(self.tmp.name, "blob"), "wb") as f:
+            f.write(OLD)
+
+        with self.app.app_context():
+            from vaultShare.resources import get_db
+            file_db = get_db(FileDB)
+            user_id = file_db._session.query(User.id).scalar()
+            file_db._session.add_all([
+                Workspace(id="ws", name="design", admin_id=user_id),
+                WorkspaceUser(id="wu", workspace_id="ws", user_id=user_id, role="user"),
+            ])
+            file_db._session.commit()
+            file_db.add_file("f1", "disk.img", "blob", "ws", len(OLD) / 2**20)
+
+    def test_sync(self):
+        signature = self.client.get("/workspaces/ws/files/f1/signature").get_json()
+        new = _edit(OLD, "overwrite")
+        _, body = _delta(signature, new)
+        response = self.client.patch("/workspaces/ws/files/f1/delta", data=body)
+        self.assertEqual(response.status_code, 200, response.get_json())
+        stats = response.get_json()
+        self.assertLess(stats["literal"], 3 * signature["block_size"])
+        with open(os.path.join(self.tmp.name, "blob"), "rb") as f:
+            self.assertEqual(f.read(), new)
+
+        with self.app.app_context():
+            from vaultShare.resources import get_db
+            file = get_db(FileDB)._session.get(File, "f1")
+            self.assertAlmostEqual(file.size, len(new) / 2**20)
+
+        # The old signature no longer matches the stored version
+        response = self.client.patch("/workspaces/ws/files/f1/delta", data=body)
+        self.assertEqual(response.status_code, 409)
+
+    @parameterized.expand([("manifest",), ("truncated",), ("size",)])
+    def test_malformed_delta(self, kind):
+        signature = self.client.get("/workspaces/ws/files/f1/signature").get_json()
+        new = _edit(OLD, "overwrite")
+        ops, body = _delta(signature, new)
+        if kind == "manifest":
+            body = b"not json\n"
+        elif kind == "truncated":
+            body = body[:-100]
+        else:
+            body = b"".join(encode_delta({
+                "version": signature["version"], "block_size": signature["block_size"],
+                "size": len(new) + 1
+            }, ops))
+        response = self.client.patch("/workspaces/ws/files/f1/delta", data=body)
+        self.assertEqual(response.status_code, 422)
+        self.assertTrue(response.get_json()["error"])
+        # The stored version is untouched
+        with open(os.path.join(self.tmp.name, "blob"), "rb") as f:
+            self.assertEqual(f.read(), OLD)
+
+    def _member_client(self, memory_allocated: float) -> tuple:
+        """Logs in a workspace member, returns the client and user id."""
+        client = self.app.test_client()
+        log_in(client, "mary")
+        with self.app.app_context():
+            from vaultShare.resources import get_db
+            file_db = get_db(FileDB)
+            user_id = file_db._session.query(User.id).filter_by(username="mary").scalar()
+            file_db._session.add(WorkspaceUser(id="wu-mary", workspace_id="ws", user_id=user_id,
+                                               role="user", memory_allocated=memory_allocated))
+            file_db._session.commit()
+        return client, user_id
+
+    def _patch(self, client, edit: str = "append"):
+        signature = client.get("/workspaces/ws/files/f1/signature").get_json()
+        _, body = _delta(signature, _edit(OLD, edit))
+        return client.patch("/workspaces/ws/files/f1/delta", data=body)
+
+    def _set_owner(self, user_id: str):
+        with self.app.app_context():
+            from vaultShare.resources import get_db
+            get_db(FileDB).update_file({"id": "f1"}, user_id=user_id)
+
+    def test_owner_or_admin_only(self):
+        client, user_id = self._member_client(memory_allocated=5.0)
+        self.assertEqual(self._patch(client).status_code, 403)
+        self._set_owner(user_id)
+        self.assertEqual(self._patch(client).status_code, 200)
+        # Workspace admins update any file
+        self.assertEqual(self._patch(self.client, "truncate").status_code, 200)
+
+    def test_memory_accounted(self):
+        self.assertEqual(self._patch(self.client).status_code, 200)
+        with self.app.app_context():
+            from vaultShare.resources import get_db
+            file_db = get_db(FileDB)
+            used = file_db._session.get(Workspace, "ws").memory_used
+            self.assertAlmostEqual(used, len(b"appended") / 2**20)
+
+            file_db._session.get(Workspace, "ws").total_memory = 0.0
+            file_db._session.commit()
+        # Shrinking is always allowed, growing past total_memory is not
+        response = self._patch(self.client, "delete")
+        self.assertEqual(response.status_code, 200)
+        response = self._patch(self.client)
+        self.assertEqual(response.status_code, 409)
+        self.assertIn("out of memory", response.get_json()["error"])
+
+    def test_owner_quota(self):
+        client, user_id = self._member_client(memory_allocated=len(OLD) / 2**20)
+        self._set_owner(user_id)
+        response = self._patch(client)
+        self.assertEqual(response.status_code, 409)
+        self.assertIn("quota", response.get_json()["error"])
+        # The stored version and its size are untouched
+        with open(os.path.join(self.tmp.name, "blob"), "rb") as f:
+            self.assertEqual(f.read(), OLD)
+        self.assertEqual(self._patch(client, "truncate").status_code, 200)
+
+    def test_stale_version_not_replaced(self):
+        """Test content updated by another server since it was read is kept."""
+        with self.app.app_context():
+            from vaultShare.resources import get_db
+            file_db = get_db(FileDB)
+            version = file_db.find_file(id="f1").updated_at
+            self.assertEqual(
+                file_db.update_file_content("f1", 1.0, lambda path: None, updated_at=version), 1
+            )
+            written = []
+            self.assertEqual(
+                file_db.update_file_content("f1", 2.0, written.append, updated_at=version), 0
+            )
+            self.assertEqual(written, [])
+            self.assertEqual(file_db.find_file(id="f1").size, 1.0)
+
+    def test_unknown_file(self):
+        response = self.client.get("/workspaces/ws/files/nope/signature")
+        self.assertEqual(response.status_code, 404)
+
+
+if __name__ == "__main__":
+    unittest.main()
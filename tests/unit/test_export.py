@@ -0,0 +1,186 @@
+"""
+Test the streaming ZIP export of workspaces and folder subtrees.
+"""
+import io
+import os
+import tempfile
+import unittest
+import zipfile
+from vaultShare.db import FolderDB, FileDB
+from vaultShare.db.models import User, Workspace, WorkspaceUser
+from vaultShare.file_mangager import ExportJob, LocalStorage, iter_entries, stream_zip
+from tests.unit import AppTestCase
+
+PNG = b"\x89PNG\r\n\x1a\n" + os.urandom(3000)
+TEXT = b"hello vault share\n" * 5000
+
+
+class TestStreamZip(unittest.TestCase):
+    """Test FolderDB/FileDB subtree walks and the archive generator."""
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = self.tmp.name
+        self.storage = LocalStorage(self.root)
+        self.folder_db = FolderDB(database_url="sqlite:///:memory:", echo=False)
+        self.file_db = FileDB(engine=self.folder_db._engine)
+        session = self.folder_db._session
+        session.add(User(id="john", username="john", email="j@x.io", hashed_password=b"x"))
+        session.add_all([
+            Workspace(id=workspace_id, name=workspace_id, admin_id="john")
+            for workspace_id in ("ws", "ws-2")
+        ])
+        session.commit()
+        self.folder_db.add_folder("f-root", "john", "ws", is_root=True)
+        self.folder_db.add_folder("f-docs", "docs", "ws", parent_folder_id="f-root")
+        self.folder_db.add_folder("f-empty", "empty", "ws", parent_folder_id="f-docs")
+        self.folder_db.add_folder("f-other", "other", "ws-2", is_root=True)
+        self._file("1", "notes.txt", "f-docs", TEXT)
+        self._file("2", "photo.png", "f-docs", PNG)
+        self._file("3", "readme.md", None, b"# top level")
+        self._file("4", "secret.txt", "f-other", b"other workspace", workspace_id="ws-2")
+
+    def tearDown(self):
+        self.folder_db.close_session()
+        self.tmp.cleanup()
+
+    def _file(self, id, name, folder_id, content, workspace_id="ws"):
+        with open(os.path.join(self.root, id), "wb") as f:
+            f.write(content)
+        self.file_db.add_file(id, name, id, workspace_id, size=len(content) / 2**20,
+                              folder_id=folder_id)
+
+    def _export(self, folder_id=None, chunk_size=4096):
+        paths = self.folder_db.find_folder_paths("ws", folder_id)
+        job = ExportJob("ws", folder_id)
+        entries = iter_entries(self.file_db, "ws", folder_id, paths, batch_size=2)
+        chunks = list(stream_zip(job, self.storage, entries, sorted(paths.values()),
+                                 chunk_size=chunk_size))
+        return job, chunks, zipfile.ZipFile(io.BytesIO(b"".join(chunks)))
+
+    def test_workspace_export(self):
+        job, chunks, archive = self._export()
+        self.assertEqual(archive.testzip(), None)
+        self.assertEqual(sorted(archive.namelist()), [
+            "john/", "john/docs/", "john/docs/empty/",
+            "john/docs/notes.txt", "john/docs/photo.png", "readme.md",
+        ])
+        self.assertEqual(archive.read("john/docs/notes.txt"), TEXT)
+        self.assertEqual(archive.read("john/docs/photo.png"), PNG)
+        self.assertEqual(job.state, "done")
+        self.assertEqual(job.files_done, 3)
+        self.assertEqual(job.bytes_sent, sum(map(len, chunks)))
+
+    def test_compressed_files_stored(self):
+        _, _, archive = self._export()
+        self.assertEqual(archive.getinfo("john/docs/photo.png").compress_type, zipfile.ZIP_STORED)
+        notes = archive.getinfo("john/docs/notes.txt")
+        self.assertEqual(notes.compress_type, zipfile.ZIP_DEFLATED)
+        self.assertLess(notes.compress_size, notes.file_size)
+
+    def test_bounded_chunks(self):
+        """Test the archive is streamed in chunks, never buffered whole."""
+        self._file("5", "random.zip", "f-docs", os.urandom(64 * 1024))
+        _, chunks, _ = self._export(chunk_size=1024)
+        self.assertGreater(len(chunks), 64)
+        self.assertLessEqual(max(map(len, chunks)), 2 * 1024)
+
+    def test_subtree_export(self):
+        _, _, archive = self._export("f-docs")
+        self.assertEqual(sorted(archive.namelist()), [
+            "docs/", "docs/empty/", "docs/notes.txt", "docs/photo.png",
+        ])
+        with self.assertRaises(Exception):
+            self.folder_db.find_folder_paths("ws", "f-other")
+
+    def test_count_tree_files(self):
+        count, size = self.file_db.count_tree_files("ws")
+        self.assertEqual(count, 3)
+        self.assertAlmostEqual(size, (len(TEXT) + len(PNG) + 11) / 2**20)
+        self.assertEqual(self.file_db.count_tree_files("ws", "f-docs")[0], 2)
+
+    def test_missing_and_duplicate_files(self):
+        self._file("5", "notes.txt", "f-docs", b"second notes")
+        os.remove(os.path.join(self.root, "2"))
+        job, _, archive = self._export()
+        self.assertIn("john/docs/notes (1).txt", archive.namelist())
+        self.assertNotIn("john/docs/photo.png", archive.namelist())
+        self.assertEqual(job.files_missing, 1)
+
+    def test_cancel(self):
+        paths = self.folder_db.find_folder_paths("ws")
+        job = ExportJob("ws")
+        stream = stream_zip(job, self.storage, iter_entries(self.file_db, "ws", None, paths),
+                            chunk_size=1024)
+        next(stream)
+        job.cancel()
+        rest = list(stream)
+        self.assertEqual(job.state, "cancelled")
+        self.assertLess(len(rest), 3)
+
+    def test_client_disconnect(self):
+        paths = self.folder_db.find_folder_paths("ws")
+        job = ExportJob("ws")
+        stream = stream_zip(job, self.storage, iter_entries(self.file_db, "ws", None, paths),
+                            chunk_size=1024)
+        next(stream)
+        stream.close()
+        self.assertEqual(job.state, "cancelled")
+
+
+class TestExportRoutes(AppTestCase):
+    """Test the export, progress and cancel routes."""
+    USERNAME = "admin"
+
+    def app_config(self):
+        return {**super().app_config(), "FILE_STORAGE_ROOT": self.tmp.name}
+
+    def setUp(self):
+        super().setUp()
+        with self.app.app_context():
+            from vaultShare.resources import get_db
+            folder_db = get_db(FolderDB)
+            admin_id = folder_db._session.query(User.id).scalar()
+            folder_db._session.add_all([
+                Workspace(id="ws", name="design", admin_id=admin_id),
+                WorkspaceUser(id="wu", workspace_id="ws", user_id=admin_id, role="admin"),
+            ])
+            folder_db._session.commit()
+            folder_db.add_folder("f-root", "admin", "ws", is_root=True)
+            with open(os.path.join(self.tmp.name, "1"), "wb") as f:
+                f.write(TEXT)
+            get_db(FileDB).add_file("1", "notes.txt", "1", "ws", 0.1, folder_id="f-root")
+
+    def test_export_and_progress(self):
+        response = self.client.get("/workspaces/ws/export")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, "application/zip")
+        archive = zipfile.ZipFile(io.BytesIO(response.get_data()))
+        self.assertEqual(archive.read("admin/notes.txt"), TEXT)
+
+        export_id = response.headers["X-Export-Id"]
+        progress = self.client.get(f"/workspaces/ws/exports/{export_id}").get_json()
+        self.assertEqual(progress["state"], "done")
+        self.assertEqual(progress["files_done"], 1)
+        response = self.client.get("/workspaces/ws/exports/unknown")
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(response.get_json(), {"error": "No export unknown found."})
+
+    def test_attachment_name_quoted(self):
+        with self.app.app_context():
+            from vaultShare.resources import get_db
+            get_db(FolderDB).add_folder("f-q", 'say "hi"', "ws", parent_folder_id="f-root")
+        response = self.client.get("/workspaces/ws/export?folder_id=f-q")
+        self.assertEqual(response.headers["Content-Disposition"],
+                         'attachment; filename="say \\"hi\\".zip"')
+
+    def test_unknown_folder(self):
+        response = self.client.get("/workspaces/ws/export?folder_id=nope")
+        self.assertEqual(response.status_code, 404)
+
+    def test_members_only(self):
+        self.client.delete_cookie("session_id")
+        self.assertEqual(self.client.get("/workspaces/ws/export").status_code, 403)
+
+
+if __name__ == "__main__":
+    unittest.main()
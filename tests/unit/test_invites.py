@@ -0,0 +1,104 @@
+"""
+Test batch workspace invitations.
+"""
+import unittest
+from sqlalchemy import event
+from vaultShare.db import InviteDB
+from vaultShare.db.models import (
+    User, Workspace, WorkspaceUser, Invite, Alert, AlertCounter
+)
+from tests.unit import AppTestCase
+
+
+class TestInviteDB(unittest.TestCase):
+    """Test InviteDB class."""
+    def setUp(self):
+        self.db = InviteDB(database_url="sqlite:///:memory:", echo=False)
+        session = self.db._session
+        session.add_all([
+            User(id="admin", username="admin", email="admin@x.io", hashed_password="x"),
+            User(id="member", username="member", email="member@x.io", hashed_password="x"),
+            User(id="known", username="known", email="known@x.io", hashed_password="x"),
+            Workspace(id="ws", name="design", admin_id="admin", max_users=600),
+            WorkspaceUser(id="wu-1", workspace_id="ws", user_id="admin", role="admin"),
+            WorkspaceUser(id="wu-2", workspace_id="ws", user_id="member", role="user"),
+            Invite(
+                id="inv-1", invite_type="workspace_invite", workspace_id="ws",
+                inviter_id="admin", invitee_email="pending@x.io"
+            ),
+        ])
+        session.commit()
+
+    def test_deduplication(self):
+        """Test emails are split into new, pending, member and invalid."""
+        result = self.db.add_invites("ws", "admin", [
+            "new@x.io", "NEW@x.io", " pending@x.io", "member@x.io",
+            "known@x.io", "not-an-email"
+        ])
+        self.assertEqual(result["invited"], ["new@x.io", "known@x.io"])
+        self.assertEqual(result["already_invited"], ["pending@x.io"])
+        self.assertEqual(result["already_members"], ["member@x.io"])
+        self.assertEqual(result["invalid"], ["not-an-email"])
+
+    def test_case_insensitive(self):
+        """Test emails differing in case from pending invites and users match them."""
+        result = self.db.add_invites("ws", "admin", [
+            "Pending@x.io", "MEMBER@x.io", "Known@X.io"
+        ])
+        self.assertEqual(result["already_invited"], ["Pending@x.io"])
+        self.assertEqual(result["already_members"], ["MEMBER@x.io"])
+        self.assertEqual(result["invited"], ["Known@X.io"])
+        self.assertEqual(self.db._session.get(AlertCounter, "known").unread, 1)
+
+    def test_registered_invitee_alert(self):
+        """Test registered invitees get an unread alert."""
+        self.db.add_invites("ws", "admin", ["known@x.io", "new@x.io"])
+        session = self.db._session
+        self.assertEqual(session.get(AlertCounter, "known").unread, 1)
+        alert = session.query(Alert).filter_by(user_id="known").one()
+        self.assertEqual(alert.alert_type, "invite")
+
+    def test_max_users(self):
+        """Test invites that would exceed max_users are rejected."""
+        with self.assertRaises(ValueError):
+            self.db.add_invites("ws", "admin", [f"user{i}@x.io" for i in range(598)])
+        result = self.db.add_invites("ws", "admin", [f"user{i}@x.io" for i in range(597)])
+        self.assertEqual(len(result["invited"]), 597)
+
+    def test_constant_statement_count(self):
+        """Test a 500 email batch does not issue per-email queries."""
+        statements = []
+        listener = lambda *args: statements.append(args[2])
+        event.listen(self.db._engine, "before_cursor_execute", listener)
+        try:
+            self.db.add_invites("ws", "admin", [f"user{i}@x.io" for i in range(500)])
+        finally:
+            event.remove(self.db._engine, "before_cursor_execute", listener)
+        self.assertLess(len(statements), 10)
+
+
+class TestInviteRoutes(AppTestCase):
+    """Test the invite route."""
+    def setUp(self):
+        super().setUp()
+        with self.app.app_context():
+            from vaultShare.resources import get_db
+            session = get_db(InviteDB)._session
+            user_id = session.query(User.id).scalar()
+            session.add_all([
+                User(id="other", username="other", email="other@x.io", hashed_password="x"),
+                Workspace(id="ws", name="design", admin_id=user_id),
+                Workspace(id="ws-2", name="ops", admin_id="other"),
+            ])
+            session.commit()
+
+    def invite(self, workspace_id):
+        return self.client.post(f"/workspaces/{workspace_id}/invites",
+                                json={"emails": ["ada@x.io"]})
+
+    def test_invite(self):
+        self.assertEqual(self.invite("ws").status_code, 201)
+        self.assertEqual(self.invite("ws-2").status_code, 403)
+        response = self.invite("nope")
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(response.get_json()["error"], "No workspace nope found.")
@@ -0,0 +1,113 @@
+"""
+Test the on-demand request profiler.
+"""
+import json
+import os
+import pstats
+import tempfile
+import time
+import unittest
+from sqlalchemy import create_engine, text
+from vaultShare.profiling import RequestProfile
+from tests.unit import AppTestCase
+
+
+def busy(seconds):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+
+class TestRequestProfile(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.engine = create_engine("sqlite://")
+
+    def tearDown(self):
+        self.engine.dispose()
+        self.tmp.cleanup()
+
+    def run_profile(self, mode):
+        profile = RequestProfile(mode, "main.status", "GET", "/status", sample_interval=0.001)
+        profile.start()
+        with self.engine.connect() as conn:
+            for _ in range(3):
+                conn.execute(text("SELECT 1"))
+        busy(0.05)
+        profile.stop()
+        paths = profile.dump(self.tmp.name)
+        with open(paths[-1]) as f:
+            return paths, json.load(f)
+
+    def test_cprofile(self):
+        paths, tags = self.run_profile("cprofile")
+        self.assertTrue(paths[0].endswith(".prof"))
+        functions = {name for _, _, name in pstats.Stats(paths[0]).stats}
+        self.assertIn("busy", functions)
+        self.assertEqual((tags["endpoint"], tags["sql_count"]), ("main.status", 3))
+        self.assertEqual(tags["sql"][0]["statement"], "SELECT 1")
+
+    def test_sampler(self):
+        paths, tags = self.run_profile("sample")
+        with open(paths[0]) as f:
+            lines = f.read().splitlines()
+        self.assertTrue(lines)
+        stack, count = lines[0].rsplit(" ", 1)
+        self.assertIn("busy (test_profiling.py", stack.split(";")[-1])
+        self.assertGreater(int(count), 5)
+
+    def test_sql_outside_profile_untracked(self):
+        profile = RequestProfile("cprofile", "x", "GET", "/")
+        with self.engine.connect() as conn:
+            conn.execute(text("SELECT 1"))
+        self.assertEqual(profile.statements, {})
+        with self.assertRaises(ValueError):
+            RequestProfile("perf", "x", "GET", "/")
+
+
+class TestProfiledRoutes(AppTestCase):
+    def setUp(self):
+        # Each test makes its app with its own profiler config
+        self.tmp = tempfile.TemporaryDirectory()
+        self.profile_dir = os.path.join(self.tmp.name, "profiles")
+
+    def profiles(self):
+        if not os.path.isdir(self.profile_dir):
+            return []
+        return sorted(os.listdir(self.profile_dir))
+
+    def test_admin_header(self, **config):
+        self.make_app(PROFILE_DIR=self.profile_dir, **config)
+        headers = {"X-VaultShare-Profile": "1"}
+        # Ignored for other users
+        response = self.client.get("/users/john", headers=headers)
+        self.assertNotIn("X-VaultShare-Profile-Id", response.headers)
+        self.assertEqual(self.profiles(), [])
+
+        self.make_admin()
+        response = self.client.get("/users/john", headers=headers)
+        name = response.headers["X-VaultShare-Profile-Id"]
+        self.assertEqual(self.profiles(), [f"{name}.json", f"{name}.prof"])
+        with open(os.path.join(self.profile_dir, f"{name}.json")) as f:
+            tags = json.load(f)
+        self.assertEqual((tags["endpoint"], tags["status"]), ("users.app_user_detail", 200))
+        self.assertTrue(any("FROM users" in sql["statement"] for sql in tags["sql"]))
+
+    def test_admin_header_signed(self):
+        # Signed sessions carry no role, it is read from the users table
+        self.test_admin_header(SESSION_MODE="signed", SECRET_KEY="test")
+
+    def test_sample_rate(self):
+        self.make_app(PROFILE_DIR=self.profile_dir, PROFILE_SAMPLE_RATE=1.0)
+        response = self.client.get("/status")
+        name = response.headers["X-VaultShare-Profile-Id"]
+        self.assertIn(f"{name}.folded", self.profiles())
+
+    def test_disabled(self):
+        self.make_app(PROFILE_SAMPLE_RATE=1.0)
+        response = self.client.get("/status", headers={"X-VaultShare-Profile": "1"})
+        self.assertNotIn("X-VaultShare-Profile-Id", response.headers)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,240 @@
+"""
+Test retention purges of alerts and invites, and cascading deletes.
+"""
+import gzip
+import json
+import os
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+from sqlalchemy import MetaData, create_engine, event, func, select
+from vaultShare.app import create_app
+from vaultShare.db import (
+    AlertDB, FileDB, InviteDB, ShardRouter, UserDB, WorkspaceDB
+)
+from vaultShare.db.models import (
+    Alert, AlertCounter, Base, File, Folder, Invite, User, UserSession, Workspace,
+    WorkspaceChange, WorkspaceUser
+)
+from vaultShare.retention import Retention
+
+NOW = datetime(2024, 5, 1)
+DAY = 24 * 3600
+
+
+def seed(file_db, workspace_id="ws", admin_id="admin"):
+    """Adds a workspace with a member, nested folders, files and an invite."""
+    session = file_db._session
+    session.add_all([
+        Workspace(id=workspace_id, name=workspace_id, admin_id=admin_id),
+        WorkspaceUser(id=f"{workspace_id}-wu", workspace_id=workspace_id, user_id="bob",
+                      role="user"),
+        Folder(id=f"{workspace_id}-d1", name="docs", workspace_id=workspace_id),
+        Folder(id=f"{workspace_id}-d2", name="specs", workspace_id=workspace_id,
+               parent_folder_id=f"{workspace_id}-d1"),
+        Invite(id=f"{workspace_id}-i", invite_type="workspace_invite",
+               workspace_id=workspace_id, inviter_id=admin_id, invitee_email="new@x.io"),
+    ])
+    session.commit()
+    file_db.add_file(f"{workspace_id}-f1", "a.txt", "blobs/a", workspace_id, 0.1,
+                     folder_id=f"{workspace_id}-d2")
+    file_db.add_file(f"{workspace_id}-f2", "b.txt", "blobs/b", workspace_id, 0.1)
+
+
+def add_users(session):
+    session.add_all([
+        User(id=user_id, username=user_id, email=f"{user_id}@x.io", hashed_password=b"x")
+        for user_id in ("admin", "bob")
+    ])
+    session.commit()
+
+
+class TestCascadingDeletes(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        url = f"sqlite:///{os.path.join(self.tmp.name, 'test.db')}"
+        self.workspace_db = WorkspaceDB(database_url=url, echo=False)
+        engine = self.workspace_db._engine
+        self.file_db = FileDB(engine=engine)
+        self.alert_db = AlertDB(engine=engine)
+        self.user_db = UserDB(engine=engine)
+        add_users(self.file_db._session)
+        for workspace_id in ("ws", "other"):
+            seed(self.file_db, workspace_id)
+            self.alert_db.add_alert(f"{workspace_id}-a", "invite", "bob", "hi", workspace_id)
+        self.statements = []
+
+        @event.listens_for(engine, "before_cursor_execute")
+        def record(conn, cursor, statement, parameters, context, executemany):
+            self.statements.append(statement)
+
+    def tearDown(self):
+        for db in (self.workspace_db, self.file_db, self.alert_db, self.user_db):
+            db.close_session()
+        self.workspace_db._engine.dispose()
+        self.tmp.cleanup()
+
+    def count(self, model, **filters) -> int:
+        self.file_db.close_session()
+        return self.file_db._session.scalar(
+            select(func.count()).select_from(model).filter_by(**filters)
+        )
+
+    def test_remove_workspace(self):
+        self.assertEqual(self.workspace_db.remove_workspace(id="ws"), 1)
+        for model in (WorkspaceUser, Folder, File, Invite, Alert, WorkspaceChange):
+            self.assertEqual(self.count(model, workspace_id="ws"), 0, model)
+            self.assertGreater(self.count(model, workspace_id="other"), 0, model)
+        # The alert went with a single statement, the rest cascaded from one
+        deletes = [s for s in self.statements if s.startswith("DELETE")]
+        self.assertEqual([s.split()[2] for s in deletes], ["alerts", "workspaces"])
+        self.assertEqual(self.alert_db.unread_count("bob"), 1)
+
+    def test_remove_user(self):
+        self.user_db._session.add(UserSession(
+            token="t", user_id="admin", created_at=NOW, last_seen=NOW, expires_at=NOW
+        ))
+        self.user_db._session.commit()
+        self.assertEqual(self.user_db.remove_user(id="admin"), 1)
+        for model in (Workspace, Folder, File, Invite, UserSession):
+            self.assertEqual(self.count(model), 0, model)
+        self.assertEqual(self.alert_db.unread_count("bob"), 0)
+        self.assertEqual(self.count(User), 1)
+
+
+class TestLegacySchema(unittest.TestCase):
+    """Databases created before the ON DELETE actions were declared."""
+    def test_remove_workspace(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            url = f"sqlite:///{tmp}/legacy.db"
+            legacy = MetaData()
+            for table in Base.metadata.sorted_tables:
+                for constraint in table.to_metadata(legacy).foreign_key_constraints:
+                    constraint.ondelete = None
+            engine = create_engine(url)
+            legacy.create_all(engine)
+            engine.dispose()
+
+            file_db = FileDB(database_url=url, echo=False)
+            workspace_db = WorkspaceDB(engine=file_db._engine)
+            add_users(file_db._session)
+            seed(file_db, "ws")
+            # Keys are left unchecked rather than refusing the delete
+            self.assertEqual(workspace_db.remove_workspace(id="ws"), 1)
+            for model in (WorkspaceUser, Folder, File, Invite, WorkspaceChange):
+                self.assertEqual(file_db._session.scalar(
+                    select(func.count()).select_from(model)
+                ), 0, model)
+            for db in (file_db, workspace_db):
+                db.close_session()
+            file_db._engine.dispose()
+
+
+class TestShardedRemove(unittest.TestCase):
+    def test_remove_workspace(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            router = ShardRouter(f"sqlite:///{tmp}/primary.db",
+                                 [f"sqlite:///{tmp}/shard{i}.db" for i in range(2)])
+            add_users(router.db(UserDB)._session)
+            seed(router.db(FileDB, "ws"), "ws")
+            router.db(AlertDB).add_alert("a", "invite", "bob", "hi", "ws")
+            self.assertEqual(router.db(AlertDB).unread_count("bob"), 1)
+
+            self.assertEqual(router.db(WorkspaceDB, "ws").remove_workspace(id="ws"), 1)
+            engine = router.engine_for("ws")
+            with engine.connect() as conn:
+                for model in (Workspace, WorkspaceUser, Folder, File, Invite, WorkspaceChange):
+                    self.assertEqual(conn.scalar(select(func.count()).select_from(model)), 0)
+            self.assertEqual(router.db(AlertDB).unread_count("bob"), 0)
+            router.close_sessions()
+            router.dispose()
+
+
+class TestRetention(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        url = f"sqlite:///{os.path.join(self.tmp.name, 'test.db')}"
+        self.alert_db = AlertDB(database_url=url, echo=False)
+        self.invite_db = InviteDB(engine=self.alert_db._engine)
+        session = self.alert_db._session
+        add_users(session)
+        session.add(Workspace(id="ws", name="ws", admin_id="admin"))
+        # One alert and one invite a day, over the last 10 days
+        for day in range(10):
+            created_at = NOW - timedelta(days=day, hours=1)
+            session.add_all([
+                Alert(id=f"a{day}", alert_type="invite" if day % 2 else "memory_usage",
+                      user_id="bob", message="m", is_read=day >= 5, created_at=created_at),
+                Invite(id=f"i{day}", invite_type="workspace_invite", workspace_id="ws",
+                       inviter_id="admin", invitee_email=f"{day}@x.io",
+                       status="pending" if day % 2 else "accepted", created_at=created_at),
+            ])
+        session.add(AlertCounter(user_id="bob", unread=5))
+        session.commit()
+        self.archive_dir = os.path.join(self.tmp.name, "archive")
+
+    def tearDown(self):
+        self.alert_db.close_session()
+        self.alert_db._engine.dispose()
+        self.tmp.cleanup()
+
+    def retention(self, **kwargs):
+        options = {
+            "alert_ttls": {"invite": 3 * DAY, "*": 6 * DAY},
+            "invite_ttls": {"pending": 2 * DAY, "*": None},
+            "batch_size": 2, "pause": 0, "archive_dir": self.archive_dir,
+        }
+        options.update(kwargs)
+        return Retention(self.alert_db, [self.invite_db], clock=lambda: NOW, **options)
+
+    def remaining(self, model):
+        self.alert_db.close_session()
+        return sorted(self.alert_db._session.scalars(select(model.id)))
+
+    def test_run_pass(self):
+        commits = []
+        event.listen(self.alert_db._engine, "commit", lambda conn: commits.append(1))
+        stats = self.retention().run_pass()
+        # invite alerts older than 3 days, the others older than 6
+        self.assertEqual(self.remaining(Alert), ["a0", "a1", "a2", "a4"])
+        # Pending invites older than 2 days, accepted ones are kept
+        self.assertEqual(self.remaining(Invite), ["i0", "i1", "i2", "i4", "i6", "i8"])
+        self.assertEqual(stats, {"alerts": 6, "invites": 4})
+        # Batches of 2 rows, one transaction each: 4 + 2 alerts, 4 invites
+        self.assertEqual(len(commits), 5)
+        # Of the purged alerts only a3 was unread
+        self.assertEqual(self.alert_db.unread_count("bob"), 4)
+
+        with gzip.open(os.path.join(self.archive_dir, "alerts-20240501.jsonl.gz"), "rt") as f:
+            archived = [json.loads(line) for line in f]
+        self.assertEqual(sorted(row["id"] for row in archived), ["a3", "a5", "a6", "a7", "a8", "a9"])
+        self.assertEqual(self.retention().run_pass(), {"alerts": 0, "invites": 0})
+
+    def test_failed_archive_keeps_rows(self):
+        open(os.path.join(self.tmp.name, "file"), "w").close()
+        retention = self.retention(archive_dir=os.path.join(self.tmp.name, "file"))
+        with self.assertRaises(OSError):
+            retention.run_pass()
+        self.assertEqual(len(self.remaining(Alert)), 10)
+        self.assertEqual(self.alert_db.unread_count("bob"), 5)
+
+    def test_purge_without_archive(self):
+        deleted, cursor = self.alert_db.purge_alerts("invite", NOW, batch_size=3)
+        self.assertEqual((deleted, cursor[1]), (3, "a5"))
+        deleted, cursor = self.alert_db.purge_alerts("invite", NOW, batch_size=3, after=cursor)
+        self.assertEqual((deleted, cursor), (2, None))
+
+    def test_purge_command(self):
+        app = create_app({
+            "DATABASE_URL": str(self.alert_db._engine.url),
+            "ALERT_RETENTION": {"*": None},
+            "INVITE_RETENTION": {"*": 0},
+        })
+        result = app.test_cli_runner().invoke(args=["purge"])
+        self.assertEqual(result.output.strip(), "Purged 0 alerts, 10 invites")
+        app.extensions["vaultshare"].close()
+        app.extensions["vaultshare"].engine.dispose()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,195 @@
+"""
+Test the integrity scrubber of stored files.
+"""
+import hashlib
+import io
+import os
+import tempfile
+import threading
+import time
+import unittest
+from vaultShare.db import AlertDB, FileDB, ScrubDB
+from vaultShare.db.models import Alert, File, User, Workspace
+from vaultShare.file_mangager import (
+    CompressedStorage, IOBudget, LocalStorage, Scrubber, content_checksum
+)
+
+CONTENT = b"quarterly report\n" * 10_000
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+        self.slept = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept += seconds
+        self.now += seconds
+
+
+class TestIOBudget(unittest.TestCase):
+    def test_rate(self):
+        clock = FakeClock()
+        budget = IOBudget(1000, burst=100, clock=clock, sleep=clock.sleep)
+        for _ in range(20):
+            budget.spend(100)
+        # 2000 bytes at 1000 B/s, less the initial burst
+        self.assertAlmostEqual(clock.slept, 1.9)
+
+    def test_unlimited(self):
+        clock = FakeClock()
+        IOBudget(0, clock=clock, sleep=clock.sleep).spend(10**9)
+        self.assertEqual(clock.slept, 0)
+
+    def test_stop_cuts_wait_short(self):
+        budget = IOBudget(1, burst=1)
+        stop = threading.Event()
+        timer = threading.Timer(0.05, stop.set)
+        timer.start()
+        started = time.monotonic()
+        # Would wait 1000 seconds for the bytes otherwise
+        self.assertFalse(budget.spend(1001, stop))
+        self.assertLess(time.monotonic() - started, 5)
+        timer.join()
+
+    def test_shared_between_threads(self):
+        clock = FakeClock()
+        budget = IOBudget(1000, burst=100, clock=clock, sleep=lambda seconds: None)
+        threads = [
+            threading.Thread(target=lambda: [budget.spend(10) for _ in range(1000)])
+            for _ in range(4)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        # Every byte was taken from the bucket, none lost to a race
+        self.assertAlmostEqual(budget._tokens, 100 - 40_000)
+
+
+class TestScrubber(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        url = f"sqlite:///{os.path.join(self.tmp.name, 'test.db')}"
+        self.file_db = FileDB(database_url=url, echo=False)
+        engine = self.file_db._engine
+        self.scrub_db = ScrubDB(engine=engine)
+        self.alert_db = AlertDB(engine=engine)
+        self.storage = LocalStorage(os.path.join(self.tmp.name, "storage"))
+        self.file_db._session.add_all([
+            User(id="admin", email="a@x.io", username="admin", hashed_password=b"x"),
+            Workspace(id="ws", name="design", admin_id="admin"),
+        ])
+        self.file_db._session.commit()
+        for i in range(5):
+            self._file(f"f{i}", CONTENT + bytes([i]))
+
+    def tearDown(self):
+        for db in (self.file_db, self.scrub_db, self.alert_db):
+            db.close_session()
+        self.file_db._engine.dispose()
+        self.tmp.cleanup()
+
+    def _file(self, file_id, content, checksum=True):
+        self.storage.put(file_id, io.BytesIO(content))
+        digest = hashlib.sha256(content).hexdigest() if checksum else None
+        self.file_db.add_file(file_id, f"{file_id}.txt", file_id, "ws", len(content) / 2**20,
+                              checksum=digest)
+
+    def _scrubber(self, storage=None, batch_size=2):
+        return Scrubber(self.scrub_db, self.alert_db, storage or self.storage, rate=0,
+                        batch_size=batch_size)
+
+    def _alerts(self):
+        self.alert_db.close_session()
+        return sorted(
+            (a.alert_type, a.message.split()[1])
+            for a in self.alert_db._session.query(Alert).all()
+        )
+
+    def test_clean_pass(self):
+        scrubber = self._scrubber()
+        scrubber.run_pass()
+        checkpoint = self.scrub_db.find_checkpoint()
+        self.assertIsNone(checkpoint.last_file_id)
+        self.assertEqual(checkpoint.files_checked, 5)
+        self.assertEqual(checkpoint.bytes_checked, 5 * (len(CONTENT) + 1))
+        self.assertEqual(checkpoint.problems_found, 0)
+        self.assertIsNotNone(checkpoint.pass_finished_at)
+        self.assertEqual(self._alerts(), [])
+
+    def test_corrupted_and_missing(self):
+        with open(self.storage.local_path("f1"), "r+b") as f:
+            f.seek(1000)
+            f.write(b"X")
+        self.storage.delete("f3")
+        self._scrubber().run_pass()
+        self.assertEqual(self._alerts(), [
+            ("file_corrupted", "f1.txt"), ("file_missing", "f3.txt")
+        ])
+        self.assertEqual(self.scrub_db.find_checkpoint().problems_found, 2)
+
+        # Still broken on the next pass, the unread alerts are not repeated
+        self._scrubber().run_pass()
+        self.assertEqual(len(self._alerts()), 2)
+        self.assertEqual(self.scrub_db.find_checkpoint().problems_found, 2)
+        self.alert_db.mark_read("admin")
+        self._scrubber().run_pass()
+        self.assertEqual(len(self._alerts()), 4)
+
+    def test_resume_from_checkpoint(self):
+        scrubber = self._scrubber()
+        self.assertFalse(scrubber.scrub_batch())
+        self.assertEqual(self.scrub_db.find_checkpoint().last_file_id, "f1")
+        self.scrub_db.close_session()
+
+        # A new scrubber picks up after f1
+        self.storage.delete("f0")
+        resumed = self._scrubber()
+        resumed.run_pass()
+        self.assertEqual(self._alerts(), [])
+        self.assertEqual(self.scrub_db.find_checkpoint().files_checked, 5)
+
+    def test_records_missing_checksum(self):
+        self._file("new", b"no checksum yet", checksum=False)
+        self._scrubber().run_pass()
+        self.file_db.close_session()
+        file = self.file_db._session.get(File, "new")
+        self.assertEqual(file.checksum, hashlib.sha256(b"no checksum yet").hexdigest())
+
+    def test_updated_file_not_reported(self):
+        scrubber = self._scrubber()
+        row = self.scrub_db.find_scrub_batch(limit=1)[0]
+        self.storage.put("f0", io.BytesIO(b"new content"))
+        self.file_db.update_file_content("f0", 0.1, lambda path: None,
+                                         checksum=hashlib.sha256(b"new content").hexdigest())
+        self.assertEqual(scrubber.check_file(*row)[0], "changed")
+        self.assertEqual(self._alerts(), [])
+
+    def test_compressed_storage(self):
+        storage = CompressedStorage(self.storage)
+        storage.put("f2", io.BytesIO(CONTENT + bytes([2])))
+        self.assertEqual(storage.stat("f2").codec, "zlib")
+        self._scrubber(storage).run_pass()
+        self.assertEqual(self._alerts(), [])
+
+        # Damage inside a compressed frame fails to decode
+        with open(self.storage.local_path("f2"), "r+b") as f:
+            f.seek(100)
+            f.write(b"\xff" * 8)
+        self._scrubber(storage).run_pass()
+        self.assertEqual(self._alerts(), [("file_corrupted", "f2.txt")])
+
+    def test_content_checksum(self):
+        digest, size = content_checksum(io.BytesIO(CONTENT), chunk_size=1000)
+        self.assertEqual((digest, size), (hashlib.sha256(CONTENT).hexdigest(), len(CONTENT)))
+        with open(self.storage.local_path("f0"), "rb") as f:
+            self.assertEqual(content_checksum(f, chunk_size=1000)[0],
+                             hashlib.sha256(CONTENT + b"\x00").hexdigest())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,83 @@
+"""
+Test workspace scoped search.
+"""
+import unittest
+from parameterized import parameterized
+from vaultShare.db import SearchDB
+from vaultShare.db.models import User, Workspace, WorkspaceUser, Folder, File
+
+
+class TestSearchDB(unittest.TestCase):
+    """Test SearchDB class."""
+    def setUp(self):
+        self.db = SearchDB(database_url="sqlite:///:memory:", echo=False)
+        session = self.db._session
+        session.add_all([
+            User(id="u1", username="gideon", email="gideon@x.io", hashed_password="x"),
+            User(id="u2", username="ada", email="ada@x.io", hashed_password="x"),
+            User(id="u3", username="gilbert", email="gil@x.io", hashed_password="x"),
+            Workspace(id="ws1", name="design", admin_id="u1"),
+            Workspace(id="ws2", name="other", admin_id="u3"),
+            WorkspaceUser(id="wu1", workspace_id="ws1", user_id="u1", role="admin"),
+            WorkspaceUser(id="wu2", workspace_id="ws1", user_id="u2", role="user"),
+            WorkspaceUser(id="wu3", workspace_id="ws2", user_id="u3", role="admin"),
+            Folder(id="f1", name="Reports", workspace_id="ws1"),
+            File(id="a", name="annual_report.pdf", path="/a", workspace_id="ws1", size=1.0),
+            File(id="b", name="report_draft.docx", path="/b", workspace_id="ws1", size=1.0),
+            File(id="c", name="report_other.pdf", path="/c", workspace_id="ws2", size=1.0),
+        ])
+        session.commit()
+
+    def test_substring_scoped_to_workspace(self):
+        """Test substring matches only come from the searched workspace."""
+        results = self.db.search_files("ws1", "report")
+        self.assertEqual({r["id"] for r in results}, {"a", "b"})
+
+    def test_prefix_ranks_first(self):
+        """Test names starting with the query rank above other matches."""
+        results = self.db.search_files("ws1", "report")
+        self.assertEqual(results[0]["id"], "b")
+
+    @parameterized.expand([
+        ("short_prefix", "an", {"a"}),
+        ("case_insensitive", "DRAFT", {"b"}),
+        ("no_match", "zzz", set()),
+    ])
+    def test_file_queries(self, _, query, expected):
+        self.assertEqual({r["id"] for r in self.db.search_files("ws1", query)}, expected)
+
+    def test_index_follows_writes(self):
+        """Test triggers keep the index in sync with renames and deletes."""
+        session = self.db._session
+        session.get(File, "a").name = "budget.xlsx"
+        session.delete(session.get(File, "b"))
+        session.commit()
+        self.assertEqual(self.db.search_files("ws1", "report"), [])
+        self.assertEqual([r["id"] for r in self.db.search_files("ws1", "budget")], ["a"])
+
+    def test_folders_and_users(self):
+        self.assertEqual([r["id"] for r in self.db.search_folders("ws1", "port")], ["f1"])
+        # "gilbert" is not a member of ws1
+        self.assertEqual([r["id"] for r in self.db.search_users("ws1", "gi")], ["u1"])
+        self.assertEqual([r["id"] for r in self.db.search_users("ws1", "ada@x")], ["u2"])
+
+    def test_pagination(self):
+        first = self.db.search_files("ws1", "report", limit=1)
+        second = self.db.search_files("ws1", "report", limit=1, offset=1)
+        self.assertEqual(len(first), 1)
+        self.assertNotEqual(first, second)
+
+    def test_substring_pages_in_name_order(self):
+        """Test contained matches page in a stable name order."""
+        session = self.db._session
+        session.add_all([
+            File(id=f"s{i}", name=f"{name}_report.txt", path=f"/s{i}", workspace_id="ws1",
+                 size=1.0)
+            for i, name in enumerate(["zeta", "beta", "delta", "alpha"])
+        ])
+        session.commit()
+        pages = [
+            [r["id"] for r in self.db.search_files("ws1", "report", limit=2, offset=offset)]
+            for offset in (1, 3)
+        ]
+        self.assertEqual(pages, [["s3", "a"], ["s1", "s2"]])
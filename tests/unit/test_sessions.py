@@ -0,0 +1,187 @@
+"""
+Test the multi-device session table, write-behind touches, expiry sweeps
+and signed session tokens.
+"""
+import os
+import tempfile
+import unittest
+from parameterized import parameterized
+from datetime import timedelta
+from sqlalchemy import event
+from vaultShare.auth import Auth
+from vaultShare.auth.sessions import utcnow
+from vaultShare.db import UserDB
+from vaultShare.db.models import UserSession
+
+
+class TestSessions(unittest.TestCase):
+    """Test Auth sessions backed by the "sessions" table."""
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        url = f"sqlite:///{os.path.join(self.tmp.name, 'test.db')}"
+        self.auth = Auth(database_url=url, touch_interval=60.0)
+        self.user = self.auth.register_user("john", "john@x.io", "Pass1234")
+
+    def tearDown(self):
+        self.auth.close_session()
+        self.auth._db._engine.dispose()
+        self.tmp.cleanup()
+
+    def test_multiple_devices(self):
+        """Test a new login keeps the sessions of other devices valid."""
+        user = self.auth.valid_login("Pass1234", username="john")
+        laptop = self.auth.create_session(user.id)
+        phone = self.auth.create_session(user.id)
+
+        self.assertEqual(self.auth.find_user_by_sessionid(laptop).id, user.id)
+        self.assertEqual(self.auth.find_user_by_sessionid(phone).id, user.id)
+        self.assertIsNone(self.user.session_id)
+
+        self.assertEqual(self.auth.destroy_session(laptop), 1)
+        self.assertIsNone(self.auth.destroy_session(laptop))
+        self.assertIsNone(self.auth.find_user_by_sessionid(laptop))
+        self.assertEqual(self.auth.find_user_by_sessionid(phone).id, user.id)
+
+    def test_revoke_user_sessions(self):
+        tokens = [self.auth.create_session(self.user.id) for _ in range(3)]
+        self.assertEqual(self.auth.revoke_user_sessions(self.user.id), 3)
+        for token in tokens:
+            self.assertIsNone(self.auth.find_user_by_sessionid(token))
+
+    def test_expired_session(self):
+        self.auth.session_ttl = -1
+        token = self.auth.create_session(self.user.id)
+        self.assertIsNone(self.auth.find_user_by_sessionid(token))
+
+    def test_touches_written_behind(self):
+        """Test last_seen is buffered, coalesced and flushed in one batch."""
+        token = self.auth.create_session(self.user.id)
+        sessiondb = self.auth._sessiondb
+        stale = utcnow() - timedelta(minutes=5)
+        sessiondb.touch_sessions({token: stale})
+
+        for _ in range(3):
+            self.auth.find_user_by_sessionid(token)
+        self.assertEqual(len(self.auth._touches), 1)
+        sessiondb._session.expire_all()
+        self.assertEqual(sessiondb.find_session(token).last_seen, stale)
+
+        self.assertEqual(self.auth._touches.flush(), 1)
+        self.assertGreater(sessiondb.find_session(token).last_seen, stale)
+        # Fresh sessions are not touched again within the interval
+        self.auth.find_user_by_sessionid(token)
+        self.assertEqual(len(self.auth._touches), 0)
+
+    def test_sweep_in_batches(self):
+        """Test the sweeper deletes only expired sessions, chunk by chunk."""
+        self.auth.session_ttl = -1
+        for _ in range(7):
+            self.auth.create_session(self.user.id)
+        self.auth.session_ttl = 3600
+        live = self.auth.create_session(self.user.id)
+
+        sessiondb = self.auth._sessiondb
+        self.assertEqual(sessiondb.sweep_expired(utcnow(), batch_size=3), 7)
+        remaining = sessiondb._session.query(UserSession.token).all()
+        self.assertEqual([token for token, in remaining], [live])
+
+    def test_sweeper_thread_flushes_on_stop(self):
+        token = self.auth.create_session(self.user.id)
+        self.auth._touches.touch(token, utcnow() + timedelta(minutes=1))
+        sweeper = self.auth.start_session_sweeper(flush_interval=60.0)
+        sweeper.stop()
+        self.assertEqual(len(self.auth._touches), 0)
+
+
+class TestSignedSessions(unittest.TestCase):
+    """Test stateless signed session tokens and their revocation."""
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.url = f"sqlite:///{os.path.join(self.tmp.name, 'test.db')}"
+        self.auth = self._auth()
+        self.user = self.auth.register_user("john", "john@x.io", "Pass1234")
+        self.queries = 0
+
+        def count(*args):
+            self.queries += 1
+        event.listen(self.auth._db._engine, "before_cursor_execute", count)
+
+    def _auth(self, **kwargs):
+        return Auth(database_url=self.url, session_mode="signed",
+                    secret_key="test-secret", **kwargs)
+
+    def tearDown(self):
+        self.auth.close_session()
+        self.auth._db._engine.dispose()
+        self.tmp.cleanup()
+
+    def test_verified_without_database(self):
+        token = self.auth.create_session(self.user.id)
+        self.queries = 0
+        for _ in range(10):
+            self.assertEqual(self.auth.find_user_by_sessionid(token).id, self.user.id)
+        self.assertEqual(self.queries, 0)
+
+    @parameterized.expand([
+        ("tampered", lambda token: token[:-2] + ("AA" if token[-2:] != "AA" else "BB")),
+        ("garbage", lambda token: "not-a-token"),
+        ("other_key", lambda token: Auth(
+            database_url="sqlite:///:memory:", session_mode="signed",
+            secret_key="other-secret").create_session("john")),
+    ])
+    def test_invalid_tokens(self, _, forge):
+        token = forge(self.auth.create_session(self.user.id))
+        self.assertIsNone(self.auth.find_user_by_sessionid(token))
+
+    def test_expired_token(self):
+        self.auth._signed.ttl = -1
+        token = self.auth.create_session(self.user.id)
+        self.assertIsNone(self.auth.find_user_by_sessionid(token))
+
+    def test_logout_revokes_one_token(self):
+        laptop = self.auth.create_session(self.user.id)
+        phone = self.auth.create_session(self.user.id)
+        self.assertEqual(self.auth.destroy_session(laptop), 1)
+        self.assertIsNone(self.auth.destroy_session(laptop))
+        self.assertIsNone(self.auth.find_user_by_sessionid(laptop))
+        self.assertEqual(self.auth.find_user_by_sessionid(phone).id, self.user.id)
+
+    def test_password_change_revokes_every_token(self):
+        tokens = [self.auth.create_session(self.user.id) for _ in range(3)]
+        with self.assertRaises(ValueError):
+            self.auth.update_password(self.user.id, "wrong", "NewPass1")
+        self.auth.update_password(self.user.id, "Pass1234", "NewPass1")
+        for token in tokens:
+            self.assertIsNone(self.auth.find_user_by_sessionid(token))
+        self.assertIsNotNone(self.auth.valid_login("NewPass1", username="john"))
+
+    def test_revocations_shared_through_table(self):
+        """Test other processes load revocations at startup and on refresh."""
+        token = self.auth.create_session(self.user.id)
+        other = self._auth(revocation_refresh=0)
+        self.assertIsNotNone(other.find_user_by_sessionid(token))
+
+        self.auth.destroy_session(token)
+        self.assertIsNone(other.find_user_by_sessionid(token))
+        self.assertIsNone(self._auth().find_user_by_sessionid(token))
+        other.close_session()
+
+    def test_deleted_user_rejected(self):
+        auth = self._auth(revocation_refresh=0)
+        token = auth.create_session(self.user.id)
+        self.assertEqual(auth.find_user_by_sessionid(token).id, self.user.id)
+        user_db = UserDB(engine=auth._db._engine)
+        user_db.remove_user(id=self.user.id)
+        user_db.close_session()
+        self.assertIsNone(auth.find_user_by_sessionid(token))
+        auth.close_session()
+
+    def test_unknown_mode(self):
+        with self.assertRaises(ValueError):
+            Auth(database_url="sqlite:///:memory:", session_mode="cookie")
+        with self.assertRaises(ValueError):
+            Auth(database_url="sqlite:///:memory:", session_mode="signed")
+
+
+if __name__ == "__main__":
+    unittest.main()
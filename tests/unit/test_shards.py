@@ -0,0 +1,219 @@
+"""
+Test sharding of workspace data over several databases.
+"""
+import os
+import tempfile
+import unittest
+from sqlalchemy import func, inspect, select
+from vaultShare.app import create_app
+from vaultShare.db import (
+    FileDB, FolderDB, InviteDB, SearchDB, ShardRouter, UserDB, WorkspaceDB
+)
+from vaultShare.db.models import (
+    Alert, AlertCounter, File, Folder, User, Workspace, WorkspaceUser
+)
+from tests.unit import log_in
+
+
+class ShardTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.routers = []
+
+    def tearDown(self):
+        for router in self.routers:
+            router.close_sessions()
+            router.dispose()
+        self.tmp.cleanup()
+
+    def url(self, name: str) -> str:
+        return f"sqlite:///{os.path.join(self.tmp.name, name)}"
+
+    def router(self, shards: int) -> ShardRouter:
+        router = ShardRouter(
+            self.url("primary.db"), [self.url(f"shard{i}.db") for i in range(shards)]
+        )
+        self.routers.append(router)
+        return router
+
+    def seed(self, router, workspace_ids):
+        user_db = router.db(UserDB)
+        user_db._session.add(User(id="admin", username="admin", email="admin@x.io",
+                                  hashed_password=b"x"))
+        user_db._session.commit()
+        for workspace_id in workspace_ids:
+            file_db = router.db(FileDB, workspace_id)
+            file_db._session.add_all([
+                Workspace(id=workspace_id, name=workspace_id, admin_id="admin"),
+                Folder(id=f"{workspace_id}-d", name="docs", workspace_id=workspace_id),
+            ])
+            file_db._session.commit()
+            file_db.add_file(f"{workspace_id}-f", "a.txt", f"{workspace_id}/a", workspace_id, 0.1,
+                             folder_id=f"{workspace_id}-d")
+
+    @staticmethod
+    def count(engine, model) -> int:
+        with engine.connect() as conn:
+            return conn.scalar(select(func.count()).select_from(model))
+
+
+class TestShardRouter(ShardTestCase):
+    def test_unsharded(self):
+        router = self.router(0)
+        self.assertIs(router.db(FileDB, "ws")._engine, router.primary)
+        self.assertIs(router.db(FileDB), router.db(FileDB, "other"))
+        self.assertEqual(len(router.all(WorkspaceDB)), 1)
+
+    def test_table_placement(self):
+        router = self.router(2)
+        self.assertEqual(set(inspect(router.primary).get_table_names()),
+                         {"users", "sessions", "session_revocations", "alerts", "alert_counters",
+                          "content_refs", "audit_events"})
+        shard_tables = set(inspect(router.shards[0]).get_table_names())
+        self.assertIn("files", shard_tables)
+        self.assertNotIn("users", shard_tables)
+
+    def test_sharded_class_needs_workspace(self):
+        router = self.router(2)
+        with self.assertRaises(ValueError):
+            router.db(FileDB)
+        self.assertIs(router.db(UserDB)._engine, router.primary)
+        self.assertEqual(len(router.all(FileDB)), 2)
+
+    def test_stable_placement(self):
+        workspace_ids = [f"ws-{i}" for i in range(2000)]
+        before = self.router(3)
+        after = self.router(4)
+        moved = [w for w in workspace_ids if before.shard_for(w) != after.shard_for(w)]
+        # Only the workspaces won by the new shard move
+        self.assertTrue(all(after.shard_for(w) == 3 for w in moved))
+        self.assertLess(abs(len(moved) - 500), 100)
+        counts = [sum(after.shard_for(w) == i for w in workspace_ids) for i in range(4)]
+        self.assertTrue(all(400 < count < 600 for count in counts), counts)
+
+    def test_writes_land_on_owner(self):
+        router = self.router(3)
+        workspace_ids = [f"ws-{i}" for i in range(12)]
+        self.seed(router, workspace_ids)
+        for index, engine in enumerate(router.shards):
+            with engine.connect() as conn:
+                owned = set(conn.scalars(select(File.workspace_id)))
+            self.assertEqual(owned, {w for w in workspace_ids if router.shard_for(w) == index})
+
+    def test_cross_database_queries(self):
+        router = self.router(2)
+        self.seed(router, ["ws"])
+        invite_db = router.db(InviteDB, "ws")
+        invite_db._session.add(User(id="bob", username="bob", email="bob@x.io",
+                                    hashed_password=b"x"))
+        invite_db._session.add(WorkspaceUser(id="wu", workspace_id="ws", user_id="bob",
+                                             role="user"))
+        invite_db._session.commit()
+
+        result = invite_db.add_invites("ws", "admin", ["bob@x.io", "new@x.io"])
+        self.assertEqual(result["already_members"], ["bob@x.io"])
+        # Users and alerts stay on the primary
+        self.assertEqual(self.count(router.primary, User), 2)
+        self.assertEqual(self.count(router.primary, Alert), 0)
+        self.assertEqual(
+            [u["username"] for u in router.db(SearchDB, "ws").search_users("ws", "bo")], ["bob"]
+        )
+        memberships = {}
+        for workspace_db in router.all(WorkspaceDB):
+            memberships.update(workspace_db.find_memberships("bob"))
+        self.assertEqual(memberships, {"ws": ("user", 0)})
+
+    def test_alerts_written_to_primary(self):
+        router = self.router(2)
+        self.seed(router, ["ws"])
+        user_db = router.db(UserDB)
+        user_db._session.add(User(id="bob", username="bob", email="bob@x.io",
+                                  hashed_password=b"x"))
+        user_db._session.commit()
+        router.db(InviteDB, "ws").add_invites("ws", "admin", ["bob@x.io"])
+        self.assertEqual(self.count(router.primary, Alert), 1)
+        with router.primary.connect() as conn:
+            self.assertEqual(conn.scalar(select(AlertCounter.unread)), 1)
+
+
+class TestRebalance(ShardTestCase):
+    def test_add_shard(self):
+        workspace_ids = [f"ws-{i}" for i in range(30)]
+        old = self.router(2)
+        self.seed(old, workspace_ids)
+        old.close_sessions()
+        old.dispose()
+
+        new = self.router(3)
+        stats = new.rebalance(batch_size=2)
+        moved = [w for w in workspace_ids if new.shard_for(w) == 2]
+        self.assertEqual(stats["workspaces"], len(moved))
+        # The workspace, its folder and file, a change and its counter
+        self.assertEqual(stats["rows"], 5 * len(moved))
+        for workspace_id in workspace_ids:
+            file = new.db(FileDB, workspace_id).find_file(id=f"{workspace_id}-f")
+            self.assertEqual(file.workspace_id, workspace_id)
+        self.assertEqual(sum(self.count(engine, Folder) for engine in new.shards), 30)
+        self.assertEqual(new.rebalance(), {"workspaces": 0, "rows": 0})
+
+    def test_from_unsharded(self):
+        old = self.router(0)
+        self.seed(old, ["ws-1", "ws-2"])
+        old.close_sessions()
+        old.dispose()
+
+        new = self.router(2)
+        self.assertEqual(new.rebalance()["workspaces"], 2)
+        self.assertEqual(self.count(new.primary, Workspace), 0)
+        for workspace_id in ("ws-1", "ws-2"):
+            folder = new.db(FolderDB, workspace_id).find_folder(id=f"{workspace_id}-d")
+            self.assertEqual(folder.name, "docs")
+
+
+class TestShardedApp(ShardTestCase):
+    def setUp(self):
+        super().setUp()
+        self.app = create_app({
+            "DATABASE_URL": self.url("app.db"),
+            "SHARD_DATABASE_URLS": [self.url("shard0.db"), self.url("shard1.db")],
+            "FILE_STORAGE_ROOT": os.path.join(self.tmp.name, "storage"),
+        })
+        self.routers.append(self.app.extensions["vaultshare"].router)
+        self.client = self.app.test_client()
+        log_in(self.client)
+
+        # Placement hashes the temporary shard URLs, take two workspaces of each
+        router = self.app.extensions["vaultshare"].router
+        self.workspace_ids = [
+            workspace_id for shard in (0, 1)
+            for workspace_id in [f"ws-{i}" for i in range(100)
+                                 if router.shard_for(f"ws-{i}") == shard][:2]
+        ]
+        with self.app.app_context():
+            from vaultShare.resources import get_db
+            user_id = get_db(UserDB)._session.query(User.id).scalar()
+            for workspace_id in self.workspace_ids:
+                file_db = get_db(FileDB, workspace_id)
+                file_db._session.add_all([
+                    Workspace(id=workspace_id, name=workspace_id, admin_id=user_id),
+                    WorkspaceUser(id=f"wu-{workspace_id}", workspace_id=workspace_id,
+                                  user_id=user_id, role="user"),
+                ])
+                file_db._session.commit()
+                file_db.add_file(f"f-{workspace_id}", f"{workspace_id}-report.txt",
+                                 f"{workspace_id}/r", workspace_id, 0.1)
+
+    def tearDown(self):
+        self.app.extensions["vaultshare"].close()
+        super().tearDown()
+
+    def test_routes_reach_every_shard(self):
+        for workspace_id in self.workspace_ids:
+            response = self.client.get(f"/workspaces/{workspace_id}/search?q=report&type=files")
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual([f["id"] for f in response.get_json()["files"]],
+                             [f"f-{workspace_id}"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,224 @@
+"""
+Test the storage backends and the download route.
+
+The S3 tests run against a moto S3 server started on localhost, or against
+a live S3 compatible endpoint, e.g. a local MinIO:
+
+    VAULTSHARE_TEST_S3_ENDPOINT=http://localhost:9000 \
+    VAULTSHARE_TEST_S3_BUCKET=vaultshare-test \
+    AWS_ACCESS_KEY_ID=minioadmin AWS_SECRET_ACCESS_KEY=minioadmin \
+    python -m pytest tests/unit/test_storage.py
+"""
+import importlib.util
+import io
+import os
+import tempfile
+import unittest
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from parameterized import parameterized
+from vaultShare.db import FileDB
+from vaultShare.db.models import User, Workspace, WorkspaceUser
+from vaultShare.file_mangager import LocalStorage, S3Storage
+from tests.unit import AppTestCase
+
+S3_ENDPOINT = os.environ.get("VAULTSHARE_TEST_S3_ENDPOINT")
+S3_BUCKET = os.environ.get("VAULTSHARE_TEST_S3_BUCKET", "vaultshare-test")
+CONTENT = os.urandom(300_000)
+MOTO_CREDENTIALS = {"AWS_ACCESS_KEY_ID": "testing", "AWS_SECRET_ACCESS_KEY": "testing"}
+
+_moto_server = None
+_saved_environ = {}
+
+
+def setUpModule():
+    """Starts a moto S3 server when no live endpoint is configured."""
+    global S3_ENDPOINT, _moto_server
+    if S3_ENDPOINT or not (
+        importlib.util.find_spec("boto3") and importlib.util.find_spec("moto")
+    ):
+        return
+    from moto.server import ThreadedMotoServer
+
+    _moto_server = ThreadedMotoServer(ip_address="127.0.0.1", port=0, verbose=False)
+    _moto_server.start()
+    S3_ENDPOINT = "http://%s:%d" % _moto_server.get_host_and_port()
+    for name, value in MOTO_CREDENTIALS.items():
+        _saved_environ[name] = os.environ.get(name)
+        os.environ[name] = value
+
+
+def tearDownModule():
+    global S3_ENDPOINT, _moto_server
+    if _moto_server is None:
+        return
+    _moto_server.stop()
+    _moto_server = S3_ENDPOINT = None
+    for name, value in _saved_environ.items():
+        if value is None:
+            os.environ.pop(name, None)
+        else:
+            os.environ[name] = value
+
+
+class StorageContract:
+    """Behaviour every backend shares."""
+    def test_put_get(self):
+        stat = self.storage.put("a/b.bin", io.BytesIO(CONTENT))
+        self.assertEqual(stat.size, len(CONTENT))
+        got, source = self.storage.get("a/b.bin")
+        with source:
+            self.assertEqual(source.read(), CONTENT)
+        self.assertEqual(got.version, stat.version)
+        self.assertEqual(self.storage.stat("a/b.bin"), stat)
+
+    def test_new_version(self):
+        old = self.storage.put("f", io.BytesIO(b"one"))
+        new = self.storage.put("f", io.BytesIO(b"two!"))
+        self.assertNotEqual(old.version, new.version)
+        with self.assertRaises(FileNotFoundError):
+            self.storage.read_range("f", 0, 2, version=old.version)
+
+    def test_read_range(self):
+        stat = self.storage.put("f", io.BytesIO(CONTENT))
+        self.assertEqual(self.storage.read_range("f", 1000, 500), CONTENT[1000:1500])
+        self.assertEqual(self.storage.read_range("f", len(CONTENT) - 10, 100, stat.version),
+                         CONTENT[-10:])
+        self.assertEqual(self.storage.read_range("f", len(CONTENT), 100), b"")
+
+    def test_missing(self):
+        for call in (self.storage.stat, self.storage.get,
+                     lambda key: self.storage.read_range(key, 0, 1)):
+            with self.assertRaises(FileNotFoundError):
+                call("missing")
+        self.assertFalse(self.storage.delete("missing"))
+
+    def test_delete(self):
+        self.storage.put("f", io.BytesIO(b"x"))
+        self.assertTrue(self.storage.delete("f"))
+        with self.assertRaises(FileNotFoundError):
+            self.storage.stat("f")
+
+    @parameterized.expand([("../up",), ("/abs",), ("a//b",), ("",)])
+    def test_invalid_keys(self, key):
+        with self.assertRaises(ValueError):
+            self.storage.put(key, io.BytesIO(b"x"))
+
+    def test_multipart(self):
+        size = self.part_size
+        data = os.urandom(2 * size + 123)
+        upload_id = self.storage.create_multipart("big")
+        # Parts land in any order
+        parts = [
+            (n, self.storage.upload_part("big", upload_id, n, data[(n - 1) * size:n * size]))
+            for n in (3, 1, 2)
+        ]
+        stat = self.storage.complete_multipart("big", upload_id, parts)
+        self.assertEqual(stat.size, len(data))
+        self.assertEqual(self.storage.read_range("big", 0, len(data)), data)
+
+    def test_abort_multipart(self):
+        upload_id = self.storage.create_multipart("big")
+        self.storage.upload_part("big", upload_id, 1, b"x" * 10)
+        self.storage.abort_multipart("big", upload_id)
+        with self.assertRaises(FileNotFoundError):
+            self.storage.stat("big")
+
+    def test_put_file(self):
+        fd, path = tempfile.mkstemp(dir=self.storage.temp_dir)
+        with os.fdopen(fd, "wb") as f:
+            f.write(CONTENT)
+        self.assertEqual(self.storage.put_file("f", path).size, len(CONTENT))
+        self.assertFalse(os.path.exists(path))
+
+
+class TestLocalStorage(StorageContract, unittest.TestCase):
+    part_size = 1000
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.storage = LocalStorage(self.tmp.name)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_layout(self):
+        self.storage.put("a/b.bin", io.BytesIO(b"x"))
+        with open(os.path.join(self.tmp.name, "a", "b.bin"), "rb") as f:
+            self.assertEqual(f.read(), b"x")
+        self.assertIsNone(self.storage.presigned_url("a/b.bin"))
+        with self.assertRaises(ValueError):
+            self.storage.put(".tmp/x", io.BytesIO(b"x"))
+
+
+class TestS3Storage(StorageContract, unittest.TestCase):
+    part_size = S3Storage.MIN_PART_SIZE
+
+    def setUp(self):
+        if not S3_ENDPOINT:
+            self.skipTest("needs boto3 and moto, or VAULTSHARE_TEST_S3_ENDPOINT")
+        self.storage = S3Storage(
+            S3_BUCKET, prefix=f"test-{uuid.uuid4().hex}", endpoint_url=S3_ENDPOINT,
+            region="us-east-1", max_pool_connections=4, part_size=self.part_size,
+            upload_concurrency=2
+        )
+        try:
+            self.storage._client.create_bucket(Bucket=S3_BUCKET)
+        except self.storage._client_error:
+            pass
+
+    def test_parallel_put(self):
+        data = os.urandom(3 * self.part_size + 1)
+        self.assertEqual(self.storage.put("big", io.BytesIO(data)).size, len(data))
+        self.assertEqual(self.storage.read_range("big", 0, len(data)), data)
+
+    def test_pooled_client(self):
+        """Test threads share one client and its pool of connections."""
+        self.storage.put("f", io.BytesIO(CONTENT))
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            chunks = list(pool.map(
+                lambda i: self.storage.read_range("f", i * 1000, 1000), range(50)
+            ))
+        self.assertEqual(b"".join(chunks), CONTENT[:50_000])
+        self.assertEqual(self.storage._client.meta.config.max_pool_connections, 4)
+
+    def test_presigned_url(self):
+        self.storage.put("f", io.BytesIO(CONTENT))
+        url = self.storage.presigned_url("f", filename="report.bin")
+        with urllib.request.urlopen(url) as response:
+            self.assertEqual(response.read(), CONTENT)
+            self.assertIn("report.bin", response.headers["Content-Disposition"])
+
+
+class TestDownloadRoute(AppTestCase):
+    """Test files are downloaded through the storage backend."""
+    def setUp(self):
+        super().setUp()
+        with self.app.app_context():
+            from vaultShare.resources import get_db, get_storage
+            get_storage().put("ws/f1", io.BytesIO(CONTENT))
+            file_db = get_db(FileDB)
+            user_id = file_db._session.query(User.id).scalar()
+            file_db._session.add_all([
+                Workspace(id="ws", name="design", admin_id=user_id),
+                WorkspaceUser(id="wu", workspace_id="ws", user_id=user_id, role="user"),
+            ])
+            file_db._session.commit()
+            file_db.add_file("f1", "report.pdf", "ws/f1", "ws", len(CONTENT) / 2**20)
+            file_db.add_file("f2", "gone.pdf", "ws/f2", "ws", 0.1)
+
+    def test_download(self):
+        response = self.client.get("/workspaces/ws/files/f1/download")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_data(), CONTENT)
+        self.assertIn("report.pdf", response.headers["Content-Disposition"])
+        response.close()
+
+    def test_missing(self):
+        self.assertEqual(self.client.get("/workspaces/ws/files/f2/download").status_code, 404)
+        self.assertEqual(self.client.get("/workspaces/ws/files/f3/download").status_code, 404)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,100 @@
+"""
+Test login admission control.
+"""
+import unittest
+from vaultShare.auth.throttle import MemoryBackend, LoginThrottle
+
+
+class FakeClock:
+    """Manually advanced monotonic clock."""
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestMemoryBackend(unittest.TestCase):
+    """Test in-memory token buckets."""
+    def setUp(self):
+        self.clock = FakeClock()
+        self.backend = MemoryBackend(clock=self.clock)
+
+    def test_burst_then_reject(self):
+        """Test bucket admits `capacity` attempts then asks the client to wait."""
+        for _ in range(3):
+            self.assertEqual(self.backend.take("k", 3, 1.0), 0.0)
+        self.assertAlmostEqual(self.backend.take("k", 3, 1.0), 1.0)
+
+    def test_refill(self):
+        """Test tokens are refilled at `rate` per second."""
+        for _ in range(3):
+            self.backend.take("k", 3, 0.5)
+        self.clock.now = 2.0
+        self.assertEqual(self.backend.take("k", 3, 0.5), 0.0)
+        self.assertGreater(self.backend.take("k", 3, 0.5), 0.0)
+
+    def test_full_buckets_expire(self):
+        """Test refilled buckets are dropped from memory."""
+        self.backend.take("a", 2, 1.0)
+        self.clock.now = 5.0
+        self.backend.take("b", 2, 1.0)
+        self.assertEqual(len(self.backend), 1)
+
+    def test_max_entries(self):
+        """Test store never exceeds `max_entries`."""
+        backend = MemoryBackend(max_entries=10, clock=self.clock)
+        for i in range(50):
+            backend.take(str(i), 5, 0.01)
+        self.assertEqual(len(backend), 10)
+
+
+class TestLoginThrottle(unittest.TestCase):
+    """Test LoginThrottle admission."""
+    def setUp(self):
+        self.clock = FakeClock()
+        self.throttle = LoginThrottle(
+            account_capacity=2, account_rate=0.1,
+            ip_capacity=4, ip_rate=0.1,
+            backend=MemoryBackend(clock=self.clock)
+        )
+
+    def test_account_limit(self):
+        """Test an account is throttled for clients of the same subnet."""
+        self.assertFalse(self.throttle.admit("1.1.1.1", "Bob"))
+        self.assertFalse(self.throttle.admit("1.1.1.2", "bob"))
+        self.assertTrue(self.throttle.admit("1.1.1.3", "bob"))
+
+    def test_other_subnets_not_locked_out(self):
+        """Test failed attempts from one network leave other clients alone."""
+        for _ in range(2):
+            self.throttle.admit("1.1.1.1", "bob")
+        self.assertTrue(self.throttle.admit("1.1.1.1", "bob"))
+        self.assertFalse(self.throttle.admit("2.2.2.2", "bob"))
+        self.assertFalse(self.throttle.admit("2001:db8::1", "bob"))
+        self.assertFalse(self.throttle.admit("2001:db8::2", "bob"))
+        self.assertTrue(self.throttle.admit("2001:db8::3", "bob"))
+
+    def test_account_global_limit(self):
+        """Test an account is throttled across many networks."""
+        throttle = LoginThrottle(
+            account_capacity=2, account_rate=0.1, ip_capacity=4, ip_rate=0.1,
+            account_global_capacity=5, account_global_rate=0.01,
+            backend=MemoryBackend(clock=self.clock)
+        )
+        for i in range(5):
+            self.assertFalse(throttle.admit(f"10.0.{i}.1", "bob"))
+        self.assertTrue(throttle.admit("10.0.9.1", "bob"))
+
+    def test_ip_limit(self):
+        """Test a client IP is throttled across different accounts."""
+        for i in range(4):
+            self.assertFalse(self.throttle.admit("1.1.1.1", f"user{i}"))
+        self.assertTrue(self.throttle.admit("1.1.1.1", "user9"))
+
+    def test_success_refills_account(self):
+        """Test a successful login refills the account bucket of its subnet."""
+        self.throttle.admit("1.1.1.1", "bob")
+        self.throttle.admit("1.1.1.1", "bob")
+        self.throttle.login_succeeded("bob", "1.1.1.1")
+        self.assertFalse(self.throttle.admit("1.1.1.1", "bob"))
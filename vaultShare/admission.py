@@ -0,0 +1,169 @@
+"""
+Module contains the adaptive admission control of requests.
+
+Requests are sorted into lanes by route class, and each lane admits at
+most `limit` requests at once. A request over the limit is rejected right
+away with a 503 and `Retry-After`, instead of queuing behind PBKDF2
+hashing and SQLite write locks until every request times out.
+
+Limits adapt to latency with AIMD: every request finishing within the
+lane's target latency raises the limit by 1/limit, about one per round of
+requests, and a slower or failed request cuts it by `backoff`. Only
+requests admitted after the last cut can cut it again, so one slow burst
+costs a single cut. Past saturation the limit settles where latency meets
+the target, and the excess load is shed for the cost of a rejection.
+
+Lanes are independent, so logins saturating their lane leave reads
+served. Health checks are never limited.
+"""
+import threading
+import time
+from vaultShare.exceptions import ServiceUnavailable
+
+# Lane of requests that are always admitted
+HEALTH = "health"
+
+# Endpoints of each lane, other requests are "read" or "write" by method
+HEALTH_ENDPOINTS = frozenset({"main.index", "main.status"})
+AUTH_ENDPOINTS = frozenset({"main.login", "main.register", "main.change_password"})
+# Long polls and streams wait on purpose, their latency says nothing of load
+POLL_ENDPOINTS = frozenset({"alerts.poll_alerts", "alerts.stream_alerts"})
+
+
+def request_lane(endpoint: str, method: str, args) -> str:
+    """
+    Returns the lane of a request.
+
+    Args:
+        endpoint (str): Flask endpoint, None for unknown URLs
+        method (str): HTTP method
+        args: Query parameters
+    """
+    if endpoint in HEALTH_ENDPOINTS:
+        return HEALTH
+    if endpoint in AUTH_ENDPOINTS:
+        return "auth"
+    if endpoint in POLL_ENDPOINTS or (
+        endpoint == "workspaces.workspace_changes" and args.get("wait", "0") != "0"
+    ):
+        return "poll"
+    return "read" if method in ("GET", "HEAD", "OPTIONS") else "write"
+
+
+class AIMDLimit:
+    """
+    Concurrency limit of a lane, adapted to latency.
+
+    Attributes:
+        limit (float): Requests admitted at once, its integer part counts.
+        in_flight (int): Requests admitted and not finished.
+        target (float): Latency in seconds above which the limit is cut,
+        None for a fixed limit.
+    """
+    def __init__(self, initial: int, max_limit: int, target: float = None,
+                 min_limit: int = 1, backoff: float = 0.9, clock=time.monotonic):
+        self.limit = float(initial)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.target = target
+        self.backoff = backoff
+        self.in_flight = 0
+        self._clock = clock
+        self._cut_at = float("-inf")
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Admits a request if the lane is under its limit.
+
+        Returns:
+            float: Admission time to pass to `release`, None if rejected
+        """
+        with self._lock:
+            if self.in_flight >= int(self.limit):
+                return None
+            self.in_flight += 1
+            return self._clock()
+
+    def release(self, started: float, failed: bool = False):
+        """
+        Records the end of an admitted request and adapts the limit.
+
+        Args:
+            started (float): Time returned by `acquire`
+            failed (bool): The request failed, which counts as too slow
+        """
+        now = self._clock()
+        with self._lock:
+            self.in_flight -= 1
+            if self.target is None:
+                return
+            if failed or now - started > self.target:
+                # Requests admitted before the last cut saw the old limit
+                if started >= self._cut_at:
+                    self.limit = max(self.min_limit, self.limit * self.backoff)
+                    self._cut_at = now
+            elif self.in_flight * 2 >= self.limit:
+                # Only grow a limit that is in use
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+
+
+class AdmissionController:
+    """
+    Lanes of an app and their limits.
+
+    Attributes:
+        lanes (dict): AIMDLimit of each lane name.
+        retry_after (int): Seconds rejected clients are asked to wait.
+        rejected (dict): Requests rejected per lane.
+    """
+    def __init__(self, lanes: dict, retry_after: int = 1, clock=time.monotonic):
+        """
+        Args:
+            lanes (dict): (initial limit, max limit, target latency) of each
+            lane name, a None target keeps the limit fixed
+            retry_after (int): Seconds rejected clients are asked to wait
+        """
+        self.lanes = {
+            name: AIMDLimit(initial, max_limit, target, clock=clock)
+            for name, (initial, max_limit, target) in lanes.items()
+        }
+        self.retry_after = retry_after
+        self.rejected = dict.fromkeys(self.lanes, 0)
+
+    def admit(self, lane: str):
+        """
+        Admits a request to a lane.
+
+        Returns:
+            tuple: (lane, started) to pass to `release`, None for requests
+            of unlimited lanes
+
+        Raises:
+            ServiceUnavailable: If the lane is at its limit
+        """
+        limit = self.lanes.get(lane)
+        if limit is None:
+            return None
+        started = limit.acquire()
+        if started is None:
+            self.rejected[lane] += 1
+            raise ServiceUnavailable(
+                f"Server busy, retry in {self.retry_after} seconds", self.retry_after
+            )
+        return lane, started
+
+    def release(self, token: tuple, failed: bool = False):
+        """Records the end of a request admitted by `admit`."""
+        lane, started = token
+        self.lanes[lane].release(started, failed)
+
+    def stats(self) -> dict:
+        """Returns the limit, in-flight and rejected requests of each lane."""
+        return {
+            name: {
+                "limit": int(limit.limit), "in_flight": limit.in_flight,
+                "rejected": self.rejected[name]
+            }
+            for name, limit in self.lanes.items()
+        }
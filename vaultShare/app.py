@@ -1,28 +1,174 @@
 """
 VaultShare Flask app module.
+
+The app is built by `create_app`. Importing this module does no database
+work, resources are created lazily by `vaultShare.resources`.
 """
 import os
-from .auth.auth import Auth
+import math
+import random
+import click
+from .admission import AdmissionController, request_lane
+from .profiling import RequestProfile
+from .auth.throttle import LoginThrottle, MemoryBackend, RedisBackend
+from .config import Config
 from .exceptions import (
     MissingFieldError, InvalidFieldType,
-    UserAlreadyExists, NoUserFound
+    UserAlreadyExists, NoUserFound, TooManyRequests,
+    NoWorkspaceFound, WorkspaceLimitExceeded, NoFolderFound, NoFileFound,
+    NoExportFound, FileVersionConflict, ServiceUnavailable
+)
+from .resources import (
+    Resources, get_resources, get_auth, get_scrubbers, get_retention
 )
 from flask import (
+    Blueprint,
     Flask,
+    g,
     jsonify,
     request,
     make_response,
     redirect,
     abort
 )
+from flask.cli import with_appcontext
 from pathvalidate import is_valid_filename
 from .routes.users import users_bp
+from .routes.alerts import alerts_bp
+from .routes.workspaces import workspaces_bp
+from .routes.audit import audit_bp
+from .routes.utils import audit, current_admin
+
+main_bp = Blueprint("main", __name__)
+
+
+def create_app(config: dict = None) -> Flask:
+    """
+    Builds a VaultShare app.
+    
+    Args:
+        config (dict): Settings overriding `vaultShare.config.Config`.
+        Optional
+        
+    Returns:
+        app (Flask): The configured app, no database connection is opened
+        until a request needs one.
+        
+    Raises:
+        ValueError: If signed sessions are configured without a SECRET_KEY
+    """
+    app = Flask(__name__)
+    app.config.from_object(Config)
+    if config:
+        app.config.update(config)
+    if app.config["SESSION_MODE"] == "signed" and not app.config["SECRET_KEY"]:
+        raise ValueError("SECRET_KEY must be set when SESSION_MODE is \"signed\"")
+    
+    app.extensions["vaultshare"] = Resources(app.config)
+    app.register_blueprint(main_bp)
+    app.register_blueprint(users_bp, url_prefix="/users")       
+    app.register_blueprint(alerts_bp, url_prefix="/alerts")
+    app.register_blueprint(workspaces_bp, url_prefix="/workspaces")
+    app.register_blueprint(audit_bp, url_prefix="/audit")
+    app.cli.add_command(scrub_command)
+    app.cli.add_command(rebalance_shards_command)
+    app.cli.add_command(purge_command)
+    if app.config["ADMISSION_CONTROL"]:
+        app.before_request(_admit_request)
+        app.teardown_request(_release_request)
+    if app.config["PROFILE_DIR"]:
+        app.before_request(_start_profile)
+        app.after_request(_tag_profile)
+        app.teardown_request(_dump_profile)
+    
+    @app.teardown_appcontext
+    def close_sessions(exception=None):
+        app.extensions["vaultshare"].close_sessions()
+    
+    return app
+
+
+def _login_throttle() -> LoginThrottle:
+    """Returns the app's login throttle, created on first use."""
+    def factory():
+        config = get_resources().config
+        redis_url = config["LOGIN_THROTTLE_REDIS_URL"]
+        return LoginThrottle(
+            account_capacity=config["LOGIN_ACCOUNT_CAPACITY"],
+            account_rate=config["LOGIN_ACCOUNT_RATE"],
+            ip_capacity=config["LOGIN_IP_CAPACITY"],
+            ip_rate=config["LOGIN_IP_RATE"],
+            account_global_capacity=config["LOGIN_ACCOUNT_GLOBAL_CAPACITY"],
+            account_global_rate=config["LOGIN_ACCOUNT_GLOBAL_RATE"],
+            backend=RedisBackend(redis_url) if redis_url else MemoryBackend()
+        )
+    return get_resources().get("login_throttle", factory)
+
+
+def _admission() -> AdmissionController:
+    """Returns the app's admission controller, created on first use."""
+    def factory():
+        config = get_resources().config
+        return AdmissionController(
+            config["ADMISSION_LANES"], retry_after=config["ADMISSION_RETRY_AFTER"]
+        )
+    return get_resources().get("admission", factory)
+
+
+def _admit_request():
+    """Admits the request to the lane of its route, or sheds it with a 503."""
+    lane = request_lane(request.endpoint, request.method, request.args)
+    g.admission = _admission().admit(lane)
+
+
+def _release_request(exception=None):
+    token = g.pop("admission", None)
+    if token:
+        _admission().release(token, failed=exception is not None)
 
-auth = Auth()
-app = Flask(__name__)
-app.register_blueprint(users_bp, url_prefix="/users")       
 
-@app.route("/", methods=['GET'], strict_slashes=False)
+def _start_profile():
+    """
+    Profiles the request if a site admin asked for it with the profile
+    header, or if it is drawn by PROFILE_SAMPLE_RATE.
+    """
+    config = get_resources().config
+    mode = request.headers.get(config["PROFILE_HEADER"])
+    if mode:
+        if current_admin(required=False) is None:
+            mode = None
+        elif mode != "sample":
+            mode = "cprofile"
+    if not mode and random.random() < config["PROFILE_SAMPLE_RATE"]:
+        mode = config["PROFILE_MODE"]
+    if mode:
+        g.profile = RequestProfile(
+            mode, request.endpoint, request.method, request.path,
+            sample_interval=config["PROFILE_SAMPLE_INTERVAL"]
+        )
+        g.profile.start()
+
+
+def _tag_profile(response):
+    profile = g.get("profile")
+    if profile:
+        profile.status = response.status_code
+        response.headers["X-VaultShare-Profile-Id"] = profile.name
+    return response
+
+
+def _dump_profile(exception=None):
+    profile = g.pop("profile", None)
+    if profile:
+        profile.stop()
+        try:
+            profile.dump(get_resources().config["PROFILE_DIR"])
+        except OSError as e:
+            # TODO: Error would be logged using custom logger
+            print(f"Error writing profile {profile.name}: {e}")
+
+
+@main_bp.route("/", methods=['GET'], strict_slashes=False)
 def index():
     """
     Root endpoint
@@ -38,19 +184,19 @@ def index():
     payload = {"message": "Welcome to VaultShare"}
     return jsonify(payload)
 
-@app.route("/status", methods=['GET'], strict_slashes=False)
+@main_bp.route("/status", methods=['GET'], strict_slashes=False)
 def status():
     """
     Status endpoint.
     """
     return jsonify({"status": "OK"}), 200
 
-@app.route("/signup", methods=['POST'], strict_slashes=False)
+@main_bp.route("/signup", methods=['POST'], strict_slashes=False)
 def register():
     """
     Handles user account creation.
     """
-    auth = Auth()
+    auth = get_auth()
     
     username = request.form.get("username")
     email = request.form.get("email")
@@ -79,6 +225,7 @@ def register():
     
     try:
         user = auth.register_user(username, email, password)
+        audit("signup", user.id)
         payload = {
             "message": f"Awesome! {user.username} you are now a member of VaultShare family",
             "account_detail": {
@@ -93,11 +240,13 @@ def register():
     except ValueError as e:
         raise UserAlreadyExists(e.args[0])
     
-@app.route("/login", methods=["POST"], strict_slashes=False)
+@main_bp.route("/login", methods=["POST"], strict_slashes=False)
 def login():
     """
     Handles user account login.
     """
+    auth = get_auth()
+    login_throttle = _login_throttle()
     user = None
     session_id = request.cookies.get("session_id")
     
@@ -114,27 +263,34 @@ def login():
     if not password:
         raise MissingFieldError("Fill in your <password>")
     
-    if email and not username:
-        try:
+    if not ((email and not username) or (username and not email)):
+        raise MissingFieldError("Enter a valid <email> or <username> to login")
+    
+    # Reject throttled attempts before any lookup, hashing or DB write
+    account = email or username
+    retry_after = login_throttle.admit(ip=request.remote_addr, account=account)
+    if retry_after:
+        raise TooManyRequests("Too many login attempts, try again later", retry_after)
+    
+    try:
+        if email:
             user = auth.valid_login(password, email=email)
-        except ValueError as e:
-            raise InvalidFieldType(e.args[0])
-    elif username and not email:
-        try:
+        else:
             user = auth.valid_login(password, username=username)
-        except ValueError as e:
-            raise InvalidFieldType(e.args[0])
-    else:
-        raise MissingFieldError("Enter a valid <email> or <username> to login")
+    except ValueError as e:
+        audit("login_failed", account=account)
+        raise InvalidFieldType(e.args[0])
+    login_throttle.login_succeeded(account, request.remote_addr)
+    audit("login", user.id)
     
     payload = {
         "message": f"Welcome back {user.username} to VaultShare",
-        "session_id": user.session_id,
+        "session_id": auth.create_session(user.id),
         "recommend_actions": ["checkNotification", "creatWorkspace", "joinWorkspace"]
     }
     return jsonify(payload), 200
 
-@app.route("/logout", methods=['DELETE'], strict_slashes=False)
+@main_bp.route("/logout", methods=['DELETE'], strict_slashes=False)
 def logout():
     """
     Endpoint handles user loggout.
@@ -145,6 +301,7 @@ def logout():
     destroy the session and redirect the user to "GET '/'".
     If the user does not exist respond with a 403 HTTP status.
     """
+    auth = get_auth()
     session_id = request.cookies.get("session_id")
     
     if not session_id:
@@ -155,34 +312,161 @@ def logout():
     if not user:
         abort(403)
 
-    if not auth.destroy_session(user.session_id):
+    if not auth.destroy_session(session_id):
         abort(422)
+    audit("logout", user.id)
     return redirect("/")
 
-@app.errorhandler(403)
+@main_bp.route("/password", methods=['PUT'], strict_slashes=False)
+def change_password():
+    """
+    Changes the logged in user's password.
+    
+    Every session of the user, on every device, is revoked and the user
+    has to log in again.
+    """
+    auth = get_auth()
+    session_id = request.cookies.get("session_id")
+    user = auth.find_user_by_sessionid(session_id) if session_id else None
+    
+    if not user:
+        abort(403)
+    
+    password = request.form.get("password")
+    new_password = request.form.get("new_password")
+    
+    if not password:
+        raise MissingFieldError("Fill in your <password>")
+    
+    if not new_password:
+        raise MissingFieldError("Fill in your <new_password>")
+    
+    try:
+        num_of_revoked = auth.update_password(user.id, password, new_password)
+    except ValueError as e:
+        raise InvalidFieldType(e.args[0])
+    audit("password_changed", user.id, sessions_revoked=num_of_revoked)
+    return jsonify({
+        "message": "Password changed, log in again on your devices",
+        "sessions_revoked": num_of_revoked
+    }), 200
+
+@main_bp.app_errorhandler(403)
 def unauthorized_access(e):
     error = {"error": "Unauthorized access"}
     return jsonify(error), 403
   
-@app.errorhandler(MissingFieldError)
+@main_bp.app_errorhandler(MissingFieldError)
 def missing_field(e):
     error = {"error": e.msg}
     return jsonify(error), 402
 
-@app.errorhandler(InvalidFieldType)
+@main_bp.app_errorhandler(InvalidFieldType)
 def missing_field(e):
     error = {"error": e.msg}
     return jsonify(error), 422
 
-@app.errorhandler(NoUserFound)
+@main_bp.app_errorhandler(NoUserFound)
 def no_user_found(e):
     error = {'error': e.msg}
     return jsonify(error), 400
 
-@app.errorhandler(ValueError)
+@main_bp.app_errorhandler(NoWorkspaceFound)
+def no_workspace_found(e):
+    error = {'error': e.msg}
+    return jsonify(error), 404
+
+@main_bp.app_errorhandler(NoFolderFound)
+def no_folder_found(e):
+    error = {'error': e.msg}
+    return jsonify(error), 404
+
+@main_bp.app_errorhandler(NoFileFound)
+def no_file_found(e):
+    error = {'error': e.msg}
+    return jsonify(error), 404
+
+@main_bp.app_errorhandler(NoExportFound)
+def no_export_found(e):
+    error = {'error': e.msg}
+    return jsonify(error), 404
+
+@main_bp.app_errorhandler(FileVersionConflict)
+def file_version_conflict(e):
+    error = {'error': e.msg}
+    return jsonify(error), 409
+
+@main_bp.app_errorhandler(WorkspaceLimitExceeded)
+def workspace_limit_exceeded(e):
+    error = {'error': e.msg}
+    return jsonify(error), 409
+
+@main_bp.app_errorhandler(TooManyRequests)
+def too_many_requests(e):
+    error = {"error": e.msg}
+    response = jsonify(error)
+    response.headers["Retry-After"] = str(math.ceil(e.retry_after))
+    return response, 429
+
+@main_bp.app_errorhandler(ServiceUnavailable)
+def service_unavailable(e):
+    error = {"error": e.msg}
+    response = jsonify(error)
+    response.headers["Retry-After"] = str(math.ceil(e.retry_after))
+    return response, 503
+
+@main_bp.app_errorhandler(ValueError)
 def missing_field(e):
     error = {"error": e.msg}
     return jsonify(error), 400
    
+@click.command("scrub")
+@click.option("--loop", is_flag=True, help="Keep scrubbing, a pass every SCRUB_PASS_INTERVAL.")
+@with_appcontext
+def scrub_command(loop: bool):
+    """Checks stored files against their checksums, resuming the last pass."""
+    scrubbers = get_scrubbers()
+    if loop:
+        for scrubber in scrubbers:
+            scrubber.start()
+        for scrubber in scrubbers:
+            scrubber.join()
+    else:
+        for scrubber in scrubbers:
+            scrubber.run_pass()
+
+
+@click.command("purge")
+@click.option("--loop", is_flag=True, help="Keep purging, a pass every RETENTION_INTERVAL.")
+@with_appcontext
+def purge_command(loop: bool):
+    """Deletes alerts and invites past their retention, archiving them if set."""
+    retention = get_retention()
+    if loop:
+        retention.start()
+        retention.join()
+    else:
+        stats = retention.run_pass()
+        click.echo(f"Purged {stats['alerts']} alerts, {stats['invites']} invites")
+
+
+@click.command("rebalance-shards")
+@click.option("--batch-size", default=500, show_default=True, help="Rows copied at once.")
+@with_appcontext
+def rebalance_shards_command(batch_size: int):
+    """Moves workspaces to their shard after SHARD_DATABASE_URLS changed."""
+    stats = get_resources().router.rebalance(batch_size)
+    click.echo(f"Moved {stats['workspaces']} workspaces, {stats['rows']} rows")
+
+
 def run_app():
-    app.run(host="0.0.0.0", port="5000", debug=True)
+    create_app().run(host="0.0.0.0", port="5000", debug=True)
+
+
+def __getattr__(name):
+    """Builds the module level `app` on first access, for WSGI servers."""
+    if name == "app":
+        global app
+        app = create_app()
+        return app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
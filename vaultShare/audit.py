@@ -0,0 +1,174 @@
+"""
+Module contains the audit log of account and file events.
+
+Requests only push an event tuple onto an in-memory queue, which takes
+microseconds. A writer thread group-commits the queue to the append-only
+"audit_events" table. A batch is written once it holds `batch_size`
+events, or `flush_interval` seconds after its first event, so a busy app
+commits one transaction per batch instead of one per request.
+
+The queue is bounded. When writes fall behind and it fills up, `record`
+waits up to `block_timeout` for room, slowing the requests down, then
+drops the event and counts it. The queue is flushed when the writer
+stops, at exit included.
+"""
+import atexit
+import json
+import queue
+import threading
+import time
+from datetime import datetime, timezone
+from sqlalchemy.exc import SQLAlchemyError
+
+# Wakes the writer up to stop
+_STOP = object()
+
+
+def utcnow() -> datetime:
+    """Naive UTC time, as event times are stored."""
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+class AuditLog:
+    """
+    Queue of audit events, written in batches by a background thread.
+
+    Attributes:
+        batch_size (int): Events written per transaction at most.
+        flush_interval (float): Seconds an event waits for its batch to fill.
+        block_timeout (float): Seconds `record` waits for room in a full queue.
+        dropped (int): Events dropped because the queue stayed full.
+        failed (int): Events lost to database errors.
+    """
+    def __init__(self, audit_db, max_queue: int = 10_000, batch_size: int = 500,
+                 flush_interval: float = 1.0, block_timeout: float = 0.05):
+        """
+        Args:
+            audit_db (AuditDB): Writes the batches
+            max_queue (int): Events queued at most
+        """
+        self._audit_db = audit_db
+        self._queue = queue.Queue(max_queue)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.block_timeout = block_timeout
+        self.dropped = 0
+        self.failed = 0
+        self._thread = None
+
+    def record(self, event_type: str, user_id: str = None, workspace_id: str = None,
+               ip: str = None, detail: dict = None) -> bool:
+        """
+        Queues an event stamped with the current time.
+
+        Args:
+            event_type (str): e.g. "login" or "file_updated"
+            user_id (str): User acting. Optional
+            workspace_id (str): Workspace acted on. Optional
+            ip (str): Client address. Optional
+            detail (dict): JSON serializable details. Optional
+
+        Returns:
+            bool: False if the event was dropped
+        """
+        event = (utcnow(), event_type, user_id, workspace_id, ip, detail)
+        try:
+            self._queue.put(event, timeout=self.block_timeout)
+            return True
+        except queue.Full:
+            self.dropped += 1
+            return False
+
+    def write(self, events: list) -> int:
+        """Writes a batch of queued events in one transaction."""
+        rows = [
+            {
+                "created_at": created_at, "event_type": event_type, "user_id": user_id,
+                "workspace_id": workspace_id, "ip": ip,
+                "detail": json.dumps(detail, default=str) if detail else None,
+            }
+            for created_at, event_type, user_id, workspace_id, ip, detail in events
+        ]
+        try:
+            return self._audit_db.add_events(rows)
+        finally:
+            self._audit_db.close_session()
+
+    def _take(self, block: bool = True) -> tuple:
+        """
+        Takes the next batch off the queue.
+
+        Returns:
+            tuple: The batch, and whether the writer was asked to stop
+        """
+        try:
+            first = self._queue.get(block)
+        except queue.Empty:
+            return [], False
+        if first is _STOP:
+            return [], True
+        batch = [first]
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            try:
+                if block:
+                    event = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                else:
+                    event = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if event is _STOP:
+                return batch, True
+            batch.append(event)
+        return batch, False
+
+    def flush(self) -> int:
+        """
+        Writes every queued event from the calling thread, meant for when
+        the writer is not running.
+
+        Returns:
+            int: Number of events written
+        """
+        written = 0
+        while True:
+            batch, _ = self._take(block=False)
+            if not batch:
+                return written
+            written += self.write(batch)
+
+    def _run(self):
+        stopped = False
+        while not stopped:
+            batch, stopped = self._take()
+            if not batch:
+                continue
+            try:
+                self.write(batch)
+            except SQLAlchemyError as e:
+                self.failed += len(batch)
+                # TODO: Error would be logged using custom logger
+                print(f"Error writing audit events: {e}")
+
+    def start(self):
+        """Starts the writer thread, the queue is flushed again at exit."""
+        if self._thread is None:
+            self._thread = threading.Thread(
+                target=self._run, name="vaultshare-audit", daemon=True
+            )
+            self._thread.start()
+            atexit.register(self.stop)
+
+    def stop(self):
+        """Stops the writer thread once it wrote the queued events."""
+        if self._thread is not None:
+            self._queue.put(_STOP)
+            self._thread.join()
+            self._thread = None
+        try:
+            self.flush()
+        except SQLAlchemyError:
+            pass
+
+    def __len__(self):
+        return self._queue.qsize()
@@ -2,9 +2,13 @@
 Module contains class for Authentication.
 """
 from .auth_utils import _generate_uuid, verify_password, _hash_password
-from vaultShare.db import DB, UserDB, WorkspaceDB
+from .sessions import SessionTouches, SessionSweeper, utcnow
+from .tokens import RevocationList, SignedSessions
+from vaultShare.db import DB, UserDB, WorkspaceDB, SessionDB
 from vaultShare.db.models import User
 from sqlalchemy.exc import NoResultFound
+from datetime import timedelta
+import time
 
 
 class Auth:
@@ -14,9 +18,53 @@ class Auth:
     Attributes:
         _db (DB): Protected instance database object.
     """
-    def __init__(self):
-        self._db = DB()
-        self._userdb = UserDB()
+    # Users of signed tokens remembered as existing, stale ones are dropped
+    # once this many are held
+    MAX_USER_CHECKS = 100_000
+    
+    def __init__(self, database_url: str = "sqlite:///app.db", engine=None,
+                 session_ttl: float = 30 * 24 * 3600, touch_interval: float = 60.0,
+                 session_mode: str = "table", secret_key: str = None,
+                 revocation_refresh: float = 30.0):
+        """
+        Args:
+            database_url (str): The database connection URL. Defaults to
+            "sqlite:///app.db"
+            engine (Engine): Engine shared with other DB objects. Optional
+            session_ttl (float): Seconds a login session stays valid
+            touch_interval (float): Seconds a session's `last_seen` may lag
+            session_mode (str): "table" for sessions stored in the database,
+            "signed" for stateless signed tokens. Defaults to "table"
+            secret_key (str): Key signing the tokens, required in "signed"
+            mode
+            revocation_refresh (float): Seconds between reloads of the
+            revoked signed tokens, and between checks that the user of a
+            signed token still exists
+            
+        Raises:
+            ValueError: If the session mode is unknown, or "signed" without
+            a secret key
+        """
+        if session_mode not in ("table", "signed"):
+            raise ValueError(f"Unknown session mode '{session_mode}'")
+        self._db = DB(database_url, engine=engine)
+        self._userdb = UserDB(engine=self._db._engine)
+        self._sessiondb = SessionDB(engine=self._db._engine)
+        self.session_ttl = session_ttl
+        self.session_mode = session_mode
+        self._touches = SessionTouches(self._sessiondb, interval=touch_interval)
+        self._sweeper = None
+        self._signed = None
+        self._user_check_interval = revocation_refresh
+        # user id -> monotonic time the user of a signed token was last found
+        self._user_checks = {}
+        if session_mode == "signed":
+            self._signed = SignedSessions(
+                secret_key,
+                RevocationList(self._sessiondb, refresh_interval=revocation_refresh),
+                ttl=session_ttl
+            )
+            self._signed.revocations.load()
         
     def register_user(self, username: str, email: str, password: str) -> User:
         """
@@ -80,14 +128,12 @@ class Auth:
         if email and not username:
             try:
                 user = self._userdb.find_user(email=email)
-                self._userdb.update_user({"email": email}, session_id=_generate_uuid())
             except NoResultFound:
                 raise ValueError("Enter a registered <email>")
             
         elif username and not email:
             try:
                 user = self._userdb.find_user(username=username)
-                self._userdb.update_user({"username": username}, session_id=_generate_uuid())
             except NoResultFound:
                 raise ValueError("Enter a registered <username>")
             
@@ -96,32 +142,152 @@ class Auth:
         
         return user
     
+    def create_session(self, user_id: str) -> str:
+        """
+        Opens a new session for one of the user's devices. Sessions of the
+        user's other devices stay valid.
+        
+        Returns:
+            token (str): The session id
+        """
+        if self._signed:
+            self._user_checks[user_id] = time.monotonic()
+            return self._signed.issue(user_id)
+        token = _generate_uuid()
+        now = utcnow()
+        self._sessiondb.add_session(
+            token, user_id, created_at=now,
+            expires_at=now + timedelta(seconds=self.session_ttl)
+        )
+        return token
+    
     def find_user_by_sessionid(self, session_id: str) -> User:
         """
         Finds user using the sessionid passed.
+        
+        Returns None for unknown and expired sessions. The session's
+        `last_seen` is written behind, see vaultShare.auth.sessions.
+        
+        Signed tokens are verified without a database read, apart from a
+        check that the user still exists every `revocation_refresh`
+        seconds, and the returned User only has its `id` loaded.
         """
+        if self._signed:
+            user_id = self._signed.user_id(session_id)
+            if not user_id or not self._user_exists(user_id):
+                return None
+            return User(id=user_id)
         try:
-            user = self._userdb.find_user(session_id=session_id)
+            user, session = self._sessiondb.find_session_user(session_id)
         except NoResultFound:
-            user = None
-            
+            return None
+        
+        now = utcnow()
+        if session.expires_at <= now:
+            return None
+        if self._touches.due(session.last_seen, now):
+            self._touches.touch(session_id, now)
         return user
     
+    def _user_exists(self, user_id: str) -> bool:
+        """
+        Whether the user of a signed token still exists. Found users are
+        only looked up again after `revocation_refresh` seconds, so tokens
+        of a deleted user stop working within that delay.
+        """
+        now = time.monotonic()
+        checked = self._user_checks.get(user_id)
+        if checked is not None and now - checked < self._user_check_interval:
+            return True
+        try:
+            self._userdb.find_user(id=user_id)
+        except NoResultFound:
+            self._user_checks.pop(user_id, None)
+            return False
+        if len(self._user_checks) >= self.MAX_USER_CHECKS:
+            self._user_checks = {
+                key: value for key, value in self._user_checks.items()
+                if now - value < self._user_check_interval
+            }
+        self._user_checks[user_id] = now
+        return True
+    
     def destroy_session(self, session_id: str):
         """
-        Updates the corresponding user's session id to None
-        within the database.
+        Deletes the session from the database, the user's sessions on other
+        devices stay valid.
+        
+        Returns:
+            int: 1 if the session existed, else None
         """
         if not session_id:
             return None
+        if self._signed:
+            return 1 if self._signed.revoke(session_id) else None
+        return self._sessiondb.remove_session(session_id) or None
+    
+    def revoke_user_sessions(self, user_id: str) -> int:
+        """
+        Logs the user out of every device.
+        
+        Returns:
+            int: Number of sessions revoked, signed tokens are revoked all at
+            once and count as 1
+        """
+        if self._signed:
+            self._signed.revocations.revoke_user(user_id, self.session_ttl)
+            return 1
+        return self._sessiondb.remove_user_sessions(user_id)
+    
+    def update_password(self, user_id: str, password: str, new_password: str) -> int:
+        """
+        Changes the user's password and logs the user out of every device.
         
+        Args:
+            user_id (str): User id
+            password (str): Current password
+            new_password (str): New password
+            
+        Returns:
+            int: Number of sessions revoked
+            
+        Raises:
+            ValueError: If the user is not found or the current password is
+            not a match
+        """
         try:
-            user = self._userdb.find_user(session_id=session_id)
-            num_of_update = self._userdb.update_user(
-                {"session_id": session_id},
-                session_id=None)
-            if num_of_update:
-                return num_of_update
+            user = self._userdb.find_user(id=user_id)
         except NoResultFound:
-            pass
-        return None
+            raise ValueError("User not found")
+        
+        if not verify_password(password, user.hashed_password):
+            raise ValueError("Enter a valid <password>")
+        
+        self._userdb.update_user(
+            {"username": user.username}, hashed_password=_hash_password(new_password)
+        )
+        return self.revoke_user_sessions(user_id)
+    
+    def start_session_sweeper(self, flush_interval: float = 5.0,
+                              sweep_interval: float = 300.0,
+                              batch_size: int = 500) -> SessionSweeper:
+        """Starts the background thread writing touches and sweeping expired sessions."""
+        if self._sweeper is None:
+            self._sweeper = SessionSweeper(
+                self._sessiondb, self._touches, flush_interval=flush_interval,
+                sweep_interval=sweep_interval, batch_size=batch_size
+            )
+            self._sweeper.start()
+        return self._sweeper
+    
+    def stop_session_sweeper(self):
+        """Stops the sweeper thread, writing the pending touches."""
+        if self._sweeper is not None:
+            self._sweeper.stop()
+            self._sweeper = None
+    
+    def close_session(self):
+        """Closes the calling thread's database sessions."""
+        self._db.close_session()
+        self._userdb.close_session()
+        self._sessiondb.close_session()
@@ -0,0 +1,134 @@
+"""
+Module contains the workspace authorization cache.
+
+A user's memberships are loaded once into a compact map of
+workspace_id -> Membership(role, memory_allocated). Every write to
+"workspace_users" or "workspaces" bumps the version of the users it touches
+when its transaction commits, and cached maps with an older version are
+reloaded on their next lookup.
+"""
+import time
+import threading
+from collections import OrderedDict, namedtuple
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session, object_session
+from vaultShare.db.models import Workspace, WorkspaceUser
+
+Membership = namedtuple("Membership", ["role", "memory_allocated"])
+
+_lock = threading.Lock()
+# Bumped when a bulk statement makes the touched users unknown
+_epoch = 0
+_versions = {}
+
+
+def bump(user_ids=None):
+    """
+    Invalidates the cached memberships of the given users, or of every user
+    if `user_ids` is None.
+    """
+    global _epoch
+    with _lock:
+        if user_ids is None:
+            _epoch += 1
+            _versions.clear()
+            return
+        for user_id in user_ids:
+            _versions[user_id] = _versions.get(user_id, 0) + 1
+
+
+def _version(user_id: str) -> tuple:
+    return _epoch, _versions.get(user_id, 0)
+
+
+def _touched(session, user_ids):
+    session.info.setdefault("authz_touched", set()).update(user_ids)
+
+
+@event.listens_for(WorkspaceUser, "after_insert")
+@event.listens_for(WorkspaceUser, "after_update")
+@event.listens_for(WorkspaceUser, "after_delete")
+def _workspace_user_changed(mapper, connection, target):
+    _touched(object_session(target), [target.user_id])
+
+
+@event.listens_for(Workspace, "after_insert")
+@event.listens_for(Workspace, "after_update")
+@event.listens_for(Workspace, "after_delete")
+def _workspace_changed(mapper, connection, target):
+    # Workspace admins hold the "admin" role without a workspace_users row,
+    # a changed admin_id touches both the old and the new admin
+    admins = set(inspect(target).attrs.admin_id.history.sum())
+    admins.add(target.admin_id)
+    _touched(object_session(target), [admin for admin in admins if admin])
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _bulk_statement(orm_execute_state):
+    if orm_execute_state.is_update or orm_execute_state.is_delete:
+        mapper = orm_execute_state.bind_mapper
+        if mapper is not None and mapper.class_ in (Workspace, WorkspaceUser):
+            orm_execute_state.session.info["authz_touched_all"] = True
+
+
+@event.listens_for(Session, "after_commit")
+def _after_commit(session):
+    if session.info.pop("authz_touched_all", False):
+        session.info.pop("authz_touched", None)
+        bump()
+    elif "authz_touched" in session.info:
+        bump(session.info.pop("authz_touched"))
+
+
+@event.listens_for(Session, "after_rollback")
+def _after_rollback(session):
+    session.info.pop("authz_touched_all", None)
+    session.info.pop("authz_touched", None)
+
+
+class MembershipCache:
+    """
+    LRU cache of each user's workspace memberships.
+
+    Attributes:
+        max_users (int): Number of users whose memberships are kept.
+        ttl (float): Seconds before an entry is reloaded anyway, bounding
+        staleness from writes made by other processes.
+    """
+    def __init__(self, loader, max_users: int = 10_000, ttl: float = 300.0):
+        """
+        Args:
+            loader (callable): Takes a user id and returns its memberships
+            as a {workspace_id: Membership} dict.
+        """
+        self._loader = loader
+        self.max_users = max_users
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def memberships(self, user_id: str) -> dict:
+        """Returns the user's {workspace_id: Membership} map."""
+        version = _version(user_id)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry and entry[0] == version and now - entry[1] < self.ttl:
+                self._entries.move_to_end(user_id)
+                return entry[2]
+
+        memberships = self._loader(user_id)
+        with self._lock:
+            self._entries[user_id] = (version, now, memberships)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_users:
+                self._entries.popitem(last=False)
+        return memberships
+
+    def get(self, user_id: str, workspace_id: str) -> Membership:
+        """Returns the user's membership of a workspace, or None."""
+        return self.memberships(user_id).get(workspace_id)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
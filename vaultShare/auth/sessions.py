@@ -0,0 +1,127 @@
+"""
+Module contains the background upkeep of the "sessions" table.
+
+Session checks only read the table. The `last_seen` time of a session is
+buffered in memory and written behind, at most once per touch interval per
+session, as one batched UPDATE. Expired sessions are deleted by a sweeper in
+bounded chunks instead of by the requests that find them.
+"""
+import atexit
+import threading
+from datetime import datetime, timezone
+from sqlalchemy.exc import SQLAlchemyError
+
+
+def utcnow() -> datetime:
+    """Naive UTC time, as session times are stored."""
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+class SessionTouches:
+    """
+    Write-behind buffer of session `last_seen` times.
+
+    Attributes:
+        interval (float): Seconds a session's stored `last_seen` may lag
+        before a request touches it again.
+    """
+    def __init__(self, session_db, interval: float = 60.0):
+        """
+        Args:
+            session_db (SessionDB): Writes the buffered touches
+        """
+        self._session_db = session_db
+        self.interval = interval
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def due(self, last_seen: datetime, now: datetime) -> bool:
+        """Whether a session last seen at `last_seen` needs a touch."""
+        return (now - last_seen).total_seconds() >= self.interval
+
+    def touch(self, token: str, now: datetime):
+        """Buffers a touch, later touches of the same token replace it."""
+        with self._lock:
+            self._pending[token] = now
+
+    def flush(self) -> int:
+        """
+        Writes every buffered touch in one batch.
+
+        Returns:
+            int: Number of sessions updated
+        """
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+        try:
+            return self._session_db.touch_sessions(pending)
+        finally:
+            self._session_db.close_session()
+
+    def __len__(self):
+        return len(self._pending)
+
+
+class SessionSweeper:
+    """
+    Background thread flushing session touches and deleting expired sessions.
+
+    Attributes:
+        flush_interval (float): Seconds between touch flushes.
+        sweep_interval (float): Seconds between expiry sweeps.
+        batch_size (int): Expired sessions deleted per transaction.
+    """
+    def __init__(self, session_db, touches: SessionTouches,
+                 flush_interval: float = 5.0, sweep_interval: float = 300.0,
+                 batch_size: int = 500):
+        self._session_db = session_db
+        self._touches = touches
+        self.flush_interval = flush_interval
+        self.sweep_interval = sweep_interval
+        self.batch_size = batch_size
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def sweep(self) -> int:
+        """Deletes the sessions expired by now, returning how many."""
+        try:
+            return self._session_db.sweep_expired(utcnow(), self.batch_size)
+        finally:
+            self._session_db.close_session()
+
+    def _run(self):
+        next_sweep = 0.0
+        elapsed = 0.0
+        while not self._stopped.wait(self.flush_interval):
+            elapsed += self.flush_interval
+            try:
+                self._touches.flush()
+                if elapsed >= next_sweep:
+                    self.sweep()
+                    next_sweep = elapsed + self.sweep_interval
+            except SQLAlchemyError as e:
+                # TODO: Error would be logged using custom logger
+                print(f"Error maintaining sessions: {e}")
+
+    def start(self):
+        """Starts the sweeper thread, touches are flushed again at exit."""
+        if self._thread is None:
+            self._stopped.clear()
+            self._thread = threading.Thread(
+                target=self._run, name="vaultshare-sessions", daemon=True
+            )
+            self._thread.start()
+            atexit.register(self.stop)
+
+    def stop(self):
+        """Stops the sweeper thread and flushes the remaining touches."""
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        try:
+            self._touches.flush()
+        except SQLAlchemyError:
+            pass
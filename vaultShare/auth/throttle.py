@@ -0,0 +1,231 @@
+"""
+Module contains the login admission controller.
+
+Every login attempt costs 100k PBKDF2 iterations, so attempts are admitted
+through token buckets (one per client IP, one per account and client subnet,
+and a larger one per account) *before* any user lookup, hashing or database
+write happens.
+"""
+import ipaddress
+import time
+import threading
+from collections import OrderedDict
+
+
+class MemoryBackend:
+    """
+    In-process token bucket store.
+
+    Buckets are kept in an LRU ordered dict as compact
+    `[tokens, stamp, full_at]` lists. A bucket that has refilled to capacity
+    holds no information, so idle buckets are expired lazily and the store
+    never exceeds `max_entries`.
+
+    Attributes:
+        max_entries (int): Maximum number of buckets held in memory.
+    """
+    def __init__(self, max_entries: int = 100_000, clock=time.monotonic):
+        self.max_entries = max_entries
+        self._clock = clock
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key: str, capacity: float, rate: float, cost: float = 1.0) -> float:
+        """
+        Takes `cost` tokens from the bucket stored under `key`.
+
+        Args:
+            key (str): Bucket key.
+            capacity (float): Maximum number of tokens (burst size).
+            rate (float): Tokens refilled per second.
+            cost (float): Tokens needed by this attempt.
+
+        Returns:
+            float: 0.0 if the tokens were taken, else the number of seconds
+            to wait before enough tokens are available.
+        """
+        now = self._clock()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                tokens = capacity
+            else:
+                tokens = min(capacity, bucket[0] + (now - bucket[1]) * rate)
+
+            wait = 0.0
+            if tokens < cost:
+                wait = (cost - tokens) / rate
+            else:
+                tokens -= cost
+
+            # Third slot is the time at which the bucket is full again
+            self._buckets[key] = [tokens, now, now + (capacity - tokens) / rate]
+            self._buckets.move_to_end(key)
+            self._expire(now)
+            return wait
+
+    def reset(self, key: str):
+        """Drops the bucket stored under `key`, refilling it."""
+        with self._lock:
+            self._buckets.pop(key, None)
+
+    def _expire(self, now: float):
+        """
+        Evicts the least recently used buckets, either because they have
+        fully refilled or because the store is over `max_entries`.
+        """
+        while self._buckets:
+            full_at = next(iter(self._buckets.values()))[2]
+            if len(self._buckets) > self.max_entries or now >= full_at:
+                self._buckets.popitem(last=False)
+            else:
+                break
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+class RedisBackend:
+    """
+    Token bucket store shared between app processes through Redis.
+
+    The refill and take happen atomically inside a Lua script, and each
+    bucket key expires on its own once it would have refilled.
+
+    Requires the optional `redis` package.
+    """
+    SCRIPT = """
+    local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'stamp')
+    local capacity = tonumber(ARGV[1])
+    local rate = tonumber(ARGV[2])
+    local cost = tonumber(ARGV[3])
+    local now = tonumber(ARGV[4])
+    local tokens = capacity
+    if bucket[1] then
+        tokens = math.min(capacity, tonumber(bucket[1]) + (now - tonumber(bucket[2])) * rate)
+    end
+    local wait = 0
+    if tokens < cost then
+        wait = (cost - tokens) / rate
+    else
+        tokens = tokens - cost
+    end
+    redis.call('HSET', KEYS[1], 'tokens', tokens, 'stamp', now)
+    redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate))
+    return tostring(wait)
+    """
+
+    def __init__(self, url: str = "redis://localhost:6379/0", prefix: str = "vaultshare:login:"):
+        import redis
+
+        self._client = redis.Redis.from_url(url)
+        self._script = self._client.register_script(self.SCRIPT)
+        self.prefix = prefix
+
+    def take(self, key: str, capacity: float, rate: float, cost: float = 1.0) -> float:
+        wait = self._script(
+            keys=[self.prefix + key],
+            args=[capacity, rate, cost, time.time()]
+        )
+        return float(wait)
+
+    def reset(self, key: str):
+        self._client.delete(self.prefix + key)
+
+
+class LoginThrottle:
+    """
+    Admits or rejects login attempts before the password is verified.
+
+    The small account bucket is kept per client subnet (/24 for IPv4, /64
+    for IPv6), so failed attempts from elsewhere cannot lock the owner of
+    an account out. A much larger bucket per account still caps guesses
+    spread over many networks.
+
+    Attributes:
+        account_capacity (int): Attempts allowed in a burst per account and
+            client subnet.
+        account_rate (float): Attempts refilled per second per account and
+            client subnet.
+        account_global_capacity (int): Attempts allowed in a burst per
+            account from every client.
+        account_global_rate (float): Attempts refilled per second per
+            account from every client.
+        ip_capacity (int): Attempts allowed in a burst per client IP.
+        ip_rate (float): Attempts refilled per second per client IP.
+    """
+    def __init__(
+        self,
+        account_capacity: int = 5,
+        account_rate: float = 1 / 60,
+        ip_capacity: int = 20,
+        ip_rate: float = 1 / 6,
+        backend=None,
+        account_global_capacity: int = 100,
+        account_global_rate: float = 100 / 3600
+    ):
+        self.account_capacity = account_capacity
+        self.account_rate = account_rate
+        self.account_global_capacity = account_global_capacity
+        self.account_global_rate = account_global_rate
+        self.ip_capacity = ip_capacity
+        self.ip_rate = ip_rate
+        self._backend = backend if backend is not None else MemoryBackend()
+
+    @staticmethod
+    def _account_key(account: str) -> str:
+        return "acct:" + account.strip().lower()
+
+    @staticmethod
+    def _subnet(ip: str) -> str:
+        """Returns the /24 or /64 network of `ip`, `ip` itself if unparsable."""
+        try:
+            address = ipaddress.ip_address(ip)
+        except ValueError:
+            return ip
+        prefix = 24 if address.version == 4 else 64
+        return str(ipaddress.ip_network(f"{address}/{prefix}", strict=False))
+
+    def _client_key(self, account: str, ip: str = None) -> str:
+        return self._account_key(account) + "|" + (self._subnet(ip) if ip else "")
+
+    def admit(self, ip: str = None, account: str = None) -> float:
+        """
+        Takes one token from the client IP bucket, then from the account
+        buckets, the one of the client's subnet first.
+
+        Args:
+            ip (str): Client IP address. Optional
+            account (str): Username or email the attempt is made for. Optional
+
+        Returns:
+            float: 0.0 if the attempt is admitted, else the number of seconds
+            the client should wait before retrying.
+        """
+        if ip:
+            wait = self._backend.take("ip:" + ip, self.ip_capacity, self.ip_rate)
+            if wait:
+                return wait
+
+        if account:
+            wait = self._backend.take(
+                self._client_key(account, ip), self.account_capacity, self.account_rate
+            )
+            if wait:
+                return wait
+            wait = self._backend.take(
+                self._account_key(account), self.account_global_capacity,
+                self.account_global_rate
+            )
+            if wait:
+                return wait
+        return 0.0
+
+    def login_succeeded(self, account: str, ip: str = None):
+        """
+        Refills the account bucket of the client's subnet after a successful
+        login, so a legitimate user is not locked out by an earlier burst of
+        failed attempts.
+        """
+        if account:
+            self._backend.reset(self._client_key(account, ip))
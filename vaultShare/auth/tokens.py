@@ -0,0 +1,183 @@
+"""
+Module contains the stateless signed session tokens.
+
+A token is the signed list [user_id, token_id, issued_at_ms], verified with
+the app secret and no database access. Revocations, from logouts and
+password changes, are kept in a small in-memory set loaded from the
+"session_revocations" table at startup and refreshed from it periodically,
+so every process sees the revocations of the others within one refresh
+interval.
+"""
+import secrets
+import threading
+import time
+from datetime import datetime, timezone
+from itsdangerous import BadSignature, URLSafeSerializer
+
+SALT = "vaultshare.session"
+
+
+def _to_datetime(ms: int) -> datetime:
+    """Naive UTC datetime of epoch milliseconds, as revocations are stored."""
+    return datetime.fromtimestamp(ms / 1000, timezone.utc).replace(tzinfo=None)
+
+
+def _to_ms(value: datetime) -> int:
+    return int(value.replace(tzinfo=timezone.utc).timestamp() * 1000)
+
+
+class RevocationList:
+    """
+    In-memory view of the revoked signed tokens.
+
+    Attributes:
+        refresh_interval (float): Seconds between reloads of revocations
+        made by other processes.
+    """
+    def __init__(self, session_db, refresh_interval: float = 30.0, clock=time.time):
+        """
+        Args:
+            session_db (SessionDB): Stores the revocations
+            clock (callable): Returns the time in seconds. Defaults to
+            `time.time`
+        """
+        self._session_db = session_db
+        self.refresh_interval = refresh_interval
+        self._clock = clock
+        # token id -> expiry ms
+        self._tokens = {}
+        # user id -> (revoked before ms, expiry ms)
+        self._users = {}
+        self._loaded_at = None
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+
+    def _now_ms(self) -> int:
+        return int(self._clock() * 1000)
+
+    def _apply(self, kind: str, key: str, revoked_ms: int, expires_ms: int):
+        if kind == "token":
+            self._tokens[key] = expires_ms
+        elif key not in self._users or self._users[key][0] < revoked_ms:
+            self._users[key] = (revoked_ms, expires_ms)
+
+    def load(self):
+        """
+        Loads the revocations in effect, then only the newer ones on later
+        calls. Expired entries are dropped from memory.
+        """
+        now = self._now_ms()
+        since = None
+        if self._loaded_at is not None:
+            # Overlap by one interval for clock skew between processes
+            since = _to_datetime(self._loaded_at - int(self.refresh_interval * 1000))
+        try:
+            rows = self._session_db.find_revocations(_to_datetime(now), since)
+        finally:
+            self._session_db.close_session()
+        with self._lock:
+            for kind, key, revoked_at, expires_at in rows:
+                self._apply(kind, key, _to_ms(revoked_at), _to_ms(expires_at))
+            self._tokens = {k: v for k, v in self._tokens.items() if v > now}
+            self._users = {k: v for k, v in self._users.items() if v[1] > now}
+            self._loaded_at = now
+
+    def revoke_token(self, token_id: str, expires_ms: int):
+        now = self._now_ms()
+        self._session_db.add_revocation(
+            "token", token_id, _to_datetime(now), _to_datetime(expires_ms)
+        )
+        with self._lock:
+            self._apply("token", token_id, now, expires_ms)
+
+    def revoke_user(self, user_id: str, ttl: float):
+        """Revokes every token of the user issued until now."""
+        now = self._now_ms()
+        expires_ms = now + int(ttl * 1000)
+        self._session_db.add_revocation(
+            "user", user_id, _to_datetime(now), _to_datetime(expires_ms)
+        )
+        with self._lock:
+            self._apply("user", user_id, now, expires_ms)
+
+    def is_revoked(self, user_id: str, token_id: str, issued_ms: int) -> bool:
+        """Checks a token against the revocations, refreshing them when due."""
+        if self._loaded_at is None or (
+            self._now_ms() - self._loaded_at >= self.refresh_interval * 1000
+        ):
+            # One thread reloads, the others carry on with the current view
+            if self._refresh_lock.acquire(blocking=self._loaded_at is None):
+                try:
+                    self.load()
+                finally:
+                    self._refresh_lock.release()
+        if token_id in self._tokens:
+            return True
+        revoked = self._users.get(user_id)
+        return revoked is not None and issued_ms <= revoked[0]
+
+    def __len__(self):
+        return len(self._tokens) + len(self._users)
+
+
+class SignedSessions:
+    """
+    Issues and verifies signed, time limited session tokens.
+
+    Attributes:
+        ttl (float): Seconds a token stays valid.
+    """
+    def __init__(self, secret_key: str, revocations: RevocationList,
+                 ttl: float = 30 * 24 * 3600, clock=time.time):
+        """
+        Raises:
+            ValueError: If `secret_key` is empty
+        """
+        if not secret_key:
+            raise ValueError("A SECRET_KEY is required for signed sessions")
+        self._serializer = URLSafeSerializer(secret_key, salt=SALT)
+        self.revocations = revocations
+        self.ttl = ttl
+        self._clock = clock
+
+    def issue(self, user_id: str) -> str:
+        """Returns a new token of the user."""
+        issued_ms = int(self._clock() * 1000)
+        return self._serializer.dumps([user_id, secrets.token_urlsafe(12), issued_ms])
+
+    def verify(self, token: str) -> tuple:
+        """
+        Verifies the token's signature and expiry, without the revocations.
+
+        Returns:
+            tuple: (user_id, token_id, issued_ms), or None for invalid and
+            expired tokens
+        """
+        try:
+            user_id, token_id, issued_ms = self._serializer.loads(token)
+        except (BadSignature, TypeError, ValueError):
+            return None
+        if self._clock() * 1000 >= issued_ms + self.ttl * 1000:
+            return None
+        return user_id, token_id, issued_ms
+
+    def user_id(self, token: str) -> str:
+        """Returns the user id of a valid, unrevoked token, else None."""
+        claims = self.verify(token)
+        if claims is None or self.revocations.is_revoked(*claims):
+            return None
+        return claims[0]
+
+    def revoke(self, token: str) -> bool:
+        """
+        Revokes a single token.
+
+        Returns:
+            bool: False if the token was invalid or already revoked
+        """
+        claims = self.verify(token)
+        if claims is None or self.revocations.is_revoked(*claims):
+            return False
+        user_id, token_id, issued_ms = claims
+        self.revocations.revoke_token(token_id, issued_ms + int(self.ttl * 1000))
+        return True
@@ -0,0 +1,113 @@
+"""
+Module contains the default VaultShare app configuration.
+
+Every setting can be overridden through the `config` mapping passed to
+`create_app`, and the main ones through environment variables.
+"""
+import os
+
+
+class Config:
+    """Default configuration, loaded with `app.config.from_object`."""
+    DATABASE_URL = os.environ.get("VAULTSHARE_DATABASE_URL", "sqlite:///app.db")
+    SQL_ECHO = False
+    # Workspace data shards, see vaultShare.db.shards, e.g.
+    # "sqlite:///shard0.db,sqlite:///shard1.db". Empty keeps every table in
+    # DATABASE_URL. Run `flask rebalance-shards` after changing the list.
+    SHARD_DATABASE_URLS = [
+        url for url in os.environ.get("VAULTSHARE_SHARD_DATABASE_URLS", "").split(",") if url
+    ]
+
+    # Login admission control, see vaultShare.auth.throttle
+    LOGIN_ACCOUNT_CAPACITY = 5
+    LOGIN_ACCOUNT_RATE = 1 / 60
+    LOGIN_ACCOUNT_GLOBAL_CAPACITY = 100
+    LOGIN_ACCOUNT_GLOBAL_RATE = 100 / 3600
+    LOGIN_IP_CAPACITY = 20
+    LOGIN_IP_RATE = 1 / 6
+    # e.g. "redis://localhost:6379/0" to share limits between processes
+    LOGIN_THROTTLE_REDIS_URL = os.environ.get("VAULTSHARE_THROTTLE_REDIS_URL")
+
+    # Workspace authorization cache, see vaultShare.auth.authz
+    MEMBERSHIP_CACHE_USERS = 10_000
+    MEMBERSHIP_CACHE_TTL = 300.0
+
+    # Login sessions, see vaultShare.auth.sessions
+    # "table" stores sessions in the database, "signed" issues stateless
+    # tokens verified without it, see vaultShare.auth.tokens
+    SESSION_MODE = os.environ.get("VAULTSHARE_SESSION_MODE", "table")
+    SECRET_KEY = os.environ.get("VAULTSHARE_SECRET_KEY")
+    SESSION_REVOCATION_REFRESH = 30.0
+    SESSION_TTL = 30 * 24 * 3600
+    SESSION_TOUCH_INTERVAL = 60.0
+    SESSION_FLUSH_INTERVAL = 5.0
+    SESSION_SWEEP_INTERVAL = 300.0
+    SESSION_SWEEP_BATCH = 500
+
+    # Adaptive concurrency limits per route class, see vaultShare.admission
+    ADMISSION_CONTROL = os.environ.get("VAULTSHARE_ADMISSION_CONTROL", "1") == "1"
+    # Lane: (initial limit, max limit, target latency in seconds), a None
+    # target keeps the limit fixed
+    ADMISSION_LANES = {
+        "auth": (4, 32, 0.5),
+        "write": (16, 128, 0.25),
+        "read": (32, 256, 0.1),
+        "poll": (512, 512, None),
+    }
+    ADMISSION_RETRY_AFTER = 1
+
+    # On-demand request profiler, see vaultShare.profiling. Only installed
+    # when PROFILE_DIR is set
+    PROFILE_DIR = os.environ.get("VAULTSHARE_PROFILE_DIR")
+    # Site admins profile a request by sending the header, with "sample"
+    # for the stack sampler, any other value for cProfile
+    PROFILE_HEADER = "X-VaultShare-Profile"
+    # Fraction of all requests profiled with PROFILE_MODE
+    PROFILE_SAMPLE_RATE = float(os.environ.get("VAULTSHARE_PROFILE_SAMPLE_RATE", "0"))
+    PROFILE_MODE = "sample"
+    PROFILE_SAMPLE_INTERVAL = 0.005
+
+    # Audit log of account and file events, see vaultShare.audit
+    AUDIT_QUEUE_SIZE = 10_000
+    AUDIT_BATCH_SIZE = 500
+    AUDIT_FLUSH_INTERVAL = 1.0
+    # Seconds a request waits for room in a full queue before dropping its event
+    AUDIT_BLOCK_TIMEOUT = 0.05
+
+    # File storage and workspace exports, see vaultShare.file_mangager
+    # "local" keeps files under FILE_STORAGE_ROOT, "s3" in S3_BUCKET
+    STORAGE_BACKEND = os.environ.get("VAULTSHARE_STORAGE_BACKEND", "local")
+    FILE_STORAGE_ROOT = os.environ.get("VAULTSHARE_STORAGE_ROOT", "storage")
+    # Credentials come from the usual AWS_* environment variables
+    S3_BUCKET = os.environ.get("VAULTSHARE_S3_BUCKET")
+    S3_PREFIX = os.environ.get("VAULTSHARE_S3_PREFIX", "")
+    # e.g. "http://localhost:9000" for MinIO
+    S3_ENDPOINT_URL = os.environ.get("VAULTSHARE_S3_ENDPOINT_URL")
+    S3_REGION = os.environ.get("VAULTSHARE_S3_REGION")
+    S3_MAX_POOL_CONNECTIONS = 32
+    S3_PART_SIZE = 16 * 1024 * 1024
+    S3_UPLOAD_CONCURRENCY = 4
+    DOWNLOAD_URL_EXPIRES = 300
+    # Compress text-like files in storage, see file_mangager.compression
+    STORAGE_COMPRESSION = os.environ.get("VAULTSHARE_STORAGE_COMPRESSION", "0") == "1"
+    COMPRESSION_FRAME_SIZE = 1024 * 1024
+    COMPRESSION_LEVEL = 6
+    COMPRESSION_MAX_RATIO = 0.8
+    # Integrity scrubber, run with `flask --app vaultShare.app scrub`
+    SCRUB_RATE = 20 * 1024 * 1024 # bytes per second
+    SCRUB_BATCH_SIZE = 100
+    SCRUB_PASS_INTERVAL = 24 * 3600
+    # Alerts kept per alert_type and invites per status, in seconds, "*" for
+    # the others and None to keep them forever. Purge with
+    # `flask --app vaultShare.app purge`, see vaultShare.retention
+    ALERT_RETENTION = {"*": 90 * 24 * 3600}
+    INVITE_RETENTION = {"pending": 30 * 24 * 3600, "*": 90 * 24 * 3600}
+    RETENTION_BATCH_SIZE = 500
+    RETENTION_PAUSE = 0.05 # seconds between batches
+    RETENTION_INTERVAL = 3600
+    # Purged rows are appended to gzip JSON lines files there when set
+    RETENTION_ARCHIVE_DIR = os.environ.get("VAULTSHARE_RETENTION_ARCHIVE_DIR")
+    EXPORT_CHUNK_SIZE = 256 * 1024
+    EXPORT_BATCH_SIZE = 500
+    # Blocks of file signatures kept for delta sync, about 60 bytes each
+    SIGNATURE_CACHE_BLOCKS = 1_000_000
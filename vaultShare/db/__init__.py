@@ -1 +1,6 @@
-from .db import DB, UserDB, WorkspaceDB
\ No newline at end of file
+from .db import (
+    DB, UserDB, WorkspaceDB, WorkspaceUserDB, FolderDB, FileDB, AlertDB,
+    InviteDB, SessionDB, WorkspaceChangeDB, ScrubDB, AuditDB
+)
+from .search import SearchDB
+from .shards import ShardRouter
@@ -1,9 +1,22 @@
 """
 DB module for handling database interactions.
 """
-from .models import Base, User, Workspace
-from sqlalchemy import create_engine, URL
-from sqlalchemy.orm import sessionmaker
+from . import statements
+from .models import (
+    Base, User, Workspace, WorkspaceUser, Folder, File, Invite, Alert,
+    AlertCounter, UserSession, SessionRevocation, WorkspaceChange,
+    WorkspaceChangeCounter, ScrubCheckpoint, ContentRef, AuditEvent
+)
+from vaultShare.notifications import broker, dispatcher, deliver
+from sqlalchemy import (
+    create_engine, URL, select, update, insert, bindparam, func, literal,
+    union_all, case, String, and_, or_, delete, tuple_, exists, table, column,
+    MetaData
+)
+from sqlalchemy import event
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import sessionmaker, scoped_session
 from sqlalchemy.orm.session import Session
 from sqlalchemy.exc import (
     SQLAlchemyError,
@@ -11,6 +24,63 @@ from sqlalchemy.exc import (
     InvalidRequestError,
     )
 from sqlite3 import IntegrityError
+from concurrent.futures import ThreadPoolExecutor
+import json
+import uuid
+from datetime import datetime, timezone, timedelta
+
+
+def _cascades_declared(dbapi_connection) -> bool:
+    """
+    Whether the foreign keys of the database's tables have the ON DELETE
+    actions of the models. Tables not created yet will get them.
+    """
+    existing = {row[0] for row in dbapi_connection.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'table'"
+    )}
+    for table in Base.metadata.sorted_tables:
+        if table.name not in existing:
+            continue
+        expected = {
+            (fk.parent.name, fk.column.table.name, (fk.ondelete or "NO ACTION").upper())
+            for fk in table.foreign_keys
+        }
+        # Rows are (id, seq, table, from, to, on_update, on_delete, match)
+        declared = {
+            (row[3], row[2], row[6].upper())
+            for row in dbapi_connection.execute(f'PRAGMA foreign_key_list("{table.name}")')
+        }
+        if declared != expected:
+            return False
+    return True
+
+
+def enforce_foreign_keys(engine: Engine):
+    """
+    Turns on SQLite foreign keys for every connection of the engine, so
+    deletes cascade in the database instead of through loaded ORM objects.
+    
+    Only for engines holding the whole schema: SQLite checks a key against
+    a table of the same database file, so shards and a sharded primary
+    leave keys unchecked. Databases created before the models declared
+    their ON DELETE actions also leave them unchecked, as the tables would
+    refuse deletes instead of cascading. `_foreign_keys_enforced` tells
+    deletes which case they run in.
+    """
+    if engine.dialect.name != "sqlite":
+        return
+    
+    @event.listens_for(engine, "connect")
+    def foreign_keys(dbapi_connection, connection_record):
+        if _cascades_declared(dbapi_connection):
+            dbapi_connection.execute("PRAGMA foreign_keys=ON")
+
+
+def _foreign_keys_enforced(session: Session) -> bool:
+    """Whether deletes in the session's database cascade."""
+    if session.get_bind().dialect.name != "sqlite":
+        return True
+    return session.connection().exec_driver_sql("PRAGMA foreign_keys").scalar() == 1
 
 
 class DB:
@@ -19,11 +89,15 @@ class DB:
     
     Attributes:
         _engine: SQLAlchemy engine object for database connection.
-        __session: Memoized session object for database transactions.
+        __session: Thread scoped session registry for database transactions.
+        SHARDED (bool): Whether the class reads and writes workspace scoped
+        tables, routed to the workspace's shard by `ShardRouter`.
     """
+    SHARDED = False
     
     def __init__(
-        self, database_url: str = "sqlite:///app.db", echo: bool = False
+        self, database_url: str = "sqlite:///app.db", echo: bool = False,
+        engine: Engine = None
     ) -> None:
         """
         Initializes the DB class with a database connection.
@@ -33,10 +107,17 @@ class DB:
             "sqlite:///app.db"
             echo (bool): If True, SQLAlchemy logs all SQL statements.
             Defaults to False.
+            engine (Engine): Engine shared with other DB objects, its owner
+            is responsible for the schema. Defaults to None, creating a new
+            engine for `database_url`.
         """
-        self._engine = create_engine(database_url, echo=echo)
-        self.__session = None
-        self._initialize_database()
+        if engine is None:
+            self._engine = create_engine(database_url, echo=echo)
+            enforce_foreign_keys(self._engine)
+            self._initialize_database()
+        else:
+            self._engine = engine
+        self.__session = scoped_session(sessionmaker(bind=self._engine))
         
     def _initialize_database(self):
         """
@@ -56,18 +137,13 @@ class DB:
     @property
     def _session(self) -> Session:
         """
-        Memoized session object
+        Session of the calling thread, created on first use.
         """
-        if self.__session is None:
-            DBSession = sessionmaker(bind=self._engine)
-            self.__session = DBSession()
-        return self.__session
+        return self.__session()
     
     def close_session(self):
-        """Closes the active session to prevent memory leaks."""
-        if self.__session:
-            self.__session.close()
-            self.__session = None
+        """Closes the calling thread's session to prevent memory leaks."""
+        self.__session.remove()
     
     def delete_tables(self):
         """Drops all tables from Base class metadata."""
@@ -107,7 +183,10 @@ class DB:
         Raises:
             NoResultFound: When no entry satisfies the filter cirteron
         """
-        obj = self._session.query(model).filter_by(**kwargs).first()
+        obj = self._session.scalars(
+            statements.select_first(model, statements.filter_key(kwargs)),
+            statements.filter_params(kwargs)
+        ).first()
         
         if not obj:
             raise NoResultFound
@@ -151,7 +230,16 @@ class DB:
         Returns:
             num_of_updates (int): Number of records updated
         """
-        num_of_updates = self._session.query(model).filter_by(**update_filter).update(kwargs)
+        if not kwargs:
+            return 0
+        stmt = statements.update_where(
+            model, statements.filter_key(update_filter), tuple(sorted(kwargs))
+        )
+        params = statements.filter_params(update_filter)
+        params.update(statements.filter_params(kwargs, prefix="v_"))
+        # None values are still bound, "v_" parameters set columns to NULL
+        params.update({"v_" + key: None for key, value in kwargs.items() if value is None})
+        num_of_updates = self._session.execute(stmt, params).rowcount
         self._session.commit()
         return num_of_updates
 
@@ -166,14 +254,17 @@ class DB:
         Returns:
             num_of_deletes: Number of records deleted
         """
-        num_of_deletes = self._session.query(model).filter_by(**kwargs).delete()
+        num_of_deletes = self._session.execute(
+            statements.delete_where(model, statements.filter_key(kwargs)),
+            statements.filter_params(kwargs)
+        ).rowcount
         self._session.commit()
         return num_of_deletes
                  
     def validate_attr(self, model, passed_attr: dict, excluded_attr: list=[]):
+        columns = statements.column_keys(model)
         for key in passed_attr:
-            if key not in model.__table__.columns.keys()\
-                or key in excluded_attr:
+            if key not in columns or key in excluded_attr:
                 raise InvalidRequestError(key)
 
 
@@ -185,9 +276,12 @@ class UserDB(DB):
     """
     EXCLUDE_UPDATE_ATTR = ["id", "created_at"]
     
-    def __init__(self, database_url: str = "sqlite:///app.db", echo: bool = False):
+    def __init__(
+        self, database_url: str = "sqlite:///app.db", echo: bool = False,
+        engine: Engine = None
+    ):
         """Initialize class and parent class."""
-        super().__init__(database_url, echo)
+        super().__init__(database_url, echo, engine)
         
     def add_user(self, id: str, username: str, email: str, password: str) -> User:
         user = self.create(User, id=id, email=email, username=username, hashed_password=password)
@@ -208,8 +302,28 @@ class UserDB(DB):
         return num_of_updates
     
     def remove_user(self, **kwargs) -> int:
+        """
+        Deletes users, the database deletes their sessions, alerts,
+        workspaces and memberships.
+        
+        Unread counts of the deleted alerts and counts of content shared
+        with the deleted workspaces' files are fixed in the same transaction.
+        """
         self.validate_attr(User, kwargs)
         
+        if _foreign_keys_enforced(self._session):
+            # Alerts and files of the users' workspaces go with them, fix the
+            # unread counts of their readers and the shared content counts
+            workspace_ids = select(Workspace.id).where(
+                Workspace.admin_id.in_(select(User.id).filter_by(**kwargs))
+            )
+            _delete_alerts(self._session, Alert.workspace_id.in_(workspace_ids))
+            _release_content(self._session, list(self._session.scalars(
+                select(File.path).where(
+                    File.workspace_id.in_(workspace_ids),
+                    File.path.in_(select(ContentRef.path))
+                )
+            )))
         num_of_deletes = self.delete(User, **kwargs)
         return num_of_deletes
 
@@ -220,11 +334,15 @@ class WorkspaceDB(DB):
     
     WorkspaceDB class inherites attributes and methods from the DB class.
     """
+    SHARDED = True
     EXCLUDE_UPDATE_ATTR = ["id", "created_at", "memory_used"]
     
-    def __init__(self, database_url: str = "sqlite:///app.db", echo: bool = False):
+    def __init__(
+        self, database_url: str = "sqlite:///app.db", echo: bool = False,
+        engine: Engine = None
+    ):
         """Initialize class and parent class."""
-        super().__init__(database_url, echo)
+        super().__init__(database_url, echo, engine)
         
     def add_workspace(self, id: str, name: str, admin_id: str) -> Workspace:
         workspace = self.create(Workspace, id=id, name=name, admin_id=admin_id)
@@ -243,7 +361,1839 @@ class WorkspaceDB(DB):
         return num_of_updates
     
     def remove_workspace(self, **kwargs) -> int:
+        """
+        Deletes workspaces with their members, folders, files, invites,
+        alerts and change log.
+        
+        With foreign keys enforced, a single DELETE of the workspaces
+        cascades in the database. Shards cannot enforce them, there every
+        workspace table is cleared by workspace id. Unread counts of the
+        deleted alerts and counts of shared content are fixed in the same
+        transaction.
+        
+        Returns:
+            num_of_deletes (int): Number of workspaces deleted
+        """
+        from .shards import sharded_tables, _shard_key
         self.validate_attr(Workspace, kwargs)
         
-        num_of_deletes = self.delete(Workspace, **kwargs)
+        session = self._session
+        workspace_ids = list(session.scalars(select(Workspace.id).filter_by(**kwargs)))
+        if not workspace_ids:
+            return 0
+        _delete_alerts(session, Alert.workspace_id.in_(workspace_ids))
+        _release_content(session, list(session.scalars(
+            select(File.path).where(
+                File.workspace_id.in_(workspace_ids),
+                File.path.in_(select(ContentRef.path))
+            )
+        )))
+        if not _foreign_keys_enforced(session):
+            for table in reversed(sharded_tables()):
+                key = _shard_key(table)
+                if key is not None and table.name != Workspace.__tablename__:
+                    session.execute(delete(table).where(key.in_(workspace_ids)))
+        num_of_deletes = session.execute(
+            delete(Workspace).where(Workspace.id.in_(workspace_ids))
+        ).rowcount
+        session.commit()
         return num_of_deletes
+    
+    def find_memberships(self, user_id: str) -> dict:
+        """
+        Finds every workspace the user belongs to with a single query.
+        
+        Workspace admins get the "admin" role even without a
+        "workspace_users" row.
+        
+        Returns:
+            dict: Mapping of workspace_id to (role, memory_allocated)
+        """
+        admin = select(
+            Workspace.id, literal("admin"), Workspace.total_memory, literal(1)
+        ).where(Workspace.admin_id == user_id)
+        member = select(
+            WorkspaceUser.workspace_id, WorkspaceUser.role, WorkspaceUser.memory_allocated,
+            literal(0).label("priority")
+        ).where(WorkspaceUser.user_id == user_id)
+        
+        rows = union_all(member, admin)
+        memberships = {}
+        for workspace_id, role, memory_allocated, _ in self._session.execute(
+            rows.order_by(rows.selected_columns.priority)
+        ):
+            # Admin rows sort last and win over a "user" membership
+            memberships[workspace_id] = (role, memory_allocated)
+        return memberships
+    
+    def clone_workspace(self, source_id: str, workspace_id: str, name: str, admin_id: str,
+                        source_path: str = None) -> dict:
+        """
+        Creates a workspace holding a copy of every folder and file of another.
+        
+        Only rows are copied, with a few INSERT ... SELECT statements in one
+        transaction. Copied files share the stored content of the source
+        files until either is modified, see `FileDB.update_file_content`.
+        Members and invites are not copied.
+        
+        Args:
+            source_id (str): Workspace to copy
+            workspace_id (str): Id of the new workspace
+            name (str): Name of the new workspace
+            admin_id (str): Admin of the new workspace
+            source_path (str): SQLite file holding the source workspace, when
+            it is another database than this object's, e.g. another shard.
+            Optional
+            
+        Returns:
+            dict: Number of "folders" and "files" copied
+            
+        Raises:
+            NoResultFound: If the source workspace does not exist
+        """
+        with self._engine.connect() as conn:
+            schema = None
+            if source_path is not None:
+                # Databases are attached outside of transactions
+                conn.exec_driver_sql(f"ATTACH DATABASE ? AS {CLONE_SOURCE}", (source_path,))
+                conn.commit()
+                schema = CLONE_SOURCE
+            try:
+                workspaces, folders, files = _clone_tables(schema)
+                with conn.begin():
+                    created = conn.execute(insert(Workspace.__table__).from_select(
+                        ["id", "name", "admin_id", "total_memory", "memory_used",
+                         "max_users", "created_at"],
+                        select(
+                            literal(workspace_id), literal(name), literal(admin_id),
+                            workspaces.c.total_memory, workspaces.c.memory_used,
+                            workspaces.c.max_users, literal(datetime.now(timezone.utc))
+                        ).where(workspaces.c.id == source_id)
+                    )).rowcount
+                    if not created:
+                        raise NoResultFound
+                    num_of_folders, num_of_files, last_seqs = _copy_tree(
+                        conn, folders, files, workspace_id,
+                        folders.c.workspace_id == source_id, files.c.workspace_id == source_id
+                    )
+            finally:
+                if schema is not None:
+                    conn.exec_driver_sql(f"DETACH DATABASE {CLONE_SOURCE}")
+                    conn.commit()
+        _changes_recorded(self._engine, last_seqs, num_of_folders + num_of_files)
+        return {"folders": num_of_folders, "files": num_of_files}
+
+
+class WorkspaceUserDB(DB):
+    """
+    WorkspaceUserDB provides database interaction with "workspace_users" table.
+    
+    WorkspaceUserDB class inherites attributes and methods from the DB class.
+    """
+    SHARDED = True
+    EXCLUDE_UPDATE_ATTR = ["id", "workspace_id", "user_id", "created_at"]
+    
+    def __init__(
+        self, database_url: str = "sqlite:///app.db", echo: bool = False,
+        engine: Engine = None
+    ):
+        """Initialize class and parent class."""
+        super().__init__(database_url, echo, engine)
+    
+    def add_member(
+        self, id: str, workspace_id: str, user_id: str, role: str = "user",
+        memory_allocated: float = 0.0
+    ) -> WorkspaceUser:
+        member = self.create(
+            WorkspaceUser, id=id, workspace_id=workspace_id, user_id=user_id,
+            role=role, memory_allocated=memory_allocated
+        )
+        return member
+    
+    def find_member(self, **kwargs) -> WorkspaceUser:
+        self.validate_attr(WorkspaceUser, kwargs)
+        member = self.retrieve(WorkspaceUser, **kwargs)
+        return member
+    
+    def update_member(self, update_filter, **kwargs) -> int:
+        self.validate_attr(WorkspaceUser, update_filter)
+        self.validate_attr(WorkspaceUser, kwargs, self.EXCLUDE_UPDATE_ATTR)
+        num_of_updates = self.update(WorkspaceUser, update_filter, **kwargs)
+        return num_of_updates
+    
+    def remove_member(self, **kwargs) -> int:
+        self.validate_attr(WorkspaceUser, kwargs)
+        
+        num_of_deletes = self.delete(WorkspaceUser, **kwargs)
+        return num_of_deletes
+
+
+# Change log entity type and parent column of the recorded models
+_ENTITIES = {Folder: ("folder", "parent_folder_id"), File: ("file", "folder_id")}
+
+
+def _upsert(session, table):
+    """
+    INSERT of `table` supporting ON CONFLICT on the dialect of `session`, a
+    Session or a Connection.
+    """
+    bind = session.get_bind() if isinstance(session, Session) else session
+    if bind.dialect.name == "postgresql":
+        return postgresql.insert(table)
+    return sqlite.insert(table)
+
+
+def _record_changes(session: Session, changes: list) -> dict:
+    """
+    Appends changes to "workspace_changes" within the open transaction.
+    
+    Each workspace's seq range is taken from its "workspace_change_counters"
+    row with one INSERT ... ON CONFLICT DO UPDATE, which creates the row on
+    a workspace's first change and otherwise locks it until the commit, so
+    seqs are handed out gap free and in commit order.
+    
+    Args:
+        session (Session): Session holding the open transaction
+        changes (list): Change dicts with "workspace_id", "entity_type",
+        "entity_id", "op", "parent_id" and "name"
+        
+    Returns:
+        dict: Mapping of workspace_id to its last recorded seq
+    """
+    counters = WorkspaceChangeCounter.__table__
+    by_workspace = {}
+    for change in changes:
+        by_workspace.setdefault(change["workspace_id"], []).append(change)
+    
+    now = datetime.now(timezone.utc)
+    rows = []
+    last_seqs = {}
+    for workspace_id, workspace_changes in by_workspace.items():
+        count = len(workspace_changes)
+        # Concurrent first changes of a workspace cannot both insert the row
+        session.execute(
+            _upsert(session, counters)
+            .values(workspace_id=workspace_id, seq=count, horizon=0)
+            .on_conflict_do_update(
+                index_elements=[counters.c.workspace_id],
+                set_={"seq": counters.c.seq + count}
+            )
+        )
+        seq = session.scalar(
+            select(counters.c.seq).where(counters.c.workspace_id == workspace_id)
+        )
+        for i, change in enumerate(workspace_changes, start=seq - count + 1):
+            rows.append(dict(change, seq=i, created_at=now))
+        last_seqs[workspace_id] = seq
+    if rows:
+        session.execute(insert(WorkspaceChange.__table__), rows)
+    return last_seqs
+
+
+def _change(row, entity_type: str, op: str) -> dict:
+    return {
+        "workspace_id": row.workspace_id, "entity_type": entity_type,
+        "entity_id": row.id, "op": op, "parent_id": row.parent_id,
+        "name": row.name,
+    }
+
+
+def _changed_rows(session: Session, model, where) -> list:
+    parent = getattr(model, _ENTITIES[model][1])
+    return session.execute(
+        select(model.id, model.workspace_id, model.name, parent.label("parent_id"))
+        .where(where)
+    ).all()
+
+
+def _add_recorded(session: Session, obj) -> dict:
+    """Adds a folder or file and records its "create" change, uncommitted."""
+    entity_type, parent = _ENTITIES[type(obj)]
+    session.add(obj)
+    return _record_changes(session, [{
+        "workspace_id": obj.workspace_id, "entity_type": entity_type,
+        "entity_id": obj.id, "op": "create", "parent_id": getattr(obj, parent),
+        "name": obj.name,
+    }])
+
+
+def _update_recorded(session: Session, model, criteria: dict, values: dict) -> tuple:
+    """
+    Updates the folders or files matching `criteria` and records a change
+    per row, uncommitted. Changing the parent folder is a "move", anything
+    else an "update".
+    
+    Returns:
+        tuple: (number of rows updated, last seq of each workspace)
+    """
+    entity_type, parent = _ENTITIES[model]
+    ids = session.scalars(select(model.id).filter_by(**criteria)).all()
+    if not ids:
+        return 0, {}
+    where = model.id.in_(ids)
+    num_of_updates = session.execute(
+        update(model).where(where).values(**values)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    op = "move" if parent in values else "update"
+    last_seqs = _record_changes(session, [
+        _change(row, entity_type, op) for row in _changed_rows(session, model, where)
+    ])
+    return num_of_updates, last_seqs
+
+
+def _delete_recorded(session: Session, model, criteria) -> tuple:
+    """
+    Deletes the folders or files matching `criteria` and records a "delete"
+    change per row, uncommitted.
+    
+    Args:
+        criteria: filter_by keywords as a dict, or a where clause
+    
+    Returns:
+        tuple: (number of rows deleted, last seq of each workspace)
+    """
+    entity_type, _ = _ENTITIES[model]
+    query = select(model.id)
+    query = query.filter_by(**criteria) if isinstance(criteria, dict) else query.where(criteria)
+    ids = session.scalars(query).all()
+    if not ids:
+        return 0, {}
+    where = model.id.in_(ids)
+    changes = [_change(row, entity_type, "delete") for row in _changed_rows(session, model, where)]
+    # The rowcount leaves out subfolders the foreign keys cascaded to
+    session.execute(delete(model).where(where).execution_options(synchronize_session=False))
+    return len(changes), _record_changes(session, changes)
+
+
+def _compact_changes(session: Session, workspace_id: str, keep: int,
+                     tombstones_before: datetime = None, batch_size: int = 1000) -> int:
+    """
+    Compacts a workspace's change log, committing after every batch.
+    
+    Changes older than the last `keep` are dropped once a later change of
+    the same entity exists, so the log holds about one row per entity.
+    Deletes recorded before `tombstones_before` are dropped as well, and the
+    workspace horizon moves past them.
+    
+    Returns:
+        num_of_deletes (int): Number of changes dropped
+    """
+    changes = WorkspaceChange.__table__
+    counters = WorkspaceChangeCounter.__table__
+    upto = (session.scalar(
+        select(counters.c.seq).where(counters.c.workspace_id == workspace_id)
+    ) or 0) - keep
+    if upto <= 0:
+        return 0
+    
+    # Aliases keep the subqueries apart from the DELETE target
+    old = changes.alias("old")
+    newer = changes.alias("newer")
+    superseded = select(old.c.seq).where(
+        old.c.workspace_id == workspace_id, old.c.seq <= upto,
+        exists().where(
+            newer.c.workspace_id == old.c.workspace_id,
+            newer.c.entity_type == old.c.entity_type,
+            newer.c.entity_id == old.c.entity_id,
+            newer.c.seq > old.c.seq
+        )
+    )
+    batches = [superseded.limit(batch_size)]
+    horizon = None
+    if tombstones_before is not None:
+        tombstones = select(old.c.seq).where(
+            old.c.workspace_id == workspace_id, old.c.seq <= upto,
+            old.c.op == "delete", old.c.created_at < tombstones_before
+        )
+        horizon = session.scalar(select(func.max(tombstones.subquery().c.seq)))
+        if horizon is not None:
+            batches.append(tombstones.where(old.c.seq <= horizon).limit(batch_size))
+    
+    num_of_deletes = 0
+    for batch in batches:
+        while True:
+            deleted = session.execute(
+                delete(changes).where(
+                    changes.c.workspace_id == workspace_id,
+                    changes.c.seq.in_(batch.scalar_subquery())
+                )
+            ).rowcount
+            session.commit()
+            num_of_deletes += deleted
+            if deleted < batch_size:
+                break
+    if horizon is not None:
+        session.execute(
+            update(counters).where(
+                counters.c.workspace_id == workspace_id, counters.c.horizon < horizon
+            ).values(horizon=horizon)
+        )
+        session.commit()
+    return num_of_deletes
+
+
+# Compactions get their own worker, so a slow one never holds up the
+# notifications queued on the dispatcher
+compactor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="vaultshare-compact")
+
+
+def _changes_recorded(engine: Engine, last_seqs: dict, count: int = 1):
+    """
+    Publishes committed changes to the workspaces' broker topics, and hands
+    a compaction to the `compactor` worker each time a workspace's log
+    grows by another `WorkspaceChangeDB.COMPACT_EVERY` changes.
+    """
+    every = WorkspaceChangeDB.COMPACT_EVERY
+    for workspace_id, seq in last_seqs.items():
+        broker.publish(WorkspaceChangeDB.topic(workspace_id), {"seq": seq})
+        if seq // every > (seq - count) // every:
+            compactor.submit(WorkspaceChangeDB.compact_in_background, engine, workspace_id)
+
+
+def _folder_tree(workspace_id: str, folder_id: str = None, max_depth: int = 256):
+    """
+    Recursive CTE of the folders under `folder_id`, or under every root
+    folder of the workspace, with their "/" joined path from that root.
+    
+    Args:
+        max_depth (int): Nesting depth the walk stops at, guarding against
+        cyclic parent references
+    """
+    folders = Folder.__table__
+    anchor = select(
+        folders.c.id, folders.c.name.label("path"), literal(0).label("depth")
+    ).where(folders.c.workspace_id == workspace_id)
+    if folder_id is None:
+        anchor = anchor.where(folders.c.parent_folder_id.is_(None))
+    else:
+        anchor = anchor.where(folders.c.id == folder_id)
+    tree = anchor.cte("tree", recursive=True)
+    return tree.union_all(
+        select(folders.c.id, tree.c.path + "/" + folders.c.name, tree.c.depth + 1)
+        .where(folders.c.parent_folder_id == tree.c.id, tree.c.depth < max_depth)
+    )
+
+
+# Schema name of the database a workspace is cloned from, when attached
+CLONE_SOURCE = "clone_source"
+
+# Per connection map of copied rows to their new ids
+_clone_ids = table("clone_ids", column("old_id"), column("new_id"))
+
+
+def _clone_tables(schema: str = None) -> tuple:
+    """The workspace, folder and file tables copies are read from."""
+    tables = (Workspace.__table__, Folder.__table__, File.__table__)
+    if schema is None:
+        return tables
+    metadata = MetaData()
+    return tuple(t.to_metadata(metadata, schema=schema) for t in tables)
+
+
+def _share_content(conn, files, file_where):
+    """
+    Counts the files of `file_where` once more in "content_refs", with one
+    UPDATE for content already shared and one INSERT for the rest.
+    """
+    refs = ContentRef.__table__
+    paths = (
+        select(files.c.path, func.count().label("copies"))
+        .where(file_where).group_by(files.c.path).subquery()
+    )
+    conn.execute(
+        update(refs).where(refs.c.path.in_(select(paths.c.path))).values(
+            refs=refs.c.refs + select(paths.c.copies)
+            .where(paths.c.path == refs.c.path).scalar_subquery()
+        )
+    )
+    # Unshared content had one file per path, it now has two
+    conn.execute(insert(refs).from_select(
+        ["path", "refs"],
+        select(paths.c.path, paths.c.copies * 2)
+        .where(paths.c.path.not_in(select(refs.c.path)))
+    ))
+
+
+def _release_content(session, paths: list):
+    """
+    Counts files that stopped pointing at their content out of
+    "content_refs", dropping the rows of content no longer shared.
+    """
+    if not paths:
+        return
+    refs = ContentRef.__table__
+    released = {}
+    for path in paths:
+        released[path] = released.get(path, 0) + 1
+    session.execute(
+        refs.update().where(refs.c.path == bindparam("b_path"))
+        .values(refs=refs.c.refs - bindparam("b_count")),
+        [{"b_path": path, "b_count": count} for path, count in released.items()]
+    )
+    session.execute(delete(refs).where(refs.c.path.in_(list(released)), refs.c.refs <= 1))
+
+
+def _charge_memory(session: Session, workspace_id: str, user_id: str, delta: float):
+    """
+    Adds a file's size change in MB to its workspace's "memory_used" within
+    the open transaction, after the file row got its new size.
+    
+    Growth is refused past the workspace's `total_memory`, checked in the
+    UPDATE itself so concurrent writers cannot both pass, and for files of
+    members other than the workspace admin past the owner's
+    `memory_allocated` in the workspace.
+    
+    Raises:
+        ValueError: If the growth is refused
+    """
+    workspaces = Workspace.__table__
+    used = func.coalesce(workspaces.c.memory_used, 0) + delta
+    if delta <= 0:
+        session.execute(
+            update(workspaces).where(workspaces.c.id == workspace_id)
+            .values(memory_used=case((used < 0, 0), else_=used))
+        )
+        return
+    charged = session.execute(
+        update(workspaces).where(
+            workspaces.c.id == workspace_id,
+            or_(workspaces.c.total_memory.is_(None), used <= workspaces.c.total_memory)
+        ).values(memory_used=used)
+    ).rowcount
+    if not charged:
+        raise ValueError(f"Workspace {workspace_id} is out of memory")
+    if user_id is None:
+        return
+    allocated = session.scalar(
+        select(func.coalesce(WorkspaceUser.memory_allocated, 0))
+        .join(Workspace, Workspace.id == WorkspaceUser.workspace_id)
+        .where(WorkspaceUser.workspace_id == workspace_id, WorkspaceUser.user_id == user_id,
+               Workspace.admin_id != user_id)
+    )
+    if allocated is not None and session.scalar(
+        select(func.sum(File.size))
+        .where(File.workspace_id == workspace_id, File.user_id == user_id)
+    ) > allocated:
+        raise ValueError("The file owner's memory quota is used up")
+
+
+def _copy_tree(conn, folders, files, workspace_id: str, folder_where, file_where,
+               root: tuple = None) -> tuple:
+    """
+    Copies folder and file rows into `workspace_id` with INSERT ... SELECT
+    statements, within the connection's open transaction.
+    
+    The copies get new ids from the "clone_ids" temp table, which maps
+    every copied row, so parent references are rewritten by a join and the
+    row count never goes through Python twice. Copied files share their
+    stored content, counted in "content_refs", and a "create" change is
+    recorded per copy.
+    
+    Args:
+        conn (Connection): Connection holding the open transaction
+        folders, files: Tables the rows are read from
+        workspace_id (str): Workspace the copies belong to
+        folder_where, file_where: Criteria of the copied rows
+        root (tuple): Id of a copied folder and the values its copy gets,
+        e.g. a new parent. Optional
+        
+    Returns:
+        tuple: (number of folders, number of files, last seq of the workspace)
+    """
+    conn.exec_driver_sql(
+        "CREATE TEMP TABLE IF NOT EXISTS clone_ids "
+        "(old_id VARCHAR PRIMARY KEY, new_id VARCHAR NOT NULL)"
+    )
+    conn.execute(delete(_clone_ids))
+    folder_ids = list(conn.scalars(select(folders.c.id).where(folder_where)))
+    file_ids = list(conn.scalars(select(files.c.id).where(file_where)))
+    if not folder_ids and not file_ids:
+        return 0, 0, {}
+    conn.execute(insert(_clone_ids), [
+        {"old_id": old_id, "new_id": str(uuid.uuid4())} for old_id in folder_ids + file_ids
+    ])
+    
+    ids = _clone_ids.alias("ids")
+    parents = _clone_ids.alias("parents")
+    now = datetime.now(timezone.utc)
+    conn.execute(insert(Folder.__table__).from_select(
+        ["id", "name", "workspace_id", "user_id", "parent_folder_id", "is_root", "created_at"],
+        select(
+            ids.c.new_id, folders.c.name, literal(workspace_id), folders.c.user_id,
+            parents.c.new_id, folders.c.is_root, literal(now)
+        )
+        .join_from(folders, ids, ids.c.old_id == folders.c.id)
+        .outerjoin(parents, parents.c.old_id == folders.c.parent_folder_id)
+    ))
+    conn.execute(insert(File.__table__).from_select(
+        ["id", "name", "path", "workspace_id", "user_id", "folder_id", "size",
+         "stored_size", "codec", "checksum", "is_directory", "created_at", "updated_at"],
+        select(
+            ids.c.new_id, files.c.name, files.c.path, literal(workspace_id), files.c.user_id,
+            parents.c.new_id, files.c.size, files.c.stored_size, files.c.codec,
+            files.c.checksum, files.c.is_directory, literal(now), literal(now)
+        )
+        .join_from(files, ids, ids.c.old_id == files.c.id)
+        .outerjoin(parents, parents.c.old_id == files.c.folder_id)
+    ))
+    _share_content(conn, files, files.c.id.in_(select(_clone_ids.c.old_id)))
+    if root is not None:
+        root_id, values = root
+        conn.execute(update(Folder.__table__).where(
+            Folder.__table__.c.id == select(_clone_ids.c.new_id)
+            .where(_clone_ids.c.old_id == root_id).scalar_subquery()
+        ).values(**values))
+    
+    new_ids = select(_clone_ids.c.new_id)
+    last_seqs = _record_changes(conn, [
+        _change(row, entity_type, "create")
+        for model, (entity_type, _) in _ENTITIES.items()
+        for row in _changed_rows(conn, model, model.id.in_(new_ids))
+    ])
+    return len(folder_ids), len(file_ids), last_seqs
+
+
+class FolderDB(DB):
+    """
+    FolderDB provides database interaction with "folders" table.
+    
+    FolderDB class inherites attributes and methods from the DB class.
+    """
+    SHARDED = True
+    EXCLUDE_UPDATE_ATTR = ["id", "workspace_id", "created_at"]
+    
+    def __init__(
+        self, database_url: str = "sqlite:///app.db", echo: bool = False,
+        engine: Engine = None
+    ):
+        """Initialize class and parent class."""
+        super().__init__(database_url, echo, engine)
+    
+    def add_folder(
+        self, id: str, name: str, workspace_id: str, user_id: str = None,
+        parent_folder_id: str = None, is_root: bool = False
+    ) -> Folder:
+        folder = Folder(
+            id=id, name=name, workspace_id=workspace_id, user_id=user_id,
+            parent_folder_id=parent_folder_id, is_root=is_root
+        )
+        last_seqs = _add_recorded(self._session, folder)
+        self._session.commit()
+        _changes_recorded(self._engine, last_seqs)
+        return folder
+    
+    def find_folder(self, **kwargs) -> Folder:
+        self.validate_attr(Folder, kwargs)
+        folder = self.retrieve(Folder, **kwargs)
+        return folder
+    
+    def find_folder_paths(self, workspace_id: str, folder_id: str = None) -> dict:
+        """
+        Finds the folders of a subtree with one recursive query.
+        
+        Args:
+            workspace_id (str): Workspace of the folders
+            folder_id (str): Root of the subtree. Defaults to None for every
+            folder of the workspace
+            
+        Returns:
+            dict: Mapping of folder id to its path, starting with the
+            subtree root's name
+            
+        Raises:
+            NoResultFound: If `folder_id` is not a folder of the workspace
+        """
+        tree = _folder_tree(workspace_id, folder_id)
+        paths = dict(self._session.execute(select(tree.c.id, tree.c.path)).all())
+        if folder_id is not None and folder_id not in paths:
+            raise NoResultFound
+        return paths
+    
+    def clone_folder(self, workspace_id: str, folder_id: str, parent_folder_id: str = None,
+                     name: str = None) -> dict:
+        """
+        Copies a folder subtree of a workspace, sharing the stored content
+        of its files, see `WorkspaceDB.clone_workspace`.
+        
+        Args:
+            workspace_id (str): Workspace of the folder
+            folder_id (str): Root of the copied subtree
+            parent_folder_id (str): Folder the copy is placed in. Defaults to
+            None for the parent of `folder_id`
+            name (str): Name of the copy. Defaults to None for the name of
+            `folder_id`
+            
+        Returns:
+            dict: "id" of the copied root, number of "folders" and "files"
+            copied
+            
+        Raises:
+            NoResultFound: If the folder, or the parent folder, is not a
+            folder of the workspace
+        """
+        folders, files = Folder.__table__, File.__table__
+        tree = _folder_tree(workspace_id, folder_id)
+        with self._engine.connect() as conn, conn.begin():
+            source = conn.execute(
+                select(folders.c.name, folders.c.parent_folder_id)
+                .where(folders.c.id == folder_id, folders.c.workspace_id == workspace_id)
+            ).first()
+            if source is None:
+                raise NoResultFound
+            values = {"name": name or source.name}
+            if parent_folder_id is not None:
+                if not conn.scalar(select(folders.c.id).where(
+                    folders.c.id == parent_folder_id, folders.c.workspace_id == workspace_id
+                )):
+                    raise NoResultFound
+                values.update(parent_folder_id=parent_folder_id, is_root=False)
+            num_of_folders, num_of_files, last_seqs = _copy_tree(
+                conn, folders, files, workspace_id,
+                and_(folders.c.workspace_id == workspace_id, folders.c.id.in_(select(tree.c.id))),
+                and_(files.c.workspace_id == workspace_id, files.c.folder_id.in_(select(tree.c.id))),
+                root=(folder_id, values)
+            )
+            new_id = conn.scalar(
+                select(_clone_ids.c.new_id).where(_clone_ids.c.old_id == folder_id)
+            )
+        _changes_recorded(self._engine, last_seqs, num_of_folders + num_of_files)
+        return {"id": new_id, "folders": num_of_folders, "files": num_of_files}
+    
+    def update_folder(self, update_filter, **kwargs) -> int:
+        """Updates folders, recording a change per folder in the change log."""
+        self.validate_attr(Folder, update_filter)
+        self.validate_attr(Folder, kwargs, self.EXCLUDE_UPDATE_ATTR)
+        num_of_updates, last_seqs = _update_recorded(self._session, Folder, update_filter, kwargs)
+        self._session.commit()
+        _changes_recorded(self._engine, last_seqs, num_of_updates)
+        return num_of_updates
+    
+    def remove_folder(self, **kwargs) -> int:
+        """
+        Deletes folders with the folders and files under them, recording a
+        change per deleted row in the change log.
+        
+        The subtree is deleted explicitly rather than left to the ON DELETE
+        CASCADE, which would skip the change log, and content shared with
+        clones stops counting the deleted files.
+        
+        Returns:
+            int: Number of folders deleted, subfolders included
+        """
+        self.validate_attr(Folder, kwargs)
+        
+        tree = select(Folder.id).filter_by(**kwargs).cte("tree", recursive=True)
+        # UNION rather than UNION ALL stops at cyclic parent references
+        tree = tree.union(select(Folder.id).where(Folder.parent_folder_id == tree.c.id))
+        folder_ids = self._session.scalars(select(tree.c.id)).all()
+        if not folder_ids:
+            return 0
+        in_tree = File.folder_id.in_(folder_ids)
+        paths = self._session.scalars(select(File.path).where(in_tree)).all()
+        num_of_files, file_seqs = _delete_recorded(self._session, File, in_tree)
+        _release_content(self._session, paths)
+        num_of_deletes, last_seqs = _delete_recorded(
+            self._session, Folder, Folder.id.in_(folder_ids)
+        )
+        self._session.commit()
+        _changes_recorded(self._engine, {**file_seqs, **last_seqs}, num_of_files + num_of_deletes)
+        return num_of_deletes
+
+
+class FileDB(DB):
+    """
+    FileDB provides database interaction with "files" table.
+    
+    FileDB class inherites attributes and methods from the DB class.
+    """
+    SHARDED = True
+    EXCLUDE_UPDATE_ATTR = ["id", "workspace_id", "created_at"]
+    
+    def __init__(
+        self, database_url: str = "sqlite:///app.db", echo: bool = False,
+        engine: Engine = None
+    ):
+        """Initialize class and parent class."""
+        super().__init__(database_url, echo, engine)
+    
+    def add_file(
+        self, id: str, name: str, path: str, workspace_id: str, size: float,
+        user_id: str = None, folder_id: str = None, stored_size: float = None,
+        codec: str = "none", checksum: str = None
+    ) -> File:
+        file = File(
+            id=id, name=name, path=path, workspace_id=workspace_id,
+            size=size, user_id=user_id, folder_id=folder_id,
+            stored_size=size if stored_size is None else stored_size, codec=codec,
+            checksum=checksum
+        )
+        last_seqs = _add_recorded(self._session, file)
+        self._session.commit()
+        _changes_recorded(self._engine, last_seqs)
+        return file
+    
+    def find_file(self, **kwargs) -> File:
+        self.validate_attr(File, kwargs)
+        file = self.retrieve(File, **kwargs)
+        return file
+    
+    def _tree_filter(self, workspace_id: str, folder_id: str = None):
+        files = File.__table__
+        in_tree = files.c.folder_id.in_(select(_folder_tree(workspace_id, folder_id).c.id))
+        if folder_id is None:
+            # Files outside any folder belong to the workspace top level
+            in_tree = or_(in_tree, files.c.folder_id.is_(None))
+        return and_(files.c.workspace_id == workspace_id, in_tree)
+    
+    def count_tree_files(self, workspace_id: str, folder_id: str = None) -> tuple:
+        """
+        Counts the files of a folder subtree, or of the whole workspace.
+        
+        Returns:
+            tuple: (number of files, total size in MB)
+        """
+        files = File.__table__
+        count, size = self._session.execute(
+            select(func.count(), func.coalesce(func.sum(files.c.size), 0.0))
+            .where(self._tree_filter(workspace_id, folder_id), files.c.is_directory.isnot(True))
+        ).one()
+        return count, size
+    
+    def find_tree_files(self, workspace_id: str, folder_id: str = None,
+                        after: str = None, limit: int = 500) -> list:
+        """
+        Keyset page of the files of a folder subtree, or of the whole
+        workspace, in id order.
+        
+        Args:
+            after (str): Id of the last file of the previous page. Optional
+            limit (int): Page size
+            
+        Returns:
+            list: (id, name, path, folder_id, updated_at) rows
+        """
+        files = File.__table__
+        query = (
+            select(files.c.id, files.c.name, files.c.path, files.c.folder_id, files.c.updated_at)
+            .where(self._tree_filter(workspace_id, folder_id), files.c.is_directory.isnot(True))
+            .order_by(files.c.id)
+            .limit(limit)
+        )
+        if after is not None:
+            query = query.where(files.c.id > after)
+        return [tuple(row) for row in self._session.execute(query)]
+    
+    def update_file_content(self, file_id: str, size: float, replace,
+                            checksum: str = None, updated_at: datetime = None) -> int:
+        """
+        Records a new version of a file's content.
+        
+        The row is updated first and `replace` swaps the content in before
+        the commit, so the new content and its size and updated_at land
+        together. If `replace` fails the update is rolled back.
+        
+        With `updated_at`, the update only applies if the row still has
+        that version. The check is part of the UPDATE, which holds the row
+        until the commit, so of two servers updating a file from the same
+        version only one gets to replace its content.
+        
+        Content shared with clones is copied on write: the new content goes
+        to a new storage key, the file points at it and the clones keep the
+        old content.
+        
+        The size change is added to the workspace's `memory_used` in the
+        same transaction, see `_charge_memory`.
+        
+        Args:
+            file_id (str): File id
+            size (float): New size in MB
+            replace (callable): Moves the new content into place at the
+            storage key it is called with, and may return its ObjectStat to
+            record the stored size and codec
+            checksum (str): hex SHA-256 of the new content. Optional
+            updated_at (datetime): `updated_at` of the version the new
+            content was made from. Optional
+            
+        Returns:
+            int: 1 if the file exists, at `updated_at` if given, else 0 and
+            `replace` is not called
+            
+        Raises:
+            ValueError: If the new size takes the workspace over its
+            `total_memory`, or the file's owner over its `memory_allocated`
+        """
+        criteria = {"id": file_id}
+        if updated_at is not None:
+            criteria["updated_at"] = updated_at
+        try:
+            old_size = self._session.scalar(select(File.size).filter_by(**criteria))
+            num_of_updates, last_seqs = _update_recorded(
+                self._session, File, criteria,
+                {"size": size, "updated_at": datetime.now(timezone.utc)}
+            )
+            if num_of_updates:
+                workspace_id, user_id, path, refs = self._session.execute(
+                    select(File.workspace_id, File.user_id, File.path, ContentRef.refs)
+                    .outerjoin(ContentRef, ContentRef.path == File.path)
+                    .where(File.id == file_id)
+                ).one()
+                _charge_memory(self._session, workspace_id, user_id, size - (old_size or 0))
+                values = {"checksum": checksum}
+                if refs:
+                    values["path"] = f"{workspace_id}/{uuid.uuid4().hex}"
+                    _release_content(self._session, [path])
+                stat = replace(values.get("path", path))
+                if stat is not None:
+                    values["stored_size"] = (stat.stored_size or stat.size) / 2**20
+                    values["codec"] = stat.codec
+                self._session.execute(
+                    update(File).where(File.id == file_id).values(**values)
+                )
+            self._session.commit()
+        except BaseException:
+            self._session.rollback()
+            raise
+        _changes_recorded(self._engine, last_seqs)
+        return num_of_updates
+    
+    def update_file(self, update_filter, **kwargs) -> int:
+        """Updates files, recording a change per file in the change log."""
+        self.validate_attr(File, update_filter)
+        self.validate_attr(File, kwargs, self.EXCLUDE_UPDATE_ATTR)
+        num_of_updates, last_seqs = _update_recorded(self._session, File, update_filter, kwargs)
+        self._session.commit()
+        _changes_recorded(self._engine, last_seqs, num_of_updates)
+        return num_of_updates
+    
+    def remove_file(self, **kwargs) -> int:
+        """
+        Deletes files, recording a change per file in the change log.
+        
+        Content shared with clones stops counting the deleted files.
+        """
+        self.validate_attr(File, kwargs)
+        
+        paths = self._session.scalars(select(File.path).filter_by(**kwargs)).all()
+        num_of_deletes, last_seqs = _delete_recorded(self._session, File, kwargs)
+        _release_content(self._session, paths)
+        self._session.commit()
+        _changes_recorded(self._engine, last_seqs, num_of_deletes)
+        return num_of_deletes
+
+
+class WorkspaceChangeDB(DB):
+    """
+    WorkspaceChangeDB provides database interaction with "workspace_changes"
+    table.
+    
+    Changes are recorded by FolderDB and FileDB in the same transaction as
+    the rows they describe, then published to the workspace's broker topic
+    "changes:<workspace_id>".
+    """
+    SHARDED = True
+    # Compaction runs each time a workspace log grows by this many changes
+    COMPACT_EVERY = 10_000
+    # Most recent changes left uncompacted
+    KEEP = 1_000
+    # Seconds deletes stay in the log, clients behind them must resync
+    TOMBSTONE_TTL = 30 * 24 * 3600
+    
+    def __init__(
+        self, database_url: str = "sqlite:///app.db", echo: bool = False,
+        engine: Engine = None
+    ):
+        """Initialize class and parent class."""
+        super().__init__(database_url, echo, engine)
+    
+    @staticmethod
+    def topic(workspace_id: str) -> str:
+        """Broker topic on which the workspace's new seqs are published."""
+        return f"changes:{workspace_id}"
+    
+    @staticmethod
+    def to_dict(change) -> dict:
+        return {
+            "seq": change.seq,
+            "entity_type": change.entity_type,
+            "entity_id": change.entity_id,
+            "op": change.op,
+            "parent_id": change.parent_id,
+            "name": change.name,
+            "created_at": change.created_at.isoformat() if change.created_at else None
+        }
+    
+    def find_changes(self, workspace_id: str, since: int = 0, limit: int = 100) -> dict:
+        """
+        Retrieves the changes of a workspace after `since`, oldest first.
+        
+        A primary key range scan, so the cost follows the number of changes
+        returned, not the size of the workspace.
+        
+        Args:
+            workspace_id (str): Workspace
+            since (int): Last seq the client has seen
+            limit (int): Page size
+            
+        Returns:
+            dict: "changes", "next" (the seq to pass as `since` next),
+            "has_more", and "resync", True if compaction dropped deletes the
+            client has not seen and it must list the workspace again
+        """
+        changes = WorkspaceChange.__table__
+        counters = WorkspaceChangeCounter.__table__
+        rows = self._session.execute(
+            select(changes).where(changes.c.workspace_id == workspace_id, changes.c.seq > since)
+            .order_by(changes.c.seq).limit(limit + 1)
+        ).all()
+        horizon = self._session.scalar(
+            select(counters.c.horizon).where(counters.c.workspace_id == workspace_id)
+        ) or 0
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        return {
+            "changes": [self.to_dict(row) for row in rows],
+            "next": rows[-1].seq if rows else since,
+            "has_more": has_more,
+            "resync": since < horizon,
+        }
+    
+    def latest_seq(self, workspace_id: str) -> int:
+        counters = WorkspaceChangeCounter.__table__
+        return self._session.scalar(
+            select(counters.c.seq).where(counters.c.workspace_id == workspace_id)
+        ) or 0
+    
+    def compact_changes(self, workspace_id: str, keep: int = None,
+                        tombstone_ttl: float = None) -> int:
+        """
+        Compacts a workspace's change log.
+        
+        Args:
+            keep (int): Most recent changes left as they are. Defaults to
+            `KEEP`
+            tombstone_ttl (float): Seconds deletes are kept. Defaults to
+            `TOMBSTONE_TTL`
+            
+        Returns:
+            num_of_deletes (int): Number of changes dropped
+        """
+        keep = self.KEEP if keep is None else keep
+        tombstone_ttl = self.TOMBSTONE_TTL if tombstone_ttl is None else tombstone_ttl
+        tombstones_before = datetime.now(timezone.utc) - timedelta(seconds=tombstone_ttl)
+        return _compact_changes(self._session, workspace_id, keep, tombstones_before)
+    
+    @classmethod
+    def compact_in_background(cls, engine: Engine, workspace_id: str):
+        """Runs a compaction on a short lived session of the engine."""
+        try:
+            with Session(engine) as session:
+                tombstones_before = (
+                    datetime.now(timezone.utc) - timedelta(seconds=cls.TOMBSTONE_TTL)
+                )
+                _compact_changes(session, workspace_id, cls.KEEP, tombstones_before)
+        except SQLAlchemyError as e:
+            # TODO: Error would be logged using custom logger
+            print(f"Error compacting workspace changes: {e}")
+
+
+def _add_unread(session: Session, counts: dict):
+    """
+    Adds unread alert counts to "alert_counters" within the open transaction.
+    
+    Uses one SELECT to find the existing counters, then a single executemany
+    UPDATE and INSERT regardless of the number of users.
+    
+    Args:
+        session (Session): Session holding the open transaction
+        counts (dict): Mapping of user_id to the count to add
+    """
+    if not counts:
+        return
+    counters = AlertCounter.__table__
+    existing = set(session.scalars(
+        select(counters.c.user_id).where(counters.c.user_id.in_(list(counts)))
+    ))
+    if existing:
+        session.execute(
+            counters.update()
+            .where(counters.c.user_id == bindparam("b_user_id"))
+            .values(unread=counters.c.unread + bindparam("b_count")),
+            [{"b_user_id": user_id, "b_count": counts[user_id]} for user_id in existing]
+        )
+    missing = [
+        {"user_id": user_id, "unread": max(count, 0)}
+        for user_id, count in counts.items() if user_id not in existing
+    ]
+    if missing:
+        session.execute(counters.insert(), missing)
+
+
+def _delete_alerts(session: Session, where) -> int:
+    """
+    Deletes the alerts matching `where` within the open transaction, taking
+    the unread ones off their owners' counters.
+    
+    Returns:
+        int: Number of alerts deleted
+    """
+    unread = session.execute(
+        select(Alert.user_id, func.count())
+        .where(where, Alert.is_read.is_(False))
+        .group_by(Alert.user_id)
+    ).all()
+    _add_unread(session, {user_id: -count for user_id, count in unread})
+    return session.execute(
+        delete(Alert).where(where).execution_options(synchronize_session=False)
+    ).rowcount
+
+
+def _purge_batch(session: Session, model, where, batch_size: int, after: tuple = None,
+                 archive=None, delete_rows=None) -> tuple:
+    """
+    Deletes the oldest `batch_size` rows matching `where` in one short
+    transaction.
+    
+    Rows are taken in (created_at, id) order after the `after` cursor, so
+    every batch starts where the previous one stopped on the index.
+    
+    Args:
+        session (Session): Session of the model's database
+        model: Model with "created_at" and "id" columns
+        where: Filter of the rows to purge
+        batch_size (int): Rows deleted at most
+        after (tuple): (created_at, id) cursor returned by the last batch
+        archive (callable): Called with the rows, as dicts, before they are
+        deleted. Optional
+        delete_rows (callable): Deletes rows by id within the transaction,
+        defaults to a DELETE statement
+        
+    Returns:
+        tuple: (rows deleted, cursor), the cursor is None once no row is left
+    """
+    table = model.__table__
+    stmt = select(table).where(where)
+    if after is not None:
+        stmt = stmt.where(or_(
+            table.c.created_at > after[0],
+            and_(table.c.created_at == after[0], table.c.id > after[1])
+        ))
+    rows = session.execute(
+        stmt.order_by(table.c.created_at, table.c.id).limit(batch_size)
+    ).mappings().all()
+    if not rows:
+        session.rollback()
+        return 0, None
+    try:
+        if archive is not None:
+            archive([dict(row) for row in rows])
+        ids = [row["id"] for row in rows]
+        if delete_rows is None:
+            session.execute(delete(table).where(table.c.id.in_(ids)))
+        else:
+            delete_rows(session, ids)
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+    cursor = (rows[-1]["created_at"], rows[-1]["id"]) if len(rows) == batch_size else None
+    return len(rows), cursor
+
+
+class AlertDB(DB):
+    """
+    AlertDB provides database interaction with "alerts" table.
+    
+    The unread count of each user is kept in "alert_counters" and updated in
+    the same transaction as the alerts, every change is then published to
+    the user's broker topic "alerts:<user_id>".
+    """
+    def __init__(
+        self, database_url: str = "sqlite:///app.db", echo: bool = False,
+        engine: Engine = None
+    ):
+        """Initialize class and parent class."""
+        super().__init__(database_url, echo, engine)
+    
+    @staticmethod
+    def topic(user_id: str) -> str:
+        """Broker topic on which the user's alert changes are published."""
+        return f"alerts:{user_id}"
+    
+    @staticmethod
+    def to_dict(alert: Alert) -> dict:
+        return {
+            "id": alert.id,
+            "alert_type": alert.alert_type,
+            "workspace_id": alert.workspace_id,
+            "message": alert.message,
+            "is_read": alert.is_read,
+            "created_at": alert.created_at.isoformat() if alert.created_at else None
+        }
+    
+    def add_alert(
+        self, id: str, alert_type: str, user_id: str, message: str,
+        workspace_id: str = None
+    ) -> Alert:
+        """
+        Adds an unread alert and bumps the user's unread counter.
+        
+        Returns:
+            alert (Alert): The created alert.
+        """
+        alert = Alert(
+            id=id, alert_type=alert_type, user_id=user_id,
+            message=message, workspace_id=workspace_id
+        )
+        self._session.add(alert)
+        _add_unread(self._session, {user_id: 1})
+        self._session.commit()
+        
+        broker.publish(self.topic(user_id), {
+            "unread": self.unread_count(user_id),
+            "alert": self.to_dict(alert)
+        })
+        return alert
+    
+    def find_alerts(
+        self, user_id: str, limit: int = 20, cursor: str = None,
+        unread_only: bool = False
+    ) -> tuple:
+        """
+        Retrieves a page of the user's alerts, newest first.
+        
+        Pages are addressed with a keyset cursor on (created_at, id), so deep
+        pages cost the same as the first one.
+        
+        Args:
+            user_id (str): Owner of the alerts
+            limit (int): Page size
+            cursor (str): `next_cursor` returned with the previous page
+            unread_only (bool): If True, only unread alerts are returned
+            
+        Returns:
+            tuple: (alerts, next_cursor), `next_cursor` is None on the last page.
+        
+        Raises:
+            ValueError: If the cursor is malformed
+        """
+        stmt = select(Alert).where(Alert.user_id == user_id)
+        if unread_only:
+            stmt = stmt.where(Alert.is_read.is_(False))
+        if cursor:
+            created_at, _, alert_id = cursor.partition("_")
+            try:
+                created_at = datetime.fromisoformat(created_at)
+            except ValueError:
+                raise ValueError(f"Invalid cursor <{cursor}>")
+            stmt = stmt.where(or_(
+                Alert.created_at < created_at,
+                and_(Alert.created_at == created_at, Alert.id < alert_id)
+            ))
+        stmt = stmt.order_by(Alert.created_at.desc(), Alert.id.desc()).limit(limit + 1)
+        alerts = self._session.scalars(stmt).all()
+        
+        next_cursor = None
+        if len(alerts) > limit:
+            alerts = alerts[:limit]
+            last = alerts[-1]
+            next_cursor = f"{last.created_at.isoformat()}_{last.id}"
+        return alerts, next_cursor
+    
+    def unread_count(self, user_id: str) -> int:
+        """Returns the user's unread alert count from its maintained counter."""
+        counter = self._session.get(AlertCounter, user_id)
+        return counter.unread if counter else 0
+    
+    def has_unread_alert(self, user_id: str, alert_type: str, message: str) -> bool:
+        """Whether the user has an unread alert of `alert_type` with `message`."""
+        return self._session.scalar(select(exists().where(
+            Alert.user_id == user_id,
+            Alert.alert_type == alert_type,
+            Alert.message == message,
+            Alert.is_read.is_(False)
+        )))
+    
+    def mark_read(self, user_id: str, alert_ids: list = None) -> int:
+        """
+        Marks the given alerts, or every alert of the user, as read in a
+        single UPDATE statement.
+        
+        Args:
+            user_id (str): Owner of the alerts
+            alert_ids (list): Ids of the alerts to mark. Defaults to None for
+            all unread alerts
+            
+        Returns:
+            num_of_updates (int): Number of alerts that changed to read
+        """
+        stmt = update(Alert).where(Alert.user_id == user_id, Alert.is_read.is_(False))
+        if alert_ids is not None:
+            if not alert_ids:
+                return 0
+            stmt = stmt.where(Alert.id.in_(alert_ids))
+        num_of_updates = self._session.execute(
+            stmt.values(is_read=True).execution_options(synchronize_session=False)
+        ).rowcount
+        
+        if num_of_updates:
+            _add_unread(self._session, {user_id: -num_of_updates})
+            self._session.commit()
+            broker.publish(self.topic(user_id), {"unread": self.unread_count(user_id)})
+        return num_of_updates
+    
+    def find_alert_types(self) -> list:
+        """Returns the alert types in use, read from their index."""
+        return list(self._session.scalars(select(Alert.alert_type).distinct()))
+    
+    def purge_alerts(self, alert_type: str, before: datetime, batch_size: int = 500,
+                     after: tuple = None, archive=None) -> tuple:
+        """
+        Deletes a batch of alerts of a type created before `before`, taking
+        the unread ones off their owners' counters.
+        
+        See `_purge_batch` for the arguments and return value.
+        """
+        return _purge_batch(
+            self._session, Alert,
+            and_(Alert.alert_type == alert_type, Alert.created_at < before),
+            batch_size, after, archive,
+            delete_rows=lambda session, ids: _delete_alerts(session, Alert.id.in_(ids))
+        )
+
+
+class InviteDB(DB):
+    """
+    InviteDB provides database interaction with "invites" table.
+    
+    InviteDB class inherites attributes and methods from the DB class.
+    """
+    SHARDED = True
+    MAX_BATCH = 1000
+    
+    def __init__(
+        self, database_url: str = "sqlite:///app.db", echo: bool = False,
+        engine: Engine = None
+    ):
+        """Initialize class and parent class."""
+        super().__init__(database_url, echo, engine)
+    
+    def _seats_taken(self, workspace_id: str) -> tuple:
+        """
+        Returns the workspace's name, `max_users` and taken seats (members,
+        the admin and pending invites) in a single query.
+        
+        Raises:
+            NoResultFound: If the workspace does not exist
+        """
+        members = select(func.count()).where(
+            WorkspaceUser.workspace_id == workspace_id
+        ).scalar_subquery()
+        admin_is_member = select(func.count()).where(
+            WorkspaceUser.workspace_id == workspace_id,
+            WorkspaceUser.user_id == Workspace.admin_id
+        ).scalar_subquery()
+        pending = select(func.count()).where(
+            Invite.workspace_id == workspace_id, Invite.status == "pending"
+        ).scalar_subquery()
+        row = self._session.execute(
+            select(Workspace.name, Workspace.max_users, members, admin_is_member, pending)
+            .where(Workspace.id == workspace_id)
+        ).first()
+        if not row:
+            raise NoResultFound
+        name, max_users, members, admin_is_member, pending = row
+        seats_taken = members + (0 if admin_is_member else 1) + pending
+        return name, max_users, seats_taken
+    
+    def _classify(self, workspace_id: str, emails: list) -> dict:
+        """
+        Looks up every lowercased email in one UNION query, returning a
+        mapping of lowercased email to (kind, user_id) where kind is
+        "invited", "member" or "user". Emails are compared case-insensitively.
+        """
+        invited = select(
+            literal("invited").label("kind"),
+            func.lower(Invite.invitee_email).label("email"),
+            literal(None, String).label("user_id")
+        ).where(
+            Invite.workspace_id == workspace_id,
+            Invite.status == "pending",
+            func.lower(Invite.invitee_email).in_(emails)
+        )
+        users = select(
+            case((WorkspaceUser.id.is_not(None), "member"), else_="user"),
+            func.lower(User.email),
+            User.id
+        ).outerjoin(
+            WorkspaceUser,
+            and_(
+                WorkspaceUser.user_id == User.id,
+                WorkspaceUser.workspace_id == workspace_id
+            )
+        ).where(func.lower(User.email).in_(emails))
+        
+        kinds, user_ids = {}, {}
+        for kind, email, user_id in self._session.execute(union_all(invited, users)):
+            kinds.setdefault(email, set()).add(kind)
+            if user_id:
+                user_ids[email] = user_id
+        
+        found = {}
+        for email, email_kinds in kinds.items():
+            kind = next(k for k in ("member", "invited", "user") if k in email_kinds)
+            found[email] = (kind, user_ids.get(email))
+        return found
+    
+    def add_invites(
+        self, workspace_id: str, inviter_id: str, emails: list,
+        invite_type: str = "workspace_invite"
+    ) -> dict:
+        """
+        Invites a batch of emails to a workspace.
+        
+        Emails are deduplicated against each other, pending invites and
+        workspace members with a single query, `max_users` is checked once,
+        then invites and alerts for registered invitees are inserted with one
+        executemany statement each. Alert delivery is handed to the
+        background dispatcher after the commit.
+        
+        Args:
+            workspace_id (str): Workspace the emails are invited to
+            inviter_id (str): Id of the inviting user
+            emails (list): Emails to invite
+            invite_type (str): Invite type. Defaults to "workspace_invite"
+        
+        Returns:
+            dict: Emails grouped into "invited", "already_invited",
+            "already_members" and "invalid".
+            
+        Raises:
+            NoResultFound: If the workspace does not exist
+            ValueError: If the batch is too large, or would take the
+            workspace over `max_users`
+        """
+        if len(emails) > self.MAX_BATCH:
+            raise ValueError(f"At most {self.MAX_BATCH} emails can be invited at once")
+        
+        result = {"invited": [], "already_invited": [], "already_members": [], "invalid": []}
+        unique = {}
+        for email in emails:
+            email = email.strip() if isinstance(email, str) else ""
+            if "@" not in email.strip("@"):
+                result["invalid"].append(email)
+                continue
+            unique.setdefault(email.lower(), email)
+        if not unique:
+            return result
+        
+        workspace_name, max_users, seats_taken = self._seats_taken(workspace_id)
+        found = self._classify(workspace_id, list(unique))
+        
+        new_emails = []
+        for key, email in unique.items():
+            kind = found.get(key, (None,))[0]
+            if kind == "invited":
+                result["already_invited"].append(email)
+            elif kind == "member":
+                result["already_members"].append(email)
+            else:
+                new_emails.append(email)
+        
+        if seats_taken + len(new_emails) > max_users:
+            raise ValueError(
+                f"Workspace <{workspace_name}> has {max(max_users - seats_taken, 0)} "
+                f"free seats, {len(new_emails)} invites requested"
+            )
+        if not new_emails:
+            return result
+        
+        inviter = self._session.get(User, inviter_id)
+        inviter_name = inviter.username if inviter else "A VaultShare user"
+        message = f"{inviter_name} invited you to join <{workspace_name}>"
+        
+        now = datetime.now(timezone.utc)
+        invites = [
+            {
+                "id": str(uuid.uuid4()), "invite_type": invite_type,
+                "workspace_id": workspace_id, "inviter_id": inviter_id,
+                "invitee_email": email, "status": "pending", "created_at": now
+            }
+            for email in new_emails
+        ]
+        alerts = [
+            {
+                "id": str(uuid.uuid4()), "alert_type": "invite",
+                "user_id": found[email.lower()][1], "workspace_id": workspace_id,
+                "message": message, "is_read": False, "created_at": now
+            }
+            for email in new_emails if email.lower() in found
+        ]
+        self._session.execute(insert(Invite), invites)
+        if alerts:
+            self._session.execute(insert(Alert), alerts)
+            _add_unread(self._session, {alert["user_id"]: 1 for alert in alerts})
+        self._session.commit()
+        
+        if alerts:
+            counters = dict(self._session.execute(
+                select(AlertCounter.user_id, AlertCounter.unread)
+                .where(AlertCounter.user_id.in_([alert["user_id"] for alert in alerts]))
+            ).all())
+            messages = [
+                (AlertDB.topic(alert["user_id"]), {
+                    "unread": counters.get(alert["user_id"], 1),
+                    "alert": {**alert, "created_at": now.isoformat()}
+                })
+                for alert in alerts
+            ]
+            dispatcher.submit(deliver, messages)
+        
+        result["invited"] = new_emails
+        return result
+    
+    def find_invite_statuses(self) -> list:
+        """Returns the invite statuses in use, read from their index."""
+        return list(self._session.scalars(select(Invite.status).distinct()))
+    
+    def purge_invites(self, status: str, before: datetime, batch_size: int = 500,
+                      after: tuple = None, archive=None) -> tuple:
+        """
+        Deletes a batch of invites with a status created before `before`.
+        
+        See `_purge_batch` for the arguments and return value.
+        """
+        return _purge_batch(
+            self._session, Invite,
+            and_(Invite.status == status, Invite.created_at < before),
+            batch_size, after, archive
+        )
+
+
+class SessionDB(DB):
+    """
+    SessionDB provides database interaction with "sessions" and
+    "session_revocations" tables.
+    
+    SessionDB class inherites attributes and methods from the DB class.
+    """
+    def __init__(
+        self, database_url: str = "sqlite:///app.db", echo: bool = False,
+        engine: Engine = None
+    ):
+        """Initialize class and parent class."""
+        super().__init__(database_url, echo, engine)
+    
+    def add_session(self, token: str, user_id: str, created_at: datetime,
+                    expires_at: datetime) -> UserSession:
+        session = self.create(
+            UserSession, token=token, user_id=user_id, created_at=created_at,
+            last_seen=created_at, expires_at=expires_at
+        )
+        return session
+    
+    def find_session(self, token: str) -> UserSession:
+        """
+        Finds a session by its token with a primary key lookup.
+        
+        Raises:
+            NoResultFound: If no session has the token
+        """
+        session = self._session.get(UserSession, token)
+        if session is None:
+            raise NoResultFound
+        return session
+    
+    def find_session_user(self, token: str) -> tuple:
+        """
+        Finds a session and its user in one query.
+        
+        Returns:
+            tuple: The (User, UserSession) pair
+            
+        Raises:
+            NoResultFound: If no session has the token
+        """
+        row = self._session.execute(
+            select(User, UserSession)
+            .join(UserSession, UserSession.user_id == User.id)
+            .where(UserSession.token == token)
+        ).first()
+        if row is None:
+            raise NoResultFound
+        return tuple(row)
+    
+    def remove_session(self, token: str) -> int:
+        return self.delete(UserSession, token=token)
+    
+    def remove_user_sessions(self, user_id: str) -> int:
+        """Revokes every session of a user, returning the number revoked."""
+        return self.delete(UserSession, user_id=user_id)
+    
+    def touch_sessions(self, last_seen: dict) -> int:
+        """
+        Writes a batch of `last_seen` times with one executemany UPDATE.
+        
+        Args:
+            last_seen (dict): Mapping of session token to its last_seen time
+            
+        Returns:
+            int: Number of sessions still existing that were updated
+        """
+        if not last_seen:
+            return 0
+        sessions = UserSession.__table__
+        result = self._session.execute(
+            sessions.update()
+            .where(sessions.c.token == bindparam("b_token"))
+            .values(last_seen=bindparam("b_last_seen")),
+            [{"b_token": token, "b_last_seen": seen} for token, seen in last_seen.items()]
+        )
+        self._session.commit()
+        return result.rowcount
+    
+    def add_revocation(self, kind: str, key: str, revoked_at: datetime,
+                       expires_at: datetime) -> SessionRevocation:
+        """
+        Records a signed token revocation, replacing an older one of the
+        same key.
+        
+        Args:
+            kind (str): "token" for a token id, "user" for a user id
+            key (str): The revoked token or user id
+            revoked_at (datetime): Revocation time
+            expires_at (datetime): Time every revoked token has expired by
+        """
+        revocation = self._session.merge(SessionRevocation(
+            kind=kind, key=key, revoked_at=revoked_at, expires_at=expires_at
+        ))
+        self._session.commit()
+        return revocation
+    
+    def find_revocations(self, now: datetime, since: datetime = None) -> list:
+        """
+        Finds the revocations still in effect at `now`.
+        
+        Args:
+            since (datetime): Only revocations made from then on. Optional
+            
+        Returns:
+            list: (kind, key, revoked_at, expires_at) rows
+        """
+        revocations = SessionRevocation.__table__
+        query = select(
+            revocations.c.kind, revocations.c.key,
+            revocations.c.revoked_at, revocations.c.expires_at
+        ).where(revocations.c.expires_at > now)
+        if since is not None:
+            query = query.where(revocations.c.revoked_at >= since)
+        return [tuple(row) for row in self._session.execute(query)]
+    
+    def _sweep(self, table, now: datetime, batch_size: int) -> int:
+        keys = tuple_(*table.primary_key.columns)
+        expired = (
+            select(*table.primary_key.columns)
+            .where(table.c.expires_at <= now)
+            .limit(batch_size)
+        )
+        num_of_deletes = 0
+        while True:
+            deleted = self._session.execute(
+                delete(table).where(keys.in_(expired))
+            ).rowcount
+            self._session.commit()
+            num_of_deletes += deleted
+            if deleted < batch_size:
+                return num_of_deletes
+    
+    def sweep_expired(self, now: datetime, batch_size: int = 500) -> int:
+        """
+        Deletes expired sessions and revocations in chunks of `batch_size`,
+        committing after each chunk so no single transaction holds the write
+        lock for long.
+        
+        Returns:
+            num_of_deletes (int): Number of rows deleted
+        """
+        return (
+            self._sweep(UserSession.__table__, now, batch_size)
+            + self._sweep(SessionRevocation.__table__, now, batch_size)
+        )
+
+
+class ScrubDB(DB):
+    """
+    ScrubDB provides database interaction for the integrity scrubber, see
+    `vaultShare.file_mangager.scrub`.
+    
+    Files are walked in primary key order and the position of the running
+    pass is kept in "scrub_checkpoints", so a restarted scrubber resumes
+    where it stopped. On a sharded app each shard has its own scrubber.
+    """
+    SHARDED = True
+    
+    def __init__(
+        self, database_url: str = "sqlite:///app.db", echo: bool = False,
+        engine: Engine = None
+    ):
+        """Initialize class and parent class."""
+        super().__init__(database_url, echo, engine)
+    
+    def find_checkpoint(self, name: str = "files") -> ScrubCheckpoint:
+        """Returns the checkpoint of a scrubber, created on first use."""
+        checkpoint = self._session.get(ScrubCheckpoint, name)
+        if checkpoint is None:
+            checkpoint = ScrubCheckpoint(name=name, files_checked=0, bytes_checked=0,
+                                         problems_found=0)
+            self._session.add(checkpoint)
+            self._session.commit()
+        return checkpoint
+    
+    def save_checkpoint(self, checkpoint: ScrubCheckpoint, now: datetime):
+        """Commits the progress of a pass, a finished pass starts over."""
+        checkpoint.updated_at = now
+        self._session.merge(checkpoint)
+        self._session.commit()
+    
+    def find_scrub_batch(self, after: str = None, limit: int = 100) -> list:
+        """
+        Page of files after `after` in primary key order, a range scan of
+        the primary key index however far the pass has got.
+        
+        Returns:
+            list: (id, workspace_id, name, path, checksum, updated_at) rows
+        """
+        query = select(
+            File.id, File.workspace_id, File.name, File.path, File.checksum, File.updated_at
+        ).order_by(File.id).limit(limit)
+        if after is not None:
+            query = query.where(File.id > after)
+        return self._session.execute(query).all()
+    
+    def find_file_checksum(self, file_id: str) -> tuple:
+        """
+        Current checksum and updated_at of a file, re-read before reporting
+        a mismatch in case the file was updated meanwhile.
+        
+        Returns:
+            tuple: (checksum, updated_at), or None for a deleted file
+        """
+        self._session.rollback()
+        return self._session.execute(
+            select(File.checksum, File.updated_at).where(File.id == file_id)
+        ).first()
+    
+    def record_checksum(self, file_id: str, checksum: str) -> int:
+        """
+        Records the checksum of a file that has none yet.
+        
+        Returns:
+            int: 1 if recorded, 0 if the file is gone or got one meanwhile
+        """
+        num_of_updates = self._session.execute(
+            update(File)
+            .where(File.id == file_id, File.checksum.is_(None))
+            .values(checksum=checksum)
+        ).rowcount
+        self._session.commit()
+        return num_of_updates
+    
+    def find_workspace_admin(self, workspace_id: str) -> str:
+        """Returns the id of the workspace admin, or None."""
+        return self._session.execute(
+            select(Workspace.admin_id).where(Workspace.id == workspace_id)
+        ).scalar()
+
+
+class AuditDB(DB):
+    """
+    Class provides methods for the append-only audit log.
+    
+    Events are only inserted, in batches by `vaultShare.audit.AuditLog`,
+    and read back by time range.
+    """
+    @staticmethod
+    def to_dict(event) -> dict:
+        return {
+            "id": event.id,
+            "created_at": event.created_at.isoformat(),
+            "event_type": event.event_type,
+            "user_id": event.user_id,
+            "workspace_id": event.workspace_id,
+            "ip": event.ip,
+            "detail": json.loads(event.detail) if event.detail else None
+        }
+    
+    def add_events(self, rows: list) -> int:
+        """
+        Inserts a batch of events in one transaction.
+        
+        Args:
+            rows (list): Dicts of AuditEvent columns, "id" aside
+            
+        Returns:
+            int: Number of events inserted
+        """
+        if not rows:
+            return 0
+        self._session.execute(insert(AuditEvent), rows)
+        self._session.commit()
+        return len(rows)
+    
+    def find_events(
+        self, since: datetime = None, until: datetime = None, user_id: str = None,
+        event_type: str = None, workspace_id: str = None, cursor: str = None,
+        limit: int = 100
+    ) -> tuple:
+        """
+        Retrieves a page of events in a time range, oldest first.
+        
+        The range is scanned on the (user_id, created_at), (event_type,
+        created_at) or created_at index, and pages are addressed with a
+        keyset cursor on (created_at, id).
+        
+        Args:
+            since (datetime): Earliest event time, inclusive. Optional
+            until (datetime): Latest event time, exclusive. Optional
+            user_id (str): Only events of this user. Optional
+            event_type (str): Only events of this type. Optional
+            workspace_id (str): Only events of this workspace. Optional
+            cursor (str): `next_cursor` returned with the previous page
+            limit (int): Page size
+            
+        Returns:
+            tuple: (events, next_cursor), `next_cursor` is None on the last page.
+        
+        Raises:
+            ValueError: If the cursor is malformed
+        """
+        stmt = select(AuditEvent)
+        if since is not None:
+            stmt = stmt.where(AuditEvent.created_at >= since)
+        if until is not None:
+            stmt = stmt.where(AuditEvent.created_at < until)
+        if user_id is not None:
+            stmt = stmt.where(AuditEvent.user_id == user_id)
+        if event_type is not None:
+            stmt = stmt.where(AuditEvent.event_type == event_type)
+        if workspace_id is not None:
+            stmt = stmt.where(AuditEvent.workspace_id == workspace_id)
+        if cursor:
+            created_at, _, event_id = cursor.partition("_")
+            try:
+                created_at, event_id = datetime.fromisoformat(created_at), int(event_id)
+            except ValueError:
+                raise ValueError(f"Invalid cursor <{cursor}>")
+            stmt = stmt.where(or_(
+                AuditEvent.created_at > created_at,
+                and_(AuditEvent.created_at == created_at, AuditEvent.id > event_id)
+            ))
+        stmt = stmt.order_by(AuditEvent.created_at, AuditEvent.id).limit(limit + 1)
+        events = self._session.scalars(stmt).all()
+        
+        next_cursor = None
+        if len(events) > limit:
+            events = events[:limit]
+            last = events[-1]
+            next_cursor = f"{last.created_at.isoformat()}_{last.id}"
+        return events, next_cursor
@@ -8,7 +8,7 @@ Module contains SQLAlchemy database model schemas.
 from sqlalchemy import (
     Boolean, Column, DateTime,
     Integer, Float, String, Text,
-    ForeignKey
+    ForeignKey, Index, func
 )
 from sqlalchemy.orm import relationship, backref, declarative_base
 from datetime import datetime, timezone
@@ -28,9 +28,17 @@ class User(Base):
     session_id = Column(String)
     created_at = Column(DateTime, default=datetime.now(timezone.utc))
     
-    # users relationships
-    workspaces = relationship("Workspace", backref="admin", cascade="all, delete")
-    alerts = relationship("Alert", backref="user", cascade="all, delete")
+    # users relationships, children are deleted by the database, see
+    # "Deleting rows" in db/README.md
+    workspaces = relationship("Workspace", backref="admin", cascade="all, delete",
+                              passive_deletes=True)
+    alerts = relationship("Alert", backref="user", cascade="all, delete",
+                          passive_deletes=True)
+    
+    __table_args__ = (
+        # Invites match emails case-insensitively
+        Index("ix_users_email_lower", func.lower(email)),
+    )
 
 
 class Workspace(Base):
@@ -38,40 +46,53 @@ class Workspace(Base):
     
     id = Column(String, primary_key=True)
     name = Column(String, nullable=False)
-    admin_id = Column(String, ForeignKey('users.id'), nullable=False)
+    admin_id = Column(String, ForeignKey('users.id', ondelete="CASCADE"), nullable=False)
     total_memory = Column(Float, default=10.0)
     memory_used = Column(Float, default=0.0)
     max_users = Column(Integer, default=5)
     created_at = Column(DateTime, default=datetime.now(timezone.utc))
     
     # workspaces relationships
-    users = relationship("WorkspaceUser", backref="workspace", cascade="all, delete")
-    folders = relationship("Folder", backref="workspace", cascade="all, delete")
-    invites = relationship("Invite", backref="workspace", cascade="all, delete")
-    alerts = relationship("Alert", backref="workspace", cascade="all, delete")
+    users = relationship("WorkspaceUser", backref="workspace", cascade="all, delete",
+                         passive_deletes=True)
+    folders = relationship("Folder", backref="workspace", cascade="all, delete",
+                           passive_deletes=True)
+    files = relationship("File", backref="workspace", cascade="all, delete",
+                         passive_deletes=True)
+    invites = relationship("Invite", backref="workspace", cascade="all, delete",
+                           passive_deletes=True)
+    alerts = relationship("Alert", backref="workspace", cascade="all, delete",
+                          passive_deletes=True)
     
 
 class WorkspaceUser(Base):
     __tablename__ = "workspace_users"
     
     id = Column(String, primary_key=True)
-    workspace_id = Column(String, ForeignKey("workspaces.id"), nullable=False)
-    user_id = Column(String, ForeignKey("users.id"), nullable=False)
+    workspace_id = Column(String, ForeignKey("workspaces.id", ondelete="CASCADE"),
+                          nullable=False)
+    user_id = Column(String, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
     role = Column(String, nullable=False) # "admin" or "user"
     memory_allocated = Column(Float, default=0.0) # memory allocated to user by admin
     created_at = Column(DateTime, default=datetime.now(timezone.utc))
     
+    __table_args__ = (
+        Index("ix_workspace_users_workspace_user", "workspace_id", "user_id"),
+    )
+    
 
 class Folder(Base):
     __tablename__ = "folders"
     
     id = Column(String, primary_key=True)
     name = Column(String, nullable=False)
-    workspace_id = Column(String, ForeignKey("workspaces.id"), nullable=False)
+    workspace_id = Column(String, ForeignKey("workspaces.id", ondelete="CASCADE"),
+                          nullable=False)
     # user_id is nullable for admin folder
-    user_id = Column(String, ForeignKey("users.id"), nullable=True)
+    user_id = Column(String, ForeignKey("users.id", ondelete="SET NULL"), nullable=True)
     # parent_folder_id is nullable for nested folders
-    parent_folder_id = Column(String, ForeignKey("folders.id"), nullable=True)
+    parent_folder_id = Column(String, ForeignKey("folders.id", ondelete="CASCADE"),
+                              nullable=True)
     is_root = Column(Boolean, default=False)
     created_at = Column(DateTime, default=datetime.now(timezone.utc))
     
@@ -85,10 +106,16 @@ class File(Base):
     id = Column(String, primary_key=True)
     name = Column(String, nullable=False)
     path = Column(Text, nullable=False)
-    workspace_id = Column(String, ForeignKey("workspaces.id"), nullable=False)
-    user_id = Column(String, ForeignKey("users.id"))
-    folder_id = Column(String, ForeignKey("folders.id"))
+    workspace_id = Column(String, ForeignKey("workspaces.id", ondelete="CASCADE"),
+                          nullable=False)
+    user_id = Column(String, ForeignKey("users.id", ondelete="SET NULL"))
+    folder_id = Column(String, ForeignKey("folders.id", ondelete="CASCADE"))
     size = Column(Float, nullable=False) # size in MB
+    # size in MB of the content as stored, see vaultShare.file_mangager.compression
+    stored_size = Column(Float)
+    codec = Column(String, default="none")
+    # hex SHA-256 of the content, checked by the scrubber
+    checksum = Column(String)
     is_directory = Column(Boolean, default=False)
     created_at = Column(DateTime, default=datetime.now(timezone.utc))
     updated_at = Column(DateTime, default=datetime.now(timezone.utc))
@@ -100,14 +127,21 @@ class Invite(Base):
     id = Column(String, primary_key=True)
     # e.g., "workspace_invite"
     invite_type = Column(String, nullable=False)
-    workspace_id = Column(String, ForeignKey("workspaces.id"), nullable=False)
-    inviter_id = Column(String, ForeignKey("users.id"), nullable=False)
+    workspace_id = Column(String, ForeignKey("workspaces.id", ondelete="CASCADE"),
+                          nullable=False)
+    inviter_id = Column(String, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
     invitee_email = Column(String, nullable=False)
     status = Column(String, default="pending") # invite status
     created_at = Column(DateTime, default=datetime.now(timezone.utc))
     
     # Relationships
-    inviter = relationship("User", backref="sent_invites")
+    inviter = relationship("User", backref=backref("sent_invites", passive_deletes=True))
+    
+    __table_args__ = (
+        Index("ix_invites_workspace_email", "workspace_id", "invitee_email"),
+        # Retention purges, oldest first per status
+        Index("ix_invites_status_created", "status", "created_at", "id"),
+    )
     
 
 class Alert(Base):
@@ -116,8 +150,126 @@ class Alert(Base):
     id = Column(String, primary_key=True)
     # e.g., "invite", "memory_usage", "memory_exceeded"
     alert_type = Column(String, nullable=False)
-    user_id = Column(String, ForeignKey("users.id"), nullable=False)
-    workspace_id = Column(String, ForeignKey("workspaces.id"))
+    user_id = Column(String, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    workspace_id = Column(String, ForeignKey("workspaces.id", ondelete="CASCADE"))
     message = Column(Text, nullable=False)
     is_read = Column(Boolean, default=False)
-    created_at = Column(DateTime, default=datetime.now(timezone.utc))
+    # Evaluated per row, the feed is ordered by creation time
+    created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
+    
+    __table_args__ = (
+        Index("ix_alerts_user_feed", "user_id", "created_at", "id"),
+        # Retention purges, oldest first per type
+        Index("ix_alerts_type_created", "alert_type", "created_at", "id"),
+    )
+
+
+class AlertCounter(Base):
+    __tablename__ = "alert_counters"
+    
+    # Maintained alongside "alerts" writes so unread counts are a single
+    # primary key lookup instead of a COUNT(*)
+    user_id = Column(String, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    unread = Column(Integer, nullable=False, default=0)
+
+
+class UserSession(Base):
+    __tablename__ = "sessions"
+    
+    # One row per logged in device, replacing the single users.session_id
+    token = Column(String, primary_key=True)
+    user_id = Column(String, ForeignKey("users.id", ondelete="CASCADE"), nullable=False,
+                     index=True)
+    created_at = Column(DateTime, nullable=False)
+    # Written behind in batches, see vaultShare.auth.sessions
+    last_seen = Column(DateTime, nullable=False)
+    expires_at = Column(DateTime, nullable=False, index=True)
+
+
+class SessionRevocation(Base):
+    __tablename__ = "session_revocations"
+    
+    # Revoked signed session tokens, kind "token" keyed by token id, or kind
+    # "user" keyed by user id revoking every token issued before revoked_at
+    kind = Column(String, primary_key=True)
+    key = Column(String, primary_key=True)
+    revoked_at = Column(DateTime, nullable=False, index=True)
+    # Tokens revoked by the row have expired by then, the row can be swept
+    expires_at = Column(DateTime, nullable=False, index=True)
+
+
+class WorkspaceChange(Base):
+    __tablename__ = "workspace_changes"
+    
+    # Append-only, per workspace log of file and folder changes, read by
+    # sync clients from the last seq they saw
+    workspace_id = Column(String, ForeignKey("workspaces.id", ondelete="CASCADE"),
+                          primary_key=True)
+    seq = Column(Integer, primary_key=True, autoincrement=False)
+    entity_type = Column(String, nullable=False) # "file" or "folder"
+    entity_id = Column(String, nullable=False)
+    op = Column(String, nullable=False) # "create", "update", "move" or "delete"
+    # Parent folder and name after the change
+    parent_id = Column(String)
+    name = Column(String)
+    created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
+    
+    __table_args__ = (
+        # Finds the superseded changes of an entity during compaction
+        Index("ix_workspace_changes_entity", "workspace_id", "entity_type", "entity_id", "seq"),
+    )
+
+
+class WorkspaceChangeCounter(Base):
+    __tablename__ = "workspace_change_counters"
+    
+    workspace_id = Column(String, ForeignKey("workspaces.id", ondelete="CASCADE"),
+                          primary_key=True)
+    # Last seq handed out
+    seq = Column(Integer, nullable=False, default=0)
+    # Clients behind this seq missed compacted deletes and must resync
+    horizon = Column(Integer, nullable=False, default=0)
+
+
+class ScrubCheckpoint(Base):
+    __tablename__ = "scrub_checkpoints"
+    
+    name = Column(String, primary_key=True)
+    # Last file checked by the running pass, None once a pass completes
+    last_file_id = Column(String)
+    pass_started_at = Column(DateTime)
+    pass_finished_at = Column(DateTime)
+    files_checked = Column(Integer, nullable=False, default=0)
+    bytes_checked = Column(Integer, nullable=False, default=0)
+    problems_found = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime)
+
+
+class ContentRef(Base):
+    __tablename__ = "content_refs"
+    
+    # Storage key shared by cloned files, unshared content has no row
+    path = Column(Text, primary_key=True)
+    # Number of files pointing at the content, 2 or more
+    refs = Column(Integer, nullable=False)
+
+
+class AuditEvent(Base):
+    __tablename__ = "audit_events"
+    
+    # Append order, rows are never updated
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    created_at = Column(DateTime, nullable=False)
+    event_type = Column(String, nullable=False)
+    user_id = Column(String)
+    workspace_id = Column(String)
+    ip = Column(String)
+    # JSON details of the event
+    detail = Column(Text)
+    
+    # Time range scans, whole log or per user or event type, in time order
+    __table_args__ = (
+        Index("ix_audit_events_created_at", "created_at"),
+        Index("ix_audit_events_user_created", "user_id", "created_at"),
+        Index("ix_audit_events_type_created", "event_type", "created_at"),
+    )
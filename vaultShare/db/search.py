@@ -0,0 +1,236 @@
+"""
+Search module for users, folders and files.
+
+On SQLite, names are indexed in FTS5 external content tables with the
+trigram tokenizer, kept in sync with their source tables by triggers. On
+PostgreSQL, pg_trgm GIN indexes serve the same substring queries. Queries
+shorter than a trigram fall back to a prefix range scan on an index of
+`lower(name)`.
+"""
+from .db import DB
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import SQLAlchemyError
+
+# Searchable source tables and their indexed text columns
+SEARCH_TABLES = {
+    "users": ("username", "email"),
+    "folders": ("name",),
+    "files": ("name",),
+}
+
+# Prefix indexes of the searchable source tables
+PREFIX_INDEXES = {
+    "files": "ix_files_workspace_lname ON files (workspace_id, lower(name))",
+    "folders": "ix_folders_workspace_lname ON folders (workspace_id, lower(name))",
+    "users": "ix_users_lusername ON users (lower(username))",
+}
+
+# Highest code point, closes the prefix range "q" <= x < "q\U0010ffff"
+_PREFIX_END = "\U0010ffff"
+
+
+def _sqlite_ddl(table: str, columns: tuple, schema: str = "main") -> list:
+    """
+    DDL of the FTS5 index of `table` and the triggers keeping it in sync.
+
+    The index and triggers are created in `schema`, the database holding
+    `table`, as triggers may not reference another database.
+    """
+    fts = f"{table}_fts"
+    cols = ", ".join(columns)
+    new_cols = ", ".join(f"new.{col}" for col in columns)
+    old_cols = ", ".join(f"old.{col}" for col in columns)
+    return [
+        f"CREATE VIRTUAL TABLE {schema}.{fts} USING fts5("
+        f"{cols}, content='{table}', content_rowid='rowid', tokenize='trigram')",
+        f"CREATE TRIGGER IF NOT EXISTS {schema}.{fts}_ai AFTER INSERT ON {table} BEGIN "
+        f"INSERT INTO {fts}(rowid, {cols}) VALUES (new.rowid, {new_cols}); END",
+        f"CREATE TRIGGER IF NOT EXISTS {schema}.{fts}_ad AFTER DELETE ON {table} BEGIN "
+        f"INSERT INTO {fts}({fts}, rowid, {cols}) VALUES ('delete', old.rowid, {old_cols}); END",
+        f"CREATE TRIGGER IF NOT EXISTS {schema}.{fts}_au AFTER UPDATE OF {cols} ON {table} BEGIN "
+        f"INSERT INTO {fts}({fts}, rowid, {cols}) VALUES ('delete', old.rowid, {old_cols}); "
+        f"INSERT INTO {fts}(rowid, {cols}) VALUES (new.rowid, {new_cols}); END",
+        # Index the rows written before the FTS table existed
+        f"INSERT INTO {schema}.{fts}({fts}) VALUES ('rebuild')",
+    ]
+
+
+def _postgresql_ddl(table: str, columns: tuple) -> list:
+    """DDL of the pg_trgm indexes of `table`."""
+    return ["CREATE EXTENSION IF NOT EXISTS pg_trgm"] + [
+        f"CREATE INDEX IF NOT EXISTS ix_{table}_{col}_trgm "
+        f"ON {table} USING gin (lower({col}) gin_trgm_ops)"
+        for col in columns
+    ]
+
+
+class SearchDB(DB):
+    """
+    SearchDB provides ranked substring and prefix search scoped to a workspace.
+
+    SearchDB class inherites attributes and methods from the DB class.
+    """
+    SHARDED = True
+    MIN_TRIGRAM = 3
+
+    def __init__(
+        self, database_url: str = "sqlite:///app.db", echo: bool = False,
+        engine: Engine = None
+    ):
+        """Initialize class and parent class, then the search indexes."""
+        super().__init__(database_url, echo, engine)
+        self._dialect = self._engine.dialect.name
+        self._initialize_search()
+
+    def _initialize_search(self):
+        """
+        Creates the search indexes that do not exist yet.
+
+        Prefix indexes on `lower(name)` are created on every dialect. On
+        SQLite, indexes are created in the database holding their table,
+        which is an attached database for "users" on a shard.
+        """
+        schemas = {table: None for table in SEARCH_TABLES}
+        existing = set()
+        if self._dialect == "sqlite":
+            with self._engine.connect() as conn:
+                databases = [
+                    row[1] for row in conn.exec_driver_sql("PRAGMA database_list")
+                    if row[1] != "temp"
+                ]
+                for schema in databases:
+                    names = set(conn.scalars(text(
+                        f"SELECT name FROM {schema}.sqlite_master WHERE type = 'table'"
+                    )))
+                    for table in SEARCH_TABLES:
+                        if table in names and schemas[table] is None:
+                            schemas[table] = schema
+                    existing.update((schema, name) for name in names if name.endswith("_fts"))
+
+        statements = []
+        for table, index in PREFIX_INDEXES.items():
+            prefix = f"{schemas[table]}." if schemas[table] else ""
+            statements.append(f"CREATE INDEX IF NOT EXISTS {prefix}{index}")
+        if self._dialect == "sqlite":
+            for table, columns in SEARCH_TABLES.items():
+                if (schemas[table], f"{table}_fts") not in existing:
+                    statements.extend(_sqlite_ddl(table, columns, schemas[table]))
+        elif self._dialect == "postgresql":
+            for table, columns in SEARCH_TABLES.items():
+                statements.extend(_postgresql_ddl(table, columns))
+
+        try:
+            with self._engine.begin() as conn:
+                for statement in statements:
+                    conn.execute(text(statement))
+        except SQLAlchemyError as e:
+            # TODO: Error would be logged using custom logger
+            print(f"Error initializing search indexes: {e}")
+
+    @staticmethod
+    def _phrase(query: str) -> str:
+        """Quotes the query as a single FTS5 phrase."""
+        return '"' + query.replace('"', '""') + '"'
+
+    def _search(self, table: str, columns: tuple, select_cols: str, scope: str,
+                query: str, limit: int, offset: int) -> list:
+        """
+        Runs a two tier search on one table.
+        
+        Names starting with the query come first, served in name order by the
+        `lower(name)` index. Names only containing the query follow, also in
+        name order with the id breaking ties, so pages stay stable between
+        requests. Neither tier has to score every match before the LIMIT
+        applies.
+        """
+        lowered = query.lower()
+        params = {
+            "q": lowered, "q_end": lowered + _PREFIX_END,
+            "scope": scope, "limit": offset + limit, "offset": 0,
+        }
+        prefix = " OR ".join(
+            f"(lower(t.{col}) >= :q AND lower(t.{col}) < :q_end)" for col in columns
+        )
+        scope_sql = (
+            "t.workspace_id = :scope" if table != "users" else
+            "t.id IN (SELECT user_id FROM workspace_users WHERE workspace_id = :scope)"
+        )
+        
+        sql = (
+            f"SELECT {select_cols} FROM {table} t WHERE {scope_sql} AND ({prefix}) "
+            f"ORDER BY lower(t.{columns[0]}), t.id LIMIT :limit"
+        )
+        results = [dict(row) for row in self._session.execute(text(sql), params).mappings()]
+        if len(results) == offset + limit or len(query) < self.MIN_TRIGRAM:
+            return results[offset:]
+        
+        # Every prefix match is known, page on into the substring matches
+        params["offset"] = max(0, offset - len(results))
+        params["limit"] = offset + limit - len(results) - params["offset"]
+        if self._dialect == "sqlite":
+            params["match"] = self._phrase(query)
+            # CROSS JOIN pins the FTS index as the outer loop, otherwise SQLite
+            # may walk the whole workspace and probe the index row by row
+            sql = (
+                f"SELECT {select_cols} FROM {table}_fts f CROSS JOIN {table} t ON t.rowid = f.rowid "
+                f"WHERE {table}_fts MATCH :match AND {scope_sql} AND NOT ({prefix}) "
+                f"ORDER BY lower(t.{columns[0]}), t.id LIMIT :limit OFFSET :offset"
+            )
+        else:
+            params["like"] = "%" + (
+                lowered.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+            ) + "%"
+            contains = " OR ".join(f"lower(t.{col}) LIKE :like ESCAPE '\\'" for col in columns)
+            sql = (
+                f"SELECT {select_cols} FROM {table} t WHERE {scope_sql} AND ({contains}) "
+                f"AND NOT ({prefix}) ORDER BY lower(t.{columns[0]}), t.id "
+                f"LIMIT :limit OFFSET :offset"
+            )
+        substring = [dict(row) for row in self._session.execute(text(sql), params).mappings()]
+        return results[offset:] + substring
+
+    def search_files(self, workspace_id: str, query: str, limit: int = 20, offset: int = 0) -> list:
+        """
+        Searches file names within a workspace.
+
+        Args:
+            workspace_id (str): Workspace searched
+            query (str): Text contained in the file name
+            limit (int): Page size
+            offset (int): Number of results skipped
+
+        Returns:
+            list: File dictionaries with "id", "name", "folder_id" and "size"
+        """
+        return self._search(
+            "files", SEARCH_TABLES["files"],
+            "t.id, t.name, t.folder_id, t.size",
+            workspace_id, query, limit, offset
+        )
+
+    def search_folders(self, workspace_id: str, query: str, limit: int = 20, offset: int = 0) -> list:
+        """
+        Searches folder names within a workspace.
+
+        Returns:
+            list: Folder dictionaries with "id", "name" and "parent_folder_id"
+        """
+        return self._search(
+            "folders", SEARCH_TABLES["folders"],
+            "t.id, t.name, t.parent_folder_id",
+            workspace_id, query, limit, offset
+        )
+
+    def search_users(self, workspace_id: str, query: str, limit: int = 20, offset: int = 0) -> list:
+        """
+        Searches usernames and emails of a workspace's members.
+
+        Returns:
+            list: User dictionaries with "id", "username" and "email"
+        """
+        return self._search(
+            "users", SEARCH_TABLES["users"],
+            "t.id, t.username, t.email",
+            workspace_id, query, limit, offset
+        )
@@ -0,0 +1,236 @@
+"""
+Module contains the shard router spreading workspace data over databases.
+
+Global tables, users, sessions and alerts, stay on the primary database.
+Workspace scoped tables are partitioned over the shard databases by
+workspace id, so writes to different workspaces mostly take different
+SQLite write locks and write throughput grows with the shard count.
+
+Workspaces are placed by rendezvous hashing of the workspace id with the
+shard URLs: adding a shard only moves the workspaces it wins, about one in
+N+1, and removing one only moves its own. `rebalance` moves the rows of
+misplaced workspaces after the shard list changed.
+
+Every shard connection attaches the primary database, and SQLite resolves
+unqualified table names in "main" before attached databases, so queries
+joining users with workspace tables, and writes of alerts next to
+invites, work unchanged on a shard.
+"""
+import hashlib
+import os
+import threading
+from sqlalchemy import create_engine, event, select, delete, inspect, make_url
+from sqlalchemy.engine import Engine
+from .db import enforce_foreign_keys
+from .models import Base, Workspace
+
+# Tables kept on the primary database, every other table is sharded
+GLOBAL_TABLES = frozenset({
+    "users", "sessions", "session_revocations", "alerts", "alert_counters",
+    # Clones share content across workspaces, and shards
+    "content_refs",
+    "audit_events",
+})
+
+# Schema name of the primary database on shard connections
+PRIMARY_SCHEMA = "vaultshare_primary"
+
+
+def _sqlite_path(url: str) -> str:
+    """Returns the database file of a SQLite URL."""
+    url = make_url(url)
+    if url.get_backend_name() != "sqlite" or url.database in (None, "", ":memory:"):
+        raise ValueError(f"Shards need SQLite database files, not {url!r}")
+    return os.path.abspath(url.database)
+
+
+def sharded_tables() -> list:
+    """Returns the sharded tables, in dependency order."""
+    return [table for table in Base.metadata.sorted_tables if table.name not in GLOBAL_TABLES]
+
+
+def _shard_key(table):
+    """Column holding the workspace id of a sharded table, None if it has none."""
+    if table.name == Workspace.__tablename__:
+        return table.c.id
+    return table.c.get("workspace_id")
+
+
+class ShardRouter:
+    """
+    Routes DB objects to the database holding a workspace.
+
+    Without shard URLs every table lives on the primary database and the
+    router hands out DB objects bound to it, as a single database app.
+
+    Attributes:
+        primary (Engine): Engine of the global tables.
+        shards (list): Engines of the shard databases.
+        shard_urls (list): URLs of the shard databases, also their identity
+        in workspace placement.
+    """
+    def __init__(self, database_url: str = "sqlite:///app.db", shard_urls: list = (),
+                 echo: bool = False, primary: Engine = None):
+        """
+        Creates the engines and the tables each database holds.
+
+        Args:
+            database_url (str): Primary database URL
+            shard_urls (list): Shard database URLs. Optional
+            echo (bool): Log SQL statements. Optional
+            primary (Engine): Existing engine of the primary database, used
+            instead of `database_url`. Optional
+        """
+        self.primary = primary or create_engine(database_url, echo=echo)
+        self.shard_urls = list(shard_urls)
+        if len(set(self.shard_urls)) != len(self.shard_urls):
+            raise ValueError("Shard URLs must be unique")
+        self._dbs = {}
+        self._lock = threading.Lock()
+
+        if self.shard_urls:
+            primary_path = _sqlite_path(str(self.primary.url))
+            self.shards = [self._shard_engine(url, primary_path, echo) for url in self.shard_urls]
+            Base.metadata.create_all(self.primary, tables=[
+                table for table in Base.metadata.sorted_tables if table.name in GLOBAL_TABLES
+            ])
+            for engine in self.shards:
+                Base.metadata.create_all(engine, tables=sharded_tables())
+        else:
+            self.shards = []
+            if primary is None:
+                enforce_foreign_keys(self.primary)
+            Base.metadata.create_all(self.primary)
+
+        if hasattr(os, "register_at_fork"):
+            # Children must not reuse the parent's pooled connections
+            os.register_at_fork(after_in_child=lambda: self.dispose(close=False))
+
+    @staticmethod
+    def _shard_engine(url: str, primary_path: str, echo: bool) -> Engine:
+        _sqlite_path(url)
+        engine = create_engine(url, echo=echo)
+
+        @event.listens_for(engine, "connect")
+        def attach_primary(dbapi_connection, connection_record):
+            dbapi_connection.execute(
+                f"ATTACH DATABASE ? AS {PRIMARY_SCHEMA}", (primary_path,)
+            )
+        return engine
+
+    def shard_for(self, workspace_id: str) -> int:
+        """Returns the index of the shard holding a workspace."""
+        def score(url):
+            digest = hashlib.blake2b(f"{url}\0{workspace_id}".encode(), digest_size=8)
+            return digest.digest()
+        return max(range(len(self.shard_urls)), key=lambda i: score(self.shard_urls[i]))
+
+    def engine_for(self, workspace_id: str) -> Engine:
+        """Returns the engine of the database holding a workspace."""
+        if not self.shards:
+            return self.primary
+        return self.shards[self.shard_for(workspace_id)]
+
+    def database_path(self, workspace_id: str) -> str:
+        """Returns the SQLite file holding a workspace."""
+        if not self.shards:
+            return _sqlite_path(str(self.primary.url))
+        return _sqlite_path(self.shard_urls[self.shard_for(workspace_id)])
+
+    def _db(self, cls, index: int):
+        key = (cls, index)
+        obj = self._dbs.get(key)
+        if obj is None:
+            with self._lock:
+                obj = self._dbs.get(key)
+                if obj is None:
+                    engine = self.primary if index is None else self.shards[index]
+                    obj = self._dbs[key] = cls(engine=engine)
+        return obj
+
+    def db(self, cls, workspace_id: str = None):
+        """
+        Returns the router's instance of a DB class for a workspace.
+
+        Args:
+            cls: DB class, sharded if its `SHARDED` attribute is set
+            workspace_id (str): Workspace the DB object serves, required for
+            sharded classes once shards are configured
+
+        Raises:
+            ValueError: When a sharded class is requested without workspace
+        """
+        if not self.shards or not cls.SHARDED:
+            return self._db(cls, None)
+        if workspace_id is None:
+            raise ValueError(f"{cls.__name__} is sharded, a workspace_id is required")
+        return self._db(cls, self.shard_for(workspace_id))
+
+    def all(self, cls) -> list:
+        """Returns an instance of a DB class per database holding its tables."""
+        if not self.shards or not cls.SHARDED:
+            return [self._db(cls, None)]
+        return [self._db(cls, index) for index in range(len(self.shards))]
+
+    def close_sessions(self):
+        """Closes the calling thread's sessions of every created DB object."""
+        for obj in list(self._dbs.values()):
+            obj.close_session()
+
+    def dispose(self, close: bool = True):
+        """Disposes the connection pools of every engine."""
+        for engine in [self.primary] + self.shards:
+            engine.dispose(close=close)
+
+    def _move_workspace(self, workspace_id: str, source: Engine, target: Engine,
+                        batch_size: int) -> int:
+        """
+        Copies a workspace's rows to `target`, then deletes them from `source`.
+
+        Copies replace existing rows, so a move interrupted between the two
+        steps is completed by running it again.
+        """
+        tables = [table for table in sharded_tables() if _shard_key(table) is not None]
+        moved = 0
+        with source.connect() as reader, target.begin() as writer:
+            for table in tables:
+                result = reader.execution_options(yield_per=batch_size).execute(
+                    select(table).where(_shard_key(table) == workspace_id)
+                )
+                for rows in result.mappings().partitions():
+                    writer.execute(table.insert().prefix_with("OR REPLACE"),
+                                   [dict(row) for row in rows])
+                    moved += len(rows)
+        with source.begin() as conn:
+            for table in reversed(tables):
+                conn.execute(delete(table).where(_shard_key(table) == workspace_id))
+        return moved
+
+    def rebalance(self, batch_size: int = 500) -> dict:
+        """
+        Moves every workspace to the shard it is placed on.
+
+        Meant to run right after the shard list changed, while the app is
+        stopped: until its workspace moved, a request would find the new
+        shard empty. Workspaces left on the primary database by an unsharded
+        deployment are moved too.
+
+        Returns:
+            dict: Number of workspaces and of rows moved
+        """
+        stats = {"workspaces": 0, "rows": 0}
+        sources = list(enumerate(self.shards))
+        if self.shards and inspect(self.primary).has_table(Workspace.__tablename__):
+            sources.append((None, self.primary))
+        for index, engine in sources:
+            with engine.connect() as conn:
+                workspace_ids = list(conn.scalars(select(Workspace.id)))
+            for workspace_id in workspace_ids:
+                owner = self.shard_for(workspace_id)
+                if owner == index:
+                    continue
+                stats["rows"] += self._move_workspace(
+                    workspace_id, engine, self.shards[owner], batch_size
+                )
+                stats["workspaces"] += 1
+        return stats
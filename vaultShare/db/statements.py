@@ -0,0 +1,72 @@
+"""
+Statement cache for the generic DB CRUD methods.
+
+Building `session.query(model).filter_by(**kwargs)` on every call costs
+Python time before SQLAlchemy even reaches its compiled cache. Here the
+Core `select`/`update`/`delete` constructs are built once per model and
+filter key set with bound parameters, so later calls reuse the same
+statement object, whose cache key SQLAlchemy memoizes, and only bind new
+values.
+"""
+from functools import lru_cache
+from sqlalchemy import select, update, delete, bindparam
+
+
+@lru_cache(maxsize=None)
+def column_keys(model) -> frozenset:
+    """Column names of a model, computed once."""
+    return frozenset(model.__table__.columns.keys())
+
+
+def filter_key(criteria: dict) -> tuple:
+    """
+    Hashable shape of a filter dict, None values become IS NULL tests as
+    they do with `filter_by`.
+    """
+    return tuple(sorted((key, value is None) for key, value in criteria.items()))
+
+
+def filter_params(criteria: dict, prefix: str = "f_") -> dict:
+    """Bound parameter values of a filter dict, IS NULL tests bind nothing."""
+    return {prefix + key: value for key, value in criteria.items() if value is not None}
+
+
+def _where(model, key: tuple) -> list:
+    return [
+        getattr(model, name).is_(None) if is_null
+        else getattr(model, name) == bindparam("f_" + name)
+        for name, is_null in key
+    ]
+
+
+@lru_cache(maxsize=1024)
+def select_first(model, key: tuple):
+    """SELECT of the first row of `model` matching the filter shape."""
+    return select(model).where(*_where(model, key)).limit(1)
+
+
+@lru_cache(maxsize=1024)
+def update_where(model, key: tuple, values: tuple):
+    """
+    UPDATE of `model` rows matching the filter shape, setting the `values`
+    columns from "v_<column>" parameters.
+
+    The ORM session is not synchronized, every caller commits straight
+    after, which expires the identity map anyway.
+    """
+    return (
+        update(model)
+        .where(*_where(model, key))
+        .values({name: bindparam("v_" + name) for name in values})
+        .execution_options(synchronize_session=False)
+    )
+
+
+@lru_cache(maxsize=1024)
+def delete_where(model, key: tuple):
+    """DELETE of `model` rows matching the filter shape."""
+    return (
+        delete(model)
+        .where(*_where(model, key))
+        .execution_options(synchronize_session=False)
+    )
@@ -31,4 +31,76 @@ class UserAlreadyExists(ValueError):
 class NoUserFound(ValueError):
     msg=""
     def __init__(self, msg):
-        self.msg = msg
\ No newline at end of file
+        self.msg = msg
+
+
+class TooManyRequests(ValueError):
+    """
+    Raises error when a client is rate limited, `retry_after` holds the
+    number of seconds the client should wait before retrying.
+    """
+    msg = ""
+    def __init__(self, msg, retry_after=1):
+        self.msg = msg
+        self.retry_after = retry_after
+
+
+class ServiceUnavailable(ValueError):
+    """
+    Raises error when a request is shed because the server is at its
+    concurrency limit, `retry_after` holds the number of seconds the
+    client should wait before retrying.
+    """
+    msg = ""
+    def __init__(self, msg, retry_after=1):
+        self.msg = msg
+        self.retry_after = retry_after
+
+
+
+class NoWorkspaceFound(ValueError):
+    """Raises error when no workspace matches the given workspace id."""
+    msg = ""
+    def __init__(self, msg):
+        self.msg = msg
+
+
+class WorkspaceLimitExceeded(ValueError):
+    """
+    Raises error when an action would take a workspace over its
+    `max_users` limit, or over its memory or a member's quota.
+    """
+    msg = ""
+    def __init__(self, msg):
+        self.msg = msg
+
+
+class NoFolderFound(ValueError):
+    """Raises error when no folder of the workspace matches the folder id."""
+    msg = ""
+    def __init__(self, msg):
+        self.msg = msg
+
+
+class NoFileFound(ValueError):
+    """Raises error when no file of the workspace matches the file id."""
+    msg = ""
+    def __init__(self, msg):
+        self.msg = msg
+
+
+class NoExportFound(ValueError):
+    """Raises error when no running export of the workspace matches the id."""
+    msg = ""
+    def __init__(self, msg):
+        self.msg = msg
+
+
+class FileVersionConflict(ValueError):
+    """
+    Raises error when a file changed since the version an update was made
+    against.
+    """
+    msg = ""
+    def __init__(self, msg):
+        self.msg = msg
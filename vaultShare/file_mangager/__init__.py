@@ -0,0 +1,15 @@
+from .compression import CompressedStorage, sniff_codec
+from .delta import (
+    SignatureCache, apply_delta, compute_delta, encode_delta, file_signature,
+    read_manifest
+)
+from .export import (
+    ExportJob, ExportRegistry, is_compressed, iter_entries, stream_zip
+)
+from .scrub import IOBudget, Scrubber, content_checksum, file_checksum
+from .storage import (
+    LocalStorage, ObjectStat, S3Storage, StorageBackend, create_storage
+)
+
+# Process wide registry of exports, for progress and cancellation
+exports = ExportRegistry()
@@ -0,0 +1,437 @@
+"""
+Module contains transparent compression of stored files.
+
+`CompressedStorage` wraps another backend. On every put it sniffs the
+first frame of content and compresses text-like files, logs, CSVs, JSON,
+into a seekable framed object. Files that are already compressed, or
+barely shrink, are stored as they are. Reads decompress on the fly, and
+callers only ever see the logical bytes.
+
+Framed object layout, all integers big endian:
+
+    header      b"VSZ\\x01" + codec (u8) + frame size (u32)
+    frames      each frame_size logical bytes compressed on their own
+    index       per frame its stored length (u32), the top bit set when
+                the frame is kept uncompressed
+    trailer     logical size (u64) + frame count (u64) + b"VSZE"
+
+Frames are independent, so a range read only fetches and decompresses the
+frames it overlaps, located through the index at the end of the object.
+"""
+import io
+import struct
+import threading
+import zlib
+from collections import OrderedDict
+from .export import is_compressed
+from .storage import ObjectStat, StorageBackend
+
+MAGIC = b"VSZ\x01"
+END_MAGIC = b"VSZE"
+FRAME_SIZE = 1024 * 1024
+# Content smaller than this is never worth the framing
+MIN_SIZE = 4 * 1024
+SNIFF_SIZE = 64 * 1024
+
+_HEADER = struct.Struct(">4sBI")
+_TRAILER = struct.Struct(">QQ4s")
+_LENGTH = struct.Struct(">I")
+_RAW_FRAME = 1 << 31
+
+CODECS = {"none": 0, "zlib": 1}
+_CODEC_NAMES = {code: name for name, code in CODECS.items()}
+
+
+def sniff_codec(head: bytes, name: str = "", max_ratio: float = 0.8) -> str:
+    """
+    Picks the codec of a file from its first bytes.
+
+    Args:
+        head (bytes): Start of the content
+        name (str): File name or key, its extension is a hint. Optional
+        max_ratio (float): Largest compressed to original size ratio of a
+        sample still worth compressing
+
+    Returns:
+        str: "zlib" or "none"
+    """
+    if len(head) < MIN_SIZE or is_compressed(name, head):
+        return "none"
+    sample = head[:SNIFF_SIZE]
+    if len(zlib.compress(sample, 1)) > max_ratio * len(sample):
+        return "none"
+    return "zlib"
+
+
+class FrameIndex:
+    """
+    Location of the frames of a stored object.
+
+    Attributes:
+        version (str): Version of the stored object the index was read from.
+        codec (str): "zlib", or "none" for an object stored as it is.
+        size (int): Logical size.
+        stored_size (int): Size of the stored object.
+        frame_size (int): Logical bytes per frame.
+        frames (list): (stored offset, stored length, raw) per frame.
+    """
+    def __init__(self, version, codec, size, stored_size, frame_size=0, frames=()):
+        self.version = version
+        self.codec = codec
+        self.size = size
+        self.stored_size = stored_size
+        self.frame_size = frame_size
+        self.frames = list(frames)
+
+    @property
+    def framed(self) -> bool:
+        return bool(self.frame_size)
+
+
+def _decode(index: FrameIndex, data: bytes, raw: bool) -> bytes:
+    return data if raw or index.codec == "none" else zlib.decompress(data)
+
+
+class _FrameEncoder:
+    """
+    Readable stream of the framed object of a content stream, produced one
+    frame at a time as the backend reads it.
+    """
+    def __init__(self, head: bytes, source, codec: str, frame_size: int, level: int):
+        self._source = source
+        self._codec = codec
+        self._frame_size = frame_size
+        self._level = level
+        self._pending = head
+        self._buffer = bytearray(_HEADER.pack(MAGIC, CODECS[codec], frame_size))
+        self._lengths = []
+        self._done = False
+        self.size = 0
+
+    def _frame(self) -> bytes:
+        data = self._pending
+        self._pending = b""
+        while len(data) < self._frame_size:
+            more = self._source.read(self._frame_size - len(data))
+            if not more:
+                break
+            data += more
+        return data
+
+    def _fill(self, size: int):
+        while not self._done and (size < 0 or len(self._buffer) < size):
+            data = self._frame()
+            if data:
+                self.size += len(data)
+                frame = zlib.compress(data, self._level) if self._codec == "zlib" else data
+                if len(frame) >= len(data):
+                    # Incompressible frame, keep it as it is
+                    self._lengths.append(len(data) | _RAW_FRAME)
+                    frame = data
+                else:
+                    self._lengths.append(len(frame))
+                self._buffer += frame
+            if len(data) < self._frame_size:
+                for length in self._lengths:
+                    self._buffer += _LENGTH.pack(length)
+                self._buffer += _TRAILER.pack(self.size, len(self._lengths), END_MAGIC)
+                self._done = True
+
+    def read(self, size: int = -1) -> bytes:
+        size = -1 if size is None else size
+        self._fill(size)
+        if size < 0:
+            size = len(self._buffer)
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        return data
+
+
+class _Chained:
+    """Readable stream of some bytes followed by the rest of a stream."""
+    def __init__(self, head: bytes, source):
+        self._head = head
+        self._source = source
+
+    def read(self, size: int = -1) -> bytes:
+        if self._head:
+            if size is None or size < 0:
+                data, self._head = self._head + self._source.read(), b""
+                return data
+            data, self._head = self._head[:size], self._head[size:]
+            return data
+        return self._source.read(size)
+
+    def readable(self) -> bool:
+        return True
+
+    def close(self):
+        self._source.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class _FramedReader(io.RawIOBase):
+    """
+    Seekable reader of the logical bytes of a framed object.
+
+    Frames are decoded from the open stored object while reads stay
+    sequential, and fetched with ranged reads after a seek when the stored
+    object cannot seek itself.
+    """
+    def __init__(self, storage: "CompressedStorage", key: str, index: FrameIndex, source):
+        self._storage = storage
+        self._key = key
+        self._index = index
+        self._source = source
+        # Skip the header, the frames follow it
+        _read_exact(source, _HEADER.size)
+        self._source_at = _HEADER.size
+        self._seekable = _is_seekable(source)
+        self._pos = 0
+        self._frame = (-1, b"")
+
+    def _load(self, i: int) -> bytes:
+        if self._frame[0] == i:
+            return self._frame[1]
+        offset, length, raw = self._index.frames[i]
+        if self._source_at != offset and self._seekable:
+            self._source.seek(offset)
+            self._source_at = offset
+        if self._source_at == offset:
+            data = _read_exact(self._source, length)
+            self._source_at += length
+        else:
+            data = self._storage.inner.read_range(
+                self._key, offset, length, version=self._index.version
+            )
+        self._frame = (i, _decode(self._index, data, raw))
+        return self._frame[1]
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._pos
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            offset += self._index.size
+        if offset < 0:
+            raise ValueError("Negative seek position")
+        self._pos = offset
+        return offset
+
+    def readinto(self, buffer) -> int:
+        if self._pos >= self._index.size:
+            return 0
+        i, skip = divmod(self._pos, self._index.frame_size)
+        data = self._load(i)[skip:skip + len(buffer)]
+        buffer[:len(data)] = data
+        self._pos += len(data)
+        return len(data)
+
+    def read(self, size: int = -1) -> bytes:
+        if size is None or size < 0:
+            size = max(self._index.size - self._pos, 0)
+        parts = []
+        while size > 0:
+            buffer = bytearray(min(size, self._index.frame_size))
+            n = self.readinto(buffer)
+            if not n:
+                break
+            parts.append(bytes(buffer[:n]))
+            size -= n
+        return b"".join(parts)
+
+    def close(self):
+        if not self.closed:
+            self._source.close()
+        super().close()
+
+
+def _is_seekable(source) -> bool:
+    seekable = getattr(source, "seekable", None)
+    return bool(seekable and seekable())
+
+
+def _read_exact(source, size: int) -> bytes:
+    data = source.read(size)
+    while len(data) < size:
+        more = source.read(size - len(data))
+        if not more:
+            raise ValueError("Stored object ended early")
+        data += more
+    return data
+
+
+class CompressedStorage(StorageBackend):
+    """
+    Backend compressing content on its way into another backend.
+
+    The stat of an object reports its logical `size`, along with its
+    `stored_size` and `codec`. Frame indexes are cached by object version,
+    so repeated stats and range reads of a file cost one stat of the inner
+    backend. Multipart uploads are passed through and stored uncompressed.
+
+    Attributes:
+        inner (StorageBackend): Holds the stored objects.
+        frame_size (int): Logical bytes per frame, the unit of range reads.
+        level (int): zlib compression level.
+        max_ratio (float): See `sniff_codec`.
+    """
+    def __init__(self, inner: StorageBackend, frame_size: int = FRAME_SIZE, level: int = 6,
+                 max_ratio: float = 0.8, max_indexes: int = 4096):
+        self.inner = inner
+        self.temp_dir = inner.temp_dir
+        self.frame_size = frame_size
+        self.level = level
+        self.max_ratio = max_ratio
+        self.max_indexes = max_indexes
+        self._indexes = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _stat(self, key: str, stat: ObjectStat, index: FrameIndex) -> ObjectStat:
+        return ObjectStat(key, index.size, stat.version, stat.modified,
+                          index.stored_size, index.codec)
+
+    def _index(self, key: str, stat: ObjectStat = None) -> tuple:
+        """Returns the inner stat of an object and its frame index."""
+        stat = stat or self.inner.stat(key)
+        with self._lock:
+            index = self._indexes.get((key, stat.version))
+            if index is not None:
+                self._indexes.move_to_end((key, stat.version))
+                return stat, index
+
+        index = FrameIndex(stat.version, "none", stat.size, stat.size)
+        if stat.size >= _HEADER.size + _TRAILER.size:
+            magic, code, frame_size = _HEADER.unpack(
+                self.inner.read_range(key, 0, _HEADER.size, version=stat.version)
+            )
+            if magic == MAGIC:
+                index = self._read_index(key, stat, code, frame_size)
+        with self._lock:
+            self._indexes[(key, stat.version)] = index
+            while len(self._indexes) > self.max_indexes:
+                self._indexes.popitem(last=False)
+        return stat, index
+
+    def _read_index(self, key: str, stat: ObjectStat, code: int, frame_size: int) -> FrameIndex:
+        size, count, end = _TRAILER.unpack(self.inner.read_range(
+            key, stat.size - _TRAILER.size, _TRAILER.size, version=stat.version
+        ))
+        index_size = count * _LENGTH.size
+        if end != END_MAGIC or code not in _CODEC_NAMES or frame_size <= 0 \
+                or index_size + _HEADER.size + _TRAILER.size > stat.size:
+            raise ValueError(f"Corrupt compressed object {key}")
+        lengths = struct.unpack(f">{count}I", self.inner.read_range(
+            key, stat.size - _TRAILER.size - index_size, index_size, version=stat.version
+        ))
+        frames, offset = [], _HEADER.size
+        for length in lengths:
+            stored = length & ~_RAW_FRAME
+            frames.append((offset, stored, bool(length & _RAW_FRAME)))
+            offset += stored
+        return FrameIndex(stat.version, _CODEC_NAMES[code], size, stat.size, frame_size, frames)
+
+    def _read_head(self, stream) -> bytes:
+        head = b""
+        while len(head) < self.frame_size:
+            more = stream.read(self.frame_size - len(head))
+            if not more:
+                break
+            head += more
+        return head
+
+    def put(self, key: str, stream, size: int = None) -> ObjectStat:
+        head = self._read_head(stream)
+        codec = sniff_codec(head, key, self.max_ratio)
+        if codec == "none" and not head.startswith(MAGIC):
+            stat = self.inner.put(key, _Chained(head, stream), size)
+            return ObjectStat(key, stat.size, stat.version, stat.modified, stat.size, "none")
+        # Content that looks like a framed object is framed too, so reads
+        # never mistake it for one
+        encoder = _FrameEncoder(head, stream, codec, self.frame_size, self.level)
+        stat = self.inner.put(key, encoder)
+        return ObjectStat(key, encoder.size, stat.version, stat.modified, stat.size, codec)
+
+    def put_file(self, key: str, path: str) -> ObjectStat:
+        with open(path, "rb") as f:
+            head = f.read(self.frame_size)
+        if sniff_codec(head, key, self.max_ratio) == "none" and not head.startswith(MAGIC):
+            stat = self.inner.put_file(key, path)
+            return ObjectStat(key, stat.size, stat.version, stat.modified, stat.size, "none")
+        return super().put_file(key, path)
+
+    def get(self, key: str) -> tuple:
+        stat, source = self.inner.get(key)
+        try:
+            stat, index = self._index(key, stat)
+        except BaseException:
+            source.close()
+            raise
+        if not index.framed:
+            return self._stat(key, stat, index), source
+        return self._stat(key, stat, index), _FramedReader(self, key, index, source)
+
+    def read_range(self, key: str, offset: int, length: int, version: str = None) -> bytes:
+        stat, index = self._index(key)
+        if version is not None and stat.version != version:
+            raise FileNotFoundError(f"{key} changed from version {version}")
+        if not index.framed:
+            return self.inner.read_range(key, offset, length, version=stat.version)
+        end = min(offset + length, index.size)
+        if offset >= end:
+            return b""
+        first, last = offset // index.frame_size, (end - 1) // index.frame_size
+        start = index.frames[first][0]
+        stop = index.frames[last][0] + index.frames[last][1]
+        # One ranged read covers every frame overlapped
+        data = self.inner.read_range(key, start, stop - start, version=stat.version)
+        parts = []
+        for frame_offset, frame_length, raw in index.frames[first:last + 1]:
+            frame = data[frame_offset - start:frame_offset - start + frame_length]
+            parts.append(_decode(index, frame, raw))
+        skip = offset - first * index.frame_size
+        return b"".join(parts)[skip:skip + end - offset]
+
+    def stat(self, key: str) -> ObjectStat:
+        stat, index = self._index(key)
+        return self._stat(key, stat, index)
+
+    def delete(self, key: str) -> bool:
+        return self.inner.delete(key)
+
+    def create_multipart(self, key: str) -> str:
+        return self.inner.create_multipart(key)
+
+    def upload_part(self, key: str, upload_id: str, part_number: int, data: bytes) -> str:
+        return self.inner.upload_part(key, upload_id, part_number, data)
+
+    def complete_multipart(self, key: str, upload_id: str, parts: list) -> ObjectStat:
+        self.inner.complete_multipart(key, upload_id, parts)
+        return self.stat(key)
+
+    def abort_multipart(self, key: str, upload_id: str):
+        self.inner.abort_multipart(key, upload_id)
+
+    def presigned_url(self, key: str, expires: int = 300, filename: str = None) -> str:
+        # Framed objects must be decompressed by the app
+        if self._index(key)[1].framed:
+            return None
+        return self.inner.presigned_url(key, expires, filename)
+
+    def local_path(self, key: str) -> str:
+        if self._index(key)[1].framed:
+            return None
+        return self.inner.local_path(key)
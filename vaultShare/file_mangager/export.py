@@ -0,0 +1,257 @@
+"""
+Module contains the streaming ZIP export of a workspace or folder subtree.
+
+The archive is written by `zipfile` into an in-memory sink that is drained
+after every chunk, so bytes reach the client as soon as they are produced,
+memory stays bounded by one chunk per export and nothing is staged on disk.
+Entries carry data descriptors and ZIP64 records where needed, which lets
+the archive be written front to back without seeking. Files are read in
+keyset pages from the database, one short query per page.
+"""
+import os
+import threading
+import time
+import uuid
+import zipfile
+from collections import OrderedDict
+
+CHUNK_SIZE = 256 * 1024
+
+# Formats already compressed, deflating them costs CPU for no gain
+STORED_EXTENSIONS = frozenset({
+    ".zip", ".gz", ".tgz", ".bz2", ".xz", ".zst", ".7z", ".rar", ".lz4",
+    ".jpg", ".jpeg", ".png", ".gif", ".webp", ".heic", ".avif",
+    ".mp3", ".aac", ".ogg", ".opus", ".flac", ".m4a",
+    ".mp4", ".m4v", ".mkv", ".mov", ".webm", ".avi",
+    ".docx", ".xlsx", ".pptx", ".odt", ".ods", ".epub", ".jar", ".apk",
+})
+STORED_MAGIC = (
+    b"PK\x03\x04", b"\x1f\x8b", b"BZh", b"\xfd7zXZ\x00", b"(\xb5/\xfd",
+    b"7z\xbc\xaf\x27\x1c", b"Rar!", b"\xff\xd8\xff", b"\x89PNG", b"GIF8",
+    b"OggS", b"fLaC", b"ID3",
+)
+
+
+def is_compressed(name: str, head: bytes) -> bool:
+    """Whether a file is already compressed, by extension or magic bytes."""
+    if os.path.splitext(name)[1].lower() in STORED_EXTENSIONS:
+        return True
+    # MP4 family, "ftyp" box after the box size
+    return head.startswith(STORED_MAGIC) or head[4:8] == b"ftyp"
+
+
+class ExportJob:
+    """
+    Progress and cancellation state of one export.
+
+    Attributes:
+        id (str): Export id.
+        state (str): "running", "done", "cancelled" or "failed".
+        files_total (int): Files in the subtree when the export started.
+        files_done (int): Files written to the archive.
+        files_missing (int): Files skipped as missing from storage.
+        bytes_read (int): Bytes read from storage.
+        bytes_sent (int): Archive bytes handed to the response.
+    """
+    def __init__(self, workspace_id: str, folder_id: str = None,
+                 files_total: int = 0, size_total: float = 0.0):
+        self.id = uuid.uuid4().hex
+        self.workspace_id = workspace_id
+        self.folder_id = folder_id
+        self.state = "running"
+        self.files_total = files_total
+        self.size_total = size_total
+        self.files_done = 0
+        self.files_missing = 0
+        self.bytes_read = 0
+        self.bytes_sent = 0
+        self.started_at = time.time()
+        self.finished_at = None
+        self._cancelled = threading.Event()
+
+    def cancel(self):
+        self._cancelled.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+    def finish(self, state: str):
+        if self.state == "running":
+            self.state = state
+            self.finished_at = time.time()
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "workspace_id": self.workspace_id,
+            "folder_id": self.folder_id,
+            "state": self.state,
+            "files_total": self.files_total,
+            "files_done": self.files_done,
+            "files_missing": self.files_missing,
+            "size_total": self.size_total,
+            "bytes_read": self.bytes_read,
+            "bytes_sent": self.bytes_sent,
+            "elapsed": (self.finished_at or time.time()) - self.started_at,
+        }
+
+
+class ExportRegistry:
+    """
+    Process wide registry of running and recent exports.
+
+    Attributes:
+        max_jobs (int): Number of jobs kept, finished jobs are dropped first.
+    """
+    def __init__(self, max_jobs: int = 256):
+        self.max_jobs = max_jobs
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def start(self, workspace_id: str, folder_id: str = None,
+              files_total: int = 0, size_total: float = 0.0) -> ExportJob:
+        job = ExportJob(workspace_id, folder_id, files_total, size_total)
+        with self._lock:
+            self._jobs[job.id] = job
+            if len(self._jobs) > self.max_jobs:
+                finished = [key for key, old in self._jobs.items() if old.state != "running"]
+                for key in finished[:len(self._jobs) - self.max_jobs]:
+                    del self._jobs[key]
+        return job
+
+    def get(self, job_id: str) -> ExportJob:
+        """Returns the job, or None."""
+        return self._jobs.get(job_id)
+
+
+class _Sink:
+    """Write-only file object collecting the bytes `zipfile` writes."""
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def iter_entries(file_db, workspace_id: str, folder_id: str, folder_paths: dict,
+                 batch_size: int = 500):
+    """
+    Yields the (archive name, storage key, date_time) of every file in the
+    subtree, one keyset page query at a time.
+
+    Args:
+        file_db (FileDB): Reads the file pages
+        folder_paths (dict): Folder id to archive path, from
+        `FolderDB.find_folder_paths`
+    """
+    after = None
+    while True:
+        try:
+            rows = file_db.find_tree_files(workspace_id, folder_id, after=after, limit=batch_size)
+        finally:
+            # No transaction stays open while the client downloads
+            file_db.close_session()
+        for file_id, name, path, file_folder_id, updated_at in rows:
+            parent = folder_paths.get(file_folder_id)
+            arcname = f"{parent}/{name}" if parent else name
+            date_time = updated_at.timetuple()[:6] if updated_at else time.localtime()[:6]
+            yield arcname, path, date_time
+        if len(rows) < batch_size:
+            return
+        after = rows[-1][0]
+
+
+def _unique(zf: zipfile.ZipFile, arcname: str) -> str:
+    if arcname not in zf.NameToInfo:
+        return arcname
+    stem, ext = os.path.splitext(arcname)
+    i = 1
+    while f"{stem} ({i}){ext}" in zf.NameToInfo:
+        i += 1
+    return f"{stem} ({i}){ext}"
+
+
+def stream_zip(job: ExportJob, storage, entries, directories=(),
+               chunk_size: int = CHUNK_SIZE, compresslevel: int = 6):
+    """
+    Generates a ZIP64 archive of the entries, chunk by chunk.
+
+    The export stops between chunks once the job is cancelled, or when the
+    client goes away and the generator is closed, leaving a truncated
+    archive.
+
+    Args:
+        job (ExportJob): Records the progress
+        storage (StorageBackend): Holds the files
+        entries (iterable): (archive name, storage key, date_time) tuples
+        directories (iterable): Archive paths of the folders, written as
+        directory entries so empty folders survive
+        chunk_size (int): Bytes read from storage at a time
+
+    Yields:
+        bytes: The next part of the archive
+    """
+    sink = _Sink()
+    zf = zipfile.ZipFile(sink, "w", zipfile.ZIP_DEFLATED, compresslevel=compresslevel)
+    try:
+        for directory in directories:
+            zf.writestr(zipfile.ZipInfo(directory.rstrip("/") + "/"), b"")
+        data = sink.drain()
+        if data:
+            job.bytes_sent += len(data)
+            yield data
+
+        for arcname, path, date_time in entries:
+            if job.cancelled:
+                job.finish("cancelled")
+                return
+            try:
+                stat, source = storage.get(path)
+            except OSError:
+                job.files_missing += 1
+                continue
+            with source:
+                head = source.read(chunk_size)
+                info = zipfile.ZipInfo(_unique(zf, arcname), date_time=max(date_time, (1980, 1, 1, 0, 0, 0)))
+                info.file_size = stat.size
+                info.compress_type = (
+                    zipfile.ZIP_STORED if is_compressed(arcname, head) else zipfile.ZIP_DEFLATED
+                )
+                # Sizes over 4 GB need ZIP64 extra fields, zipfile adds them
+                # from the file_size set above
+                with zf.open(info, "w") as dest:
+                    chunk = head
+                    while chunk:
+                        job.bytes_read += len(chunk)
+                        dest.write(chunk)
+                        data = sink.drain()
+                        if data:
+                            job.bytes_sent += len(data)
+                            yield data
+                        if job.cancelled:
+                            job.finish("cancelled")
+                            return
+                        chunk = source.read(chunk_size)
+            job.files_done += 1
+
+        zf.close()
+        data = sink.drain()
+        job.bytes_sent += len(data)
+        job.finish("done")
+        yield data
+    except GeneratorExit:
+        job.finish("cancelled")
+        raise
+    except Exception:
+        job.finish("failed")
+        raise
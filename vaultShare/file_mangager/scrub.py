@@ -0,0 +1,296 @@
+"""
+Module contains the background integrity scrubber of stored files.
+
+The scrubber walks the "files" table in primary key pages, re-hashes the
+content of every file and compares it with the checksum recorded when the
+content was written. Corrupted and missing files raise an alert to the
+workspace admin. Files without a checksum get one recorded, so later
+passes can check them.
+
+Reads are large and sequential, and paced by an `IOBudget` of bytes per
+second, so a pass never saturates the disks that serve requests. Local
+files are mapped and hashed in place, then dropped from the page cache so
+scrubbing does not evict the files users are reading. The position of the
+running pass is checkpointed after every page, and a restarted scrubber
+resumes where it stopped.
+"""
+import atexit
+import hashlib
+import mmap
+import os
+import threading
+import time
+import uuid
+import zlib
+from datetime import datetime, timezone
+from sqlalchemy.exc import SQLAlchemyError
+
+CHUNK_SIZE = 4 * 1024 * 1024
+
+
+def utcnow() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+class IOBudget:
+    """
+    Token bucket pacing reads to a byte rate, safe to share between threads.
+
+    Attributes:
+        rate (float): Bytes per second, 0 for no limit.
+        burst (float): Bytes that may be read at once after an idle spell.
+    """
+    def __init__(self, rate: float, burst: float = CHUNK_SIZE, clock=time.monotonic,
+                 sleep=time.sleep):
+        self.rate = rate
+        self.burst = burst
+        self._clock = clock
+        self._sleep = sleep
+        self._tokens = burst
+        self._stamp = clock()
+        self._lock = threading.Lock()
+
+    def spend(self, size: int, stop: threading.Event = None) -> bool:
+        """
+        Waits until `size` bytes may be read.
+
+        The bytes are taken from the bucket under the lock, the wait for them
+        happens outside of it, so threads sharing the budget queue up in turn.
+
+        Args:
+            size (int): Bytes about to be read
+            stop (threading.Event): Cuts the wait short once set. Optional
+
+        Returns:
+            bool: False when the wait was cut short by `stop`
+        """
+        if not self.rate:
+            return True
+        with self._lock:
+            now = self._clock()
+            self._tokens = min(self.burst, self._tokens + (now - self._stamp) * self.rate)
+            self._stamp = now
+            self._tokens -= size
+            delay = -self._tokens / self.rate
+        if delay <= 0:
+            return True
+        if stop is not None:
+            return not stop.wait(delay)
+        self._sleep(delay)
+        return True
+
+
+def _drop_cache(fd: int):
+    if hasattr(os, "posix_fadvise"):
+        try:
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+        except OSError:
+            pass
+
+
+def content_checksum(source, budget: IOBudget = None, chunk_size: int = CHUNK_SIZE,
+                     drop_cache: bool = False, stop: threading.Event = None) -> tuple:
+    """
+    Hashes the content of an open file with SHA-256.
+
+    Args:
+        source (file): Opened for binary reading, from a storage backend
+        budget (IOBudget): Paces the reads. Optional
+        drop_cache (bool): Evict a local file from the page cache once
+        hashed. Optional
+        stop (threading.Event): Ends waits on the budget once set, the rest
+        of the file is read unpaced. Optional
+
+    Returns:
+        tuple: hex digest and bytes read
+    """
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        fd = source.fileno()
+    except (AttributeError, OSError):
+        fd = None
+
+    if fd is not None and os.fstat(fd).st_size:
+        if hasattr(os, "posix_fadvise"):
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        with mmap.mmap(fd, 0, access=mmap.ACCESS_READ) as mapped, memoryview(mapped) as view:
+            if hasattr(mapped, "madvise"):
+                mapped.madvise(mmap.MADV_SEQUENTIAL)
+            for offset in range(0, len(view), chunk_size):
+                chunk = view[offset:offset + chunk_size]
+                if budget:
+                    budget.spend(len(chunk), stop)
+                digest.update(chunk)
+                size += len(chunk)
+                chunk.release()
+        if drop_cache:
+            _drop_cache(fd)
+        return digest.hexdigest(), size
+
+    while True:
+        if budget:
+            budget.spend(chunk_size, stop)
+        chunk = source.read(chunk_size)
+        if not chunk:
+            return digest.hexdigest(), size
+        digest.update(chunk)
+        size += len(chunk)
+
+
+def file_checksum(path: str, chunk_size: int = CHUNK_SIZE) -> str:
+    """hex SHA-256 of a local file."""
+    with open(path, "rb") as f:
+        return content_checksum(f, chunk_size=chunk_size)[0]
+
+
+class Scrubber:
+    """
+    Re-hashes stored files in the background and reports those that no
+    longer match their checksum.
+
+    Attributes:
+        rate (float): Bytes per second read at most, 0 for no limit.
+        batch_size (int): Files per page and per checkpoint.
+        pass_interval (float): Seconds between the start of passes.
+    """
+    def __init__(self, scrub_db, alert_db, storage, rate: float = 20 * 1024 * 1024,
+                 batch_size: int = 100, pass_interval: float = 24 * 3600,
+                 chunk_size: int = CHUNK_SIZE, name: str = "files", budget: IOBudget = None):
+        self._scrub_db = scrub_db
+        self._alert_db = alert_db
+        self._storage = storage
+        self.rate = rate
+        self.batch_size = batch_size
+        self.pass_interval = pass_interval
+        self.chunk_size = chunk_size
+        self.name = name
+        self._stopped = threading.Event()
+        # Scrubbers of several shards may share one budget, and one disk
+        self._budget = budget or IOBudget(rate, max(chunk_size, 1))
+        self._thread = None
+
+    def _hash(self, path: str) -> tuple:
+        """Returns the checksum and size of stored content, None if missing."""
+        try:
+            _, source = self._storage.get(path)
+        except FileNotFoundError:
+            return None
+        with source:
+            return content_checksum(source, self._budget, self.chunk_size, drop_cache=True,
+                                    stop=self._stopped)
+
+    def _report(self, file_id: str, workspace_id: str, name: str, problem: str):
+        admin_id = self._scrub_db.find_workspace_admin(workspace_id)
+        if admin_id is None:
+            return
+        message = {
+            "file_corrupted": f"File {name} ({file_id}) no longer matches its checksum.",
+            "file_missing": f"File {name} ({file_id}) is missing from storage.",
+        }[problem]
+        # A file left broken is reported again once its alert is read
+        if self._alert_db.has_unread_alert(admin_id, problem, message):
+            return
+        self._alert_db.add_alert(str(uuid.uuid4()), problem, admin_id, message, workspace_id)
+
+    def check_file(self, file_id: str, workspace_id: str, name: str, path: str,
+                   checksum: str, updated_at) -> tuple:
+        """
+        Checks one file.
+
+        Returns:
+            tuple: The outcome, "ok", "recorded", "changed", "file_missing"
+            or "file_corrupted", and the bytes read
+        """
+        try:
+            result = self._hash(path)
+        except (ValueError, zlib.error):
+            # Compressed content that no longer decodes
+            result = ("", 0)
+        if result is not None and result[0] and checksum is None:
+            self._scrub_db.record_checksum(file_id, result[0])
+            return "recorded", result[1]
+        if result is not None and result[0] == checksum:
+            return "ok", result[1]
+
+        # The file may have been updated or deleted since the page was read
+        current = self._scrub_db.find_file_checksum(file_id)
+        if current is None or tuple(current) != (checksum, updated_at):
+            return "changed", result[1] if result else 0
+        problem = "file_missing" if result is None else "file_corrupted"
+        self._report(file_id, workspace_id, name, problem)
+        return problem, result[1] if result else 0
+
+    def scrub_batch(self) -> bool:
+        """
+        Checks the next page of files and checkpoints the pass.
+
+        Returns:
+            bool: Whether the pass is complete
+        """
+        try:
+            checkpoint = self._scrub_db.find_checkpoint(self.name)
+            if checkpoint.last_file_id is None:
+                checkpoint.pass_started_at = utcnow()
+                checkpoint.files_checked = checkpoint.bytes_checked = 0
+                checkpoint.problems_found = 0
+            rows = self._scrub_db.find_scrub_batch(checkpoint.last_file_id, self.batch_size)
+            # No transaction stays open while files are read
+            self._scrub_db.close_session()
+            for row in rows:
+                if self._stopped.is_set():
+                    break
+                outcome, size = self.check_file(*row)
+                checkpoint.last_file_id = row[0]
+                checkpoint.files_checked += 1
+                checkpoint.bytes_checked += size
+                checkpoint.problems_found += outcome in ("file_missing", "file_corrupted")
+            done = len(rows) < self.batch_size and not self._stopped.is_set()
+            if done:
+                checkpoint.last_file_id = None
+                checkpoint.pass_finished_at = utcnow()
+            self._scrub_db.save_checkpoint(checkpoint, utcnow())
+            return done
+        finally:
+            self._scrub_db.close_session()
+            self._alert_db.close_session()
+
+    def run_pass(self):
+        """Checks files until the running pass completes or the scrubber stops."""
+        while not self.scrub_batch():
+            if self._stopped.is_set():
+                return
+
+    def run_forever(self):
+        """Runs a pass every `pass_interval` seconds until the scrubber stops."""
+        while not self._stopped.is_set():
+            started = time.monotonic()
+            try:
+                self.run_pass()
+            except SQLAlchemyError as e:
+                # TODO: Error would be logged using custom logger
+                print(f"Error scrubbing files: {e}")
+            self._stopped.wait(max(0.0, self.pass_interval - (time.monotonic() - started)))
+
+    def start(self):
+        """Starts the scrubber thread, it stops at exit."""
+        if self._thread is None:
+            self._stopped.clear()
+            self._thread = threading.Thread(
+                target=self.run_forever, name="vaultshare-scrubber", daemon=True
+            )
+            self._thread.start()
+            atexit.register(self.stop)
+
+    def join(self, timeout: float = None):
+        """Waits for the scrubber thread to stop."""
+        thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+
+    def stop(self):
+        """Stops the scrubber thread after the file it is checking."""
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
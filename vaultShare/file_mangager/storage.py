@@ -0,0 +1,474 @@
+"""
+Module contains the storage backends file content is kept in.
+
+`File.path` holds a storage key, a relative "/" separated name, and every
+read and write of content goes through the app's backend. `LocalStorage`
+keeps objects under a directory of one node's disk. `S3Storage` keeps them
+in an S3 compatible bucket shared by every app server, and hands out
+presigned URLs so downloads go straight to the bucket.
+
+Missing objects raise `FileNotFoundError` on every backend.
+"""
+import os
+import posixpath
+import shutil
+import tempfile
+import threading
+import uuid
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+# size in bytes, version changes whenever the content does, modified is a
+# POSIX timestamp. stored_size and codec differ from size and "none" only
+# for compressed objects, see vaultShare.file_mangager.compression
+ObjectStat = namedtuple(
+    "ObjectStat", ["key", "size", "version", "modified", "stored_size", "codec"],
+    defaults=(None, "none")
+)
+
+COPY_SIZE = 1024 * 1024
+
+
+def _check_key(key: str) -> str:
+    """Rejects keys escaping the storage root."""
+    parts = key.replace("\\", "/").split("/")
+    if not key or key.startswith("/") or any(part in ("", ".", "..") for part in parts):
+        raise ValueError(f"Invalid storage key {key!r}")
+    return "/".join(parts)
+
+
+class StorageBackend:
+    """
+    Interface of a content store.
+
+    Attributes:
+        temp_dir (str): Directory temporary files bound for `put_file` are
+        best created in, None for the system default.
+    """
+    temp_dir = None
+
+    def put(self, key: str, stream, size: int = None) -> ObjectStat:
+        """
+        Stores the content of a binary stream under `key`, replacing any
+        object there. Readers see the old or the new content, never a mix.
+        """
+        raise NotImplementedError
+
+    def put_file(self, key: str, path: str) -> ObjectStat:
+        """Stores a local file under `key` and removes the file."""
+        with open(path, "rb") as f:
+            stat = self.put(key, f, os.fstat(f.fileno()).st_size)
+        os.unlink(path)
+        return stat
+
+    def get(self, key: str) -> tuple:
+        """
+        Opens an object for streaming.
+
+        Returns:
+            tuple: The ObjectStat and a binary file object, which the caller
+            closes
+        """
+        raise NotImplementedError
+
+    def read_range(self, key: str, offset: int, length: int, version: str = None) -> bytes:
+        """
+        Reads up to `length` bytes from `offset`.
+
+        Args:
+            version (str): Fail with FileNotFoundError unless the object is
+            still at this version. Optional
+        """
+        raise NotImplementedError
+
+    def stat(self, key: str) -> ObjectStat:
+        raise NotImplementedError
+
+    def delete(self, key: str) -> bool:
+        """Deletes an object, returns whether it existed."""
+        raise NotImplementedError
+
+    def create_multipart(self, key: str) -> str:
+        """Starts a multipart upload, returns its id."""
+        raise NotImplementedError
+
+    def upload_part(self, key: str, upload_id: str, part_number: int, data: bytes) -> str:
+        """
+        Uploads one part, numbered from 1. Parts may be uploaded in any
+        order and in parallel.
+
+        Returns:
+            str: Part tag to pass to `complete_multipart`
+        """
+        raise NotImplementedError
+
+    def complete_multipart(self, key: str, upload_id: str, parts: list) -> ObjectStat:
+        """
+        Assembles the parts into the object.
+
+        Args:
+            parts (list): (part number, tag) pairs
+        """
+        raise NotImplementedError
+
+    def abort_multipart(self, key: str, upload_id: str):
+        raise NotImplementedError
+
+    def presigned_url(self, key: str, expires: int = 300, filename: str = None) -> str:
+        """
+        URL a client can download the object from directly, or None when
+        the backend cannot serve one and the app must stream the bytes.
+        """
+        return None
+
+    def local_path(self, key: str) -> str:
+        """
+        Filesystem path of an object, or None when it is not on this
+        node's disk.
+        """
+        return None
+
+
+class LocalStorage(StorageBackend):
+    """
+    Objects kept as files under a directory.
+
+    Writes go to a temporary file in the root that is fsynced and renamed
+    over the object, so they are atomic.
+
+    Attributes:
+        root (str): Storage directory.
+    """
+    def __init__(self, root: str):
+        self.root = os.path.abspath(root)
+        self.temp_dir = os.path.join(self.root, ".tmp")
+        os.makedirs(self.temp_dir, exist_ok=True)
+
+    def local_path(self, key: str) -> str:
+        parts = _check_key(key).split("/")
+        if parts[0] == ".tmp":
+            raise ValueError(f"Invalid storage key {key!r}")
+        return os.path.join(self.root, *parts)
+
+    def _stat(self, key: str, st) -> ObjectStat:
+        return ObjectStat(
+            key, st.st_size, f"{st.st_size}-{st.st_mtime_ns}", st.st_mtime, st.st_size
+        )
+
+    def _commit(self, key: str, temp_path: str) -> ObjectStat:
+        path = self.local_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(temp_path, path)
+        return self.stat(key)
+
+    def put(self, key: str, stream, size: int = None) -> ObjectStat:
+        self.local_path(key)
+        fd, temp_path = tempfile.mkstemp(dir=self.temp_dir)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                shutil.copyfileobj(stream, f, COPY_SIZE)
+                f.flush()
+                os.fsync(f.fileno())
+            return self._commit(key, temp_path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.unlink(temp_path)
+            raise
+
+    def put_file(self, key: str, path: str) -> ObjectStat:
+        if os.path.dirname(os.path.abspath(path)) == self.temp_dir:
+            return self._commit(key, path)
+        return super().put_file(key, path)
+
+    def get(self, key: str) -> tuple:
+        f = open(self.local_path(key), "rb")
+        return self._stat(key, os.fstat(f.fileno())), f
+
+    def read_range(self, key: str, offset: int, length: int, version: str = None) -> bytes:
+        with open(self.local_path(key), "rb") as f:
+            if version is not None and self._stat(key, os.fstat(f.fileno())).version != version:
+                raise FileNotFoundError(f"{key} changed from version {version}")
+            return os.pread(f.fileno(), length, offset)
+
+    def stat(self, key: str) -> ObjectStat:
+        path = self.local_path(key)
+        st = os.stat(path)
+        if not os.path.isfile(path):
+            raise FileNotFoundError(path)
+        return self._stat(key, st)
+
+    def delete(self, key: str) -> bool:
+        try:
+            os.unlink(self.local_path(key))
+        except FileNotFoundError:
+            return False
+        return True
+
+    def _upload_dir(self, key: str, upload_id: str) -> str:
+        if not upload_id.isalnum():
+            raise ValueError(f"Invalid upload id {upload_id!r}")
+        return os.path.join(self.temp_dir, f"upload-{upload_id}")
+
+    def create_multipart(self, key: str) -> str:
+        self.local_path(key)
+        upload_id = uuid.uuid4().hex
+        os.mkdir(self._upload_dir(key, upload_id))
+        return upload_id
+
+    def upload_part(self, key: str, upload_id: str, part_number: int, data: bytes) -> str:
+        upload_dir = self._upload_dir(key, upload_id)
+        fd, temp_path = tempfile.mkstemp(dir=upload_dir)
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(temp_path, os.path.join(upload_dir, f"{part_number:05d}"))
+        return str(len(data))
+
+    def complete_multipart(self, key: str, upload_id: str, parts: list) -> ObjectStat:
+        upload_dir = self._upload_dir(key, upload_id)
+        fd, temp_path = tempfile.mkstemp(dir=self.temp_dir)
+        try:
+            with os.fdopen(fd, "wb") as dest:
+                for part_number, _ in sorted(parts):
+                    with open(os.path.join(upload_dir, f"{part_number:05d}"), "rb") as part:
+                        shutil.copyfileobj(part, dest, COPY_SIZE)
+                dest.flush()
+                os.fsync(dest.fileno())
+            stat = self._commit(key, temp_path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.unlink(temp_path)
+            raise
+        shutil.rmtree(upload_dir, ignore_errors=True)
+        return stat
+
+    def abort_multipart(self, key: str, upload_id: str):
+        shutil.rmtree(self._upload_dir(key, upload_id), ignore_errors=True)
+
+
+class _BodyReader:
+    """Binary file object over a streaming S3 response body."""
+    def __init__(self, body):
+        self._body = body
+
+    def read(self, size: int = -1) -> bytes:
+        return self._body.read(None if size is None or size < 0 else size)
+
+    def readable(self) -> bool:
+        return True
+
+    def close(self):
+        self._body.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class S3Storage(StorageBackend):
+    """
+    Objects kept in an S3 compatible bucket, e.g. AWS S3 or MinIO.
+
+    One client, and its pool of keep-alive connections, is shared by every
+    thread of the process. Streams larger than `part_size` are uploaded as
+    multipart uploads with up to `upload_concurrency` parts in flight,
+    which also bounds the memory an upload holds.
+
+    Requires the optional `boto3` package.
+
+    Attributes:
+        bucket (str): Bucket name.
+        prefix (str): Prepended to every key.
+        part_size (int): Multipart part size, 5 MiB at least.
+        upload_concurrency (int): Parts uploaded in parallel per upload.
+    """
+    MIN_PART_SIZE = 5 * 1024 * 1024
+
+    def __init__(self, bucket: str, prefix: str = "", endpoint_url: str = None,
+                 region: str = None, max_pool_connections: int = 32,
+                 part_size: int = 16 * 1024 * 1024, upload_concurrency: int = 4):
+        import boto3
+        from botocore.config import Config as BotoConfig
+        from botocore.exceptions import ClientError
+
+        self.bucket = bucket
+        self.prefix = prefix
+        self.part_size = max(part_size, self.MIN_PART_SIZE)
+        self.upload_concurrency = upload_concurrency
+        self._client_error = ClientError
+        self._client = boto3.session.Session().client(
+            "s3", endpoint_url=endpoint_url, region_name=region,
+            config=BotoConfig(
+                max_pool_connections=max_pool_connections,
+                retries={"max_attempts": 5, "mode": "adaptive"},
+                tcp_keepalive=True,
+                # MinIO and most stand-ins only serve path style URLs
+                s3={"addressing_style": "path" if endpoint_url else "auto"},
+            )
+        )
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _key(self, key: str) -> str:
+        return posixpath.join(self.prefix, _check_key(key)) if self.prefix else _check_key(key)
+
+    def _missing(self, error) -> bool:
+        code = error.response.get("Error", {}).get("Code")
+        return code in ("404", "NoSuchKey", "NotFound", "412", "PreconditionFailed")
+
+    def _stat(self, key: str, response: dict) -> ObjectStat:
+        size = response["ContentLength"]
+        return ObjectStat(
+            key, size, response["ETag"].strip('"'), response["LastModified"].timestamp(), size
+        )
+
+    def _parts_executor(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.upload_concurrency * 4,
+                    thread_name_prefix="vaultshare-s3-upload"
+                )
+        return self._executor
+
+    def put(self, key: str, stream, size: int = None) -> ObjectStat:
+        first = stream.read(self.part_size)
+        if len(first) < self.part_size:
+            self._client.put_object(Bucket=self.bucket, Key=self._key(key), Body=first)
+            return self.stat(key)
+
+        upload_id = self.create_multipart(key)
+        executor = self._parts_executor()
+        pending, parts = set(), []
+        try:
+            data, part_number = first, 1
+            while data:
+                if len(pending) >= self.upload_concurrency:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    parts.extend(future.result() for future in done)
+                pending.add(executor.submit(
+                    lambda n, d: (n, self.upload_part(key, upload_id, n, d)),
+                    part_number, data
+                ))
+                data, part_number = stream.read(self.part_size), part_number + 1
+            parts.extend(future.result() for future in wait(pending).done)
+            return self.complete_multipart(key, upload_id, parts)
+        except BaseException:
+            for future in pending:
+                future.cancel()
+            self.abort_multipart(key, upload_id)
+            raise
+
+    def get(self, key: str) -> tuple:
+        try:
+            response = self._client.get_object(Bucket=self.bucket, Key=self._key(key))
+        except self._client_error as e:
+            if self._missing(e):
+                raise FileNotFoundError(key) from e
+            raise
+        return self._stat(key, response), _BodyReader(response["Body"])
+
+    def read_range(self, key: str, offset: int, length: int, version: str = None) -> bytes:
+        if length <= 0:
+            return b""
+        kwargs = {"IfMatch": f'"{version}"'} if version is not None else {}
+        try:
+            response = self._client.get_object(
+                Bucket=self.bucket, Key=self._key(key),
+                Range=f"bytes={offset}-{offset + length - 1}", **kwargs
+            )
+        except self._client_error as e:
+            if e.response.get("Error", {}).get("Code") == "InvalidRange":
+                return b""
+            if self._missing(e):
+                raise FileNotFoundError(key) from e
+            raise
+        with response["Body"] as body:
+            return body.read()
+
+    def stat(self, key: str) -> ObjectStat:
+        try:
+            response = self._client.head_object(Bucket=self.bucket, Key=self._key(key))
+        except self._client_error as e:
+            if self._missing(e):
+                raise FileNotFoundError(key) from e
+            raise
+        return self._stat(key, response)
+
+    def delete(self, key: str) -> bool:
+        try:
+            self.stat(key)
+        except FileNotFoundError:
+            return False
+        self._client.delete_object(Bucket=self.bucket, Key=self._key(key))
+        return True
+
+    def create_multipart(self, key: str) -> str:
+        response = self._client.create_multipart_upload(Bucket=self.bucket, Key=self._key(key))
+        return response["UploadId"]
+
+    def upload_part(self, key: str, upload_id: str, part_number: int, data: bytes) -> str:
+        response = self._client.upload_part(
+            Bucket=self.bucket, Key=self._key(key), UploadId=upload_id,
+            PartNumber=part_number, Body=data
+        )
+        return response["ETag"]
+
+    def complete_multipart(self, key: str, upload_id: str, parts: list) -> ObjectStat:
+        self._client.complete_multipart_upload(
+            Bucket=self.bucket, Key=self._key(key), UploadId=upload_id,
+            MultipartUpload={"Parts": [
+                {"PartNumber": number, "ETag": tag} for number, tag in sorted(parts)
+            ]}
+        )
+        return self.stat(key)
+
+    def abort_multipart(self, key: str, upload_id: str):
+        self._client.abort_multipart_upload(
+            Bucket=self.bucket, Key=self._key(key), UploadId=upload_id
+        )
+
+    def presigned_url(self, key: str, expires: int = 300, filename: str = None) -> str:
+        params = {"Bucket": self.bucket, "Key": self._key(key)}
+        if filename:
+            quoted = filename.replace("\\", "\\\\").replace('"', '\\"')
+            params["ResponseContentDisposition"] = f'attachment; filename="{quoted}"'
+        return self._client.generate_presigned_url(
+            "get_object", Params=params, ExpiresIn=expires
+        )
+
+
+def create_storage(config) -> StorageBackend:
+    """
+    Builds the storage backend named by the `STORAGE_BACKEND` setting,
+    compressing when `STORAGE_COMPRESSION` is on.
+    """
+    storage = _create_backend(config)
+    if config["STORAGE_COMPRESSION"]:
+        from .compression import CompressedStorage
+
+        storage = CompressedStorage(
+            storage,
+            frame_size=config["COMPRESSION_FRAME_SIZE"],
+            level=config["COMPRESSION_LEVEL"],
+            max_ratio=config["COMPRESSION_MAX_RATIO"]
+        )
+    return storage
+
+
+def _create_backend(config) -> StorageBackend:
+    backend = config["STORAGE_BACKEND"]
+    if backend == "local":
+        return LocalStorage(config["FILE_STORAGE_ROOT"])
+    if backend == "s3":
+        return S3Storage(
+            config["S3_BUCKET"],
+            prefix=config["S3_PREFIX"],
+            endpoint_url=config["S3_ENDPOINT_URL"],
+            region=config["S3_REGION"],
+            max_pool_connections=config["S3_MAX_POOL_CONNECTIONS"],
+            part_size=config["S3_PART_SIZE"],
+            upload_concurrency=config["S3_UPLOAD_CONCURRENCY"]
+        )
+    raise ValueError(f"Unknown storage backend {backend!r}")
@@ -0,0 +1,13 @@
+from concurrent.futures import ThreadPoolExecutor
+from .broker import Broker
+
+# Process wide broker shared by the DB layer and the streaming routes
+broker = Broker()
+# Single background worker that delivers notifications off the request path
+dispatcher = ThreadPoolExecutor(max_workers=1, thread_name_prefix="vaultshare-notify")
+
+
+def deliver(messages: list):
+    """Publishes a batch of (topic, message) pairs to the broker."""
+    for topic, message in messages:
+        broker.publish(topic, message)
@@ -0,0 +1,85 @@
+"""
+Module contains an in-process publish/subscribe broker.
+
+Long-poll and server-sent events clients block on a topic until something
+is published to it, so an idle client costs a sleeping thread and no
+database queries.
+"""
+import threading
+from collections import deque
+
+
+class _Topic:
+    """Recent messages and the condition waiters of one topic sleep on."""
+    __slots__ = ("condition", "messages", "version")
+
+    def __init__(self, lock, history):
+        self.condition = threading.Condition(lock)
+        self.messages = deque(maxlen=history)
+        self.version = 0
+
+
+class Broker:
+    """
+    Broker keeps a short history of versioned messages per topic.
+
+    Attributes:
+        history (int): Number of recent messages kept per topic.
+    """
+    def __init__(self, history: int = 100):
+        self.history = history
+        self._lock = threading.Lock()
+        self._topics = {}
+
+    def _topic(self, name: str) -> _Topic:
+        topic = self._topics.get(name)
+        if topic is None:
+            topic = self._topics[name] = _Topic(self._lock, self.history)
+        return topic
+
+    def publish(self, name: str, message) -> int:
+        """
+        Publishes a message to a topic and wakes the topic's waiters.
+
+        Args:
+            name (str): Topic name.
+            message: Any object, handed as is to subscribers.
+
+        Returns:
+            int: Version of the published message.
+        """
+        with self._lock:
+            topic = self._topic(name)
+            topic.version += 1
+            topic.messages.append((topic.version, message))
+            topic.condition.notify_all()
+            return topic.version
+
+    def version(self, name: str) -> int:
+        """Returns the version of the latest message published to a topic."""
+        with self._lock:
+            topic = self._topics.get(name)
+            return topic.version if topic else 0
+
+    def wait(self, name: str, since: int, timeout: float = None):
+        """
+        Blocks until a message newer than `since` is published to a topic.
+
+        Args:
+            name (str): Topic name.
+            since (int): Last version seen by the caller.
+            timeout (float): Seconds to wait. Waits forever if None.
+
+        Returns:
+            tuple: (version, messages, complete), where `messages` lists the
+            messages published after `since` and `complete` is False if some
+            of them already fell out of the topic history.
+        """
+        with self._lock:
+            topic = self._topic(name)
+            topic.condition.wait_for(lambda: topic.version > since, timeout)
+
+            messages = [msg for version, msg in topic.messages if version > since]
+            oldest = topic.messages[0][0] if topic.messages else topic.version + 1
+            complete = since >= oldest - 1 or since >= topic.version
+            return topic.version, messages, complete
@@ -0,0 +1,191 @@
+"""
+Module contains the on-demand profiler of production requests.
+
+A request is profiled when a site admin sends the `PROFILE_HEADER` header,
+or when it is drawn by `PROFILE_SAMPLE_RATE`. It runs under cProfile, or
+under a stack sampler that inspects the request thread every
+`PROFILE_SAMPLE_INTERVAL` seconds and costs little more than that. Output
+goes to `PROFILE_DIR`:
+
+    <name>.prof     pstats file, `python -m pstats <name>.prof`
+    <name>.folded   folded stacks, for flamegraph.pl or speedscope
+    <name>.json     route, status, duration and the SQL statements run
+
+The hooks are only installed when `PROFILE_DIR` is set, and cost a header
+lookup and a random draw per request when no profile is taken.
+"""
+import cProfile
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+MODES = ("cprofile", "sample")
+
+# Profile of the request the thread is serving, read by the SQL listeners
+_local = threading.local()
+_listening = False
+_listen_lock = threading.Lock()
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if getattr(_local, "profile", None) is not None:
+        context._vaultshare_started = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    profile = getattr(_local, "profile", None)
+    started = getattr(context, "_vaultshare_started", None)
+    if profile is not None and started is not None:
+        profile.add_statement(statement, time.perf_counter() - started)
+
+
+def _listen_sql():
+    """Times the statements of every engine, once per process."""
+    global _listening
+    with _listen_lock:
+        if not _listening:
+            event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+            event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
+            _listening = True
+
+
+class StackSampler:
+    """
+    Samples the stack of a thread at a fixed interval, from another thread.
+
+    Attributes:
+        stacks (Counter): Samples of each "outer;...;inner" stack.
+    """
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.stacks = Counter()
+        self._target = None
+        self._stopped = threading.Event()
+        self._thread = None
+
+    @staticmethod
+    def _frame_name(frame) -> str:
+        code = frame.f_code
+        return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self._target)
+            names = []
+            while frame is not None:
+                names.append(self._frame_name(frame))
+                frame = frame.f_back
+            if names:
+                self.stacks[";".join(reversed(names))] += 1
+
+    def start(self):
+        """Starts sampling the calling thread."""
+        self._target = threading.get_ident()
+        self._thread = threading.Thread(
+            target=self._run, name="vaultshare-profiler", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+
+    def dump(self, path: str):
+        """Writes the samples in folded stack format."""
+        with open(path, "w") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+class RequestProfile:
+    """
+    Profile of a single request.
+
+    Attributes:
+        name (str): File name of the outputs, without extension.
+        mode (str): "cprofile" or "sample".
+        statements (dict): [count, seconds] of each SQL statement run.
+        status (int): Response status, None until known.
+    """
+    def __init__(self, mode: str, endpoint: str, method: str, path: str,
+                 sample_interval: float = 0.005):
+        if mode not in MODES:
+            raise ValueError(f"Unknown profile mode <{mode}>, use one of {MODES}")
+        self.mode = mode
+        self.endpoint = endpoint
+        self.method = method
+        self.path = path
+        stamp = time.strftime("%Y%m%dT%H%M%S", time.gmtime())
+        self.name = f"{stamp}-{endpoint or 'unknown'}-{uuid.uuid4().hex[:8]}"
+        self.statements = {}
+        self.status = None
+        if mode == "cprofile":
+            self._profiler = cProfile.Profile()
+        else:
+            self._profiler = StackSampler(sample_interval)
+        self._started = None
+        self.duration = None
+
+    def add_statement(self, statement: str, seconds: float):
+        stats = self.statements.setdefault(statement, [0, 0.0])
+        stats[0] += 1
+        stats[1] += seconds
+
+    def start(self):
+        """Starts profiling the calling thread and timing its SQL."""
+        _listen_sql()
+        _local.profile = self
+        self._started = time.perf_counter()
+        if self.mode == "cprofile":
+            self._profiler.enable()
+        else:
+            self._profiler.start()
+
+    def stop(self):
+        if self.mode == "cprofile":
+            self._profiler.disable()
+        else:
+            self._profiler.stop()
+        self.duration = time.perf_counter() - self._started
+        _local.profile = None
+
+    def dump(self, directory: str) -> list:
+        """
+        Writes the profile and its tags to `directory`.
+
+        Returns:
+            list: Paths of the written files
+        """
+        os.makedirs(directory, exist_ok=True)
+        base = os.path.join(directory, self.name)
+        if self.mode == "cprofile":
+            paths = [f"{base}.prof"]
+            self._profiler.dump_stats(paths[0])
+        else:
+            paths = [f"{base}.folded"]
+            self._profiler.dump(paths[0])
+        statements = sorted(self.statements.items(), key=lambda item: -item[1][1])
+        tags = {
+            "endpoint": self.endpoint,
+            "method": self.method,
+            "path": self.path,
+            "status": self.status,
+            "mode": self.mode,
+            "duration": self.duration,
+            "sql_count": sum(count for count, _ in self.statements.values()),
+            "sql_seconds": sum(seconds for _, seconds in self.statements.values()),
+            "sql": [
+                {"statement": statement, "count": count, "seconds": seconds}
+                for statement, (count, seconds) in statements
+            ],
+        }
+        paths.append(f"{base}.json")
+        with open(paths[-1], "w") as f:
+            json.dump(tags, f, indent=2)
+        return paths
@@ -0,0 +1,204 @@
+"""
+Module contains the lazily created resources shared by an app's requests.
+
+Nothing here touches the database at import time. The engines are created,
+and the schema initialized, on the first request that needs them, so tests,
+CLI tools and forked workers only pay for what they use.
+"""
+import threading
+from flask import current_app
+
+
+class Resources:
+    """
+    Per app registry of the engine, DB objects and in-memory services.
+
+    Attributes:
+        config (dict): The app configuration.
+    """
+    def __init__(self, config):
+        self.config = config
+        self._router = None
+        self._objects = {}
+        self._lock = threading.RLock()
+
+    @property
+    def router(self):
+        """Shard router of the app's databases, created on first use."""
+        if self._router is None:
+            with self._lock:
+                if self._router is None:
+                    from vaultShare.db.shards import ShardRouter
+
+                    self._router = ShardRouter(
+                        self.config["DATABASE_URL"], self.config["SHARD_DATABASE_URLS"],
+                        echo=self.config["SQL_ECHO"]
+                    )
+        return self._router
+
+    @property
+    def engine(self):
+        """Engine of the primary database, shared by global DB objects."""
+        return self.router.primary
+
+    def get(self, name: str, factory):
+        """Returns the object registered under `name`, creating it on first use."""
+        obj = self._objects.get(name)
+        if obj is None:
+            with self._lock:
+                obj = self._objects.get(name)
+                if obj is None:
+                    obj = self._objects[name] = factory()
+        return obj
+
+    def db(self, cls, workspace_id: str = None):
+        """
+        Returns the app's instance of a DB class, bound to the database
+        holding `workspace_id` for sharded classes.
+        """
+        return self.router.db(cls, workspace_id)
+
+    def dbs(self, cls) -> list:
+        """Returns the app's instances of a DB class, one per database."""
+        return self.router.all(cls)
+
+    def close_sessions(self):
+        """Closes the calling thread's sessions of every created DB object."""
+        if self._router is not None:
+            self._router.close_sessions()
+        for obj in list(self._objects.values()):
+            close_session = getattr(obj, "close_session", None)
+            if close_session:
+                close_session()
+
+    def close(self):
+        """
+        Stops the background threads of the app, the session sweeper, audit
+        log writer, scrubbers and retention job, writing what they still
+        hold. Call it before disposing of the engines.
+        """
+        objects = self._objects
+        if "Auth" in objects:
+            objects["Auth"].stop_session_sweeper()
+        for name in ("audit_log", "retention"):
+            if name in objects:
+                objects[name].stop()
+        for scrubber in objects.get("scrubbers", ()):
+            scrubber.stop()
+        self.close_sessions()
+
+
+def get_resources() -> Resources:
+    """Returns the resources of the current app."""
+    return current_app.extensions["vaultshare"]
+
+
+def get_db(cls, workspace_id: str = None):
+    """
+    Returns the current app's instance of a DB class.
+
+    Sharded DB classes need the `workspace_id` they serve once shards are
+    configured.
+    """
+    return get_resources().db(cls, workspace_id)
+
+
+def get_auth():
+    """Returns the current app's Auth object."""
+    from vaultShare.auth import Auth
+
+    resources = get_resources()
+
+    def factory():
+        config = resources.config
+        auth = Auth(
+            engine=resources.engine,
+            session_ttl=config["SESSION_TTL"],
+            touch_interval=config["SESSION_TOUCH_INTERVAL"],
+            session_mode=config["SESSION_MODE"],
+            secret_key=config["SECRET_KEY"],
+            revocation_refresh=config["SESSION_REVOCATION_REFRESH"]
+        )
+        auth.start_session_sweeper(
+            flush_interval=config["SESSION_FLUSH_INTERVAL"],
+            sweep_interval=config["SESSION_SWEEP_INTERVAL"],
+            batch_size=config["SESSION_SWEEP_BATCH"]
+        )
+        return auth
+    return resources.get("Auth", factory)
+
+
+def get_storage():
+    """Returns the current app's file storage backend."""
+    from vaultShare.file_mangager import create_storage
+
+    resources = get_resources()
+    return resources.get("storage", lambda: create_storage(resources.config))
+
+
+def get_scrubbers() -> list:
+    """
+    Returns the current app's integrity scrubbers, one per database holding
+    files, not started. They share the SCRUB_RATE budget.
+    """
+    from vaultShare.db import AlertDB, ScrubDB
+    from vaultShare.file_mangager import IOBudget, Scrubber
+
+    resources = get_resources()
+
+    def factory():
+        config = resources.config
+        budget = IOBudget(config["SCRUB_RATE"])
+        return [
+            Scrubber(
+                scrub_db, resources.db(AlertDB), get_storage(),
+                rate=config["SCRUB_RATE"],
+                batch_size=config["SCRUB_BATCH_SIZE"],
+                pass_interval=config["SCRUB_PASS_INTERVAL"],
+                budget=budget
+            )
+            for scrub_db in resources.dbs(ScrubDB)
+        ]
+    return resources.get("scrubbers", factory)
+
+
+def get_retention():
+    """Returns the current app's retention job of alerts and invites, not started."""
+    from vaultShare.db import AlertDB, InviteDB
+    from vaultShare.retention import Retention
+
+    resources = get_resources()
+
+    def factory():
+        config = resources.config
+        return Retention(
+            resources.db(AlertDB), resources.dbs(InviteDB),
+            alert_ttls=config["ALERT_RETENTION"],
+            invite_ttls=config["INVITE_RETENTION"],
+            batch_size=config["RETENTION_BATCH_SIZE"],
+            pause=config["RETENTION_PAUSE"],
+            interval=config["RETENTION_INTERVAL"],
+            archive_dir=config["RETENTION_ARCHIVE_DIR"]
+        )
+    return resources.get("retention", factory)
+
+
+def get_audit_log():
+    """Returns the current app's audit log, its writer started."""
+    from vaultShare.audit import AuditLog
+    from vaultShare.db import AuditDB
+
+    resources = get_resources()
+
+    def factory():
+        config = resources.config
+        audit_log = AuditLog(
+            resources.db(AuditDB),
+            max_queue=config["AUDIT_QUEUE_SIZE"],
+            batch_size=config["AUDIT_BATCH_SIZE"],
+            flush_interval=config["AUDIT_FLUSH_INTERVAL"],
+            block_timeout=config["AUDIT_BLOCK_TIMEOUT"]
+        )
+        audit_log.start()
+        return audit_log
+    return resources.get("audit_log", factory)
@@ -0,0 +1,169 @@
+"""
+Module contains the retention job purging old alerts and invites.
+
+Alerts are kept for a time to live per `alert_type`, and invites per
+`status`, with "*" as the default for the others and None to keep them
+forever. Expired rows are deleted oldest first in batches of `batch_size`,
+each in its own short transaction, with a `pause` between batches. A big
+purge therefore never holds the SQLite write lock for long, and requests
+get it in between.
+
+With an archive directory, every batch is appended to a gzip compressed
+JSON lines file before it is deleted, one file per table and day:
+
+    <archive_dir>/alerts-20240501.jsonl.gz
+
+A purge interrupted between the archive write and the delete archives
+the batch again on the next pass.
+"""
+import atexit
+import gzip
+import json
+import os
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from sqlalchemy.exc import SQLAlchemyError
+
+
+def utcnow() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+class Archive:
+    """Appends purged rows to gzip compressed JSON lines files."""
+    def __init__(self, directory: str, clock=utcnow):
+        self.directory = directory
+        self._clock = clock
+
+    def path(self, table: str) -> str:
+        return os.path.join(self.directory, f"{table}-{self._clock():%Y%m%d}.jsonl.gz")
+
+    def write(self, table: str, rows: list):
+        """
+        Appends rows as a new gzip member of the day's file, synced to disk
+        before returning, so the rows are safe once they are deleted.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        with open(self.path(table), "ab") as raw:
+            with gzip.GzipFile(fileobj=raw, mode="wb") as f:
+                for row in rows:
+                    f.write(json.dumps(row, default=str).encode() + b"\n")
+            raw.flush()
+            os.fsync(raw.fileno())
+
+
+class Retention:
+    """
+    Purges expired alerts and invites, in the background or a pass at a time.
+
+    Attributes:
+        alert_ttls (dict): Seconds alerts are kept per `alert_type`.
+        invite_ttls (dict): Seconds invites are kept per `status`.
+        batch_size (int): Rows deleted per transaction.
+        pause (float): Seconds between batches.
+        interval (float): Seconds between the start of passes.
+    """
+    def __init__(self, alert_db, invite_dbs: list, alert_ttls: dict, invite_ttls: dict,
+                 batch_size: int = 500, pause: float = 0.05, interval: float = 3600,
+                 archive_dir: str = None, clock=utcnow):
+        """
+        Args:
+            alert_db (AlertDB): Database of the alerts
+            invite_dbs (list): InviteDB of every database holding invites
+            archive_dir (str): Directory of the archives, None to purge
+            without archiving
+        """
+        self._alert_db = alert_db
+        self._invite_dbs = list(invite_dbs)
+        self.alert_ttls = alert_ttls
+        self.invite_ttls = invite_ttls
+        self.batch_size = batch_size
+        self.pause = pause
+        self.interval = interval
+        self._archive = Archive(archive_dir, clock) if archive_dir else None
+        self._clock = clock
+        self._stopped = threading.Event()
+        self._thread = None
+
+    @staticmethod
+    def _ttl(ttls: dict, key: str):
+        return ttls[key] if key in ttls else ttls.get("*")
+
+    def _purge(self, db, purge, keys: list, ttls: dict, table: str) -> int:
+        """Purges the expired rows of every key, batch by batch."""
+        archive = None
+        if self._archive is not None:
+            def archive(rows):
+                self._archive.write(table, rows)
+        purged = 0
+        try:
+            for key in keys:
+                ttl = self._ttl(ttls, key)
+                if ttl is None:
+                    continue
+                before = self._clock() - timedelta(seconds=ttl)
+                cursor = None
+                while not self._stopped.is_set():
+                    deleted, cursor = purge(key, before, self.batch_size, cursor, archive)
+                    purged += deleted
+                    if cursor is None:
+                        break
+                    # Let requests take the write lock between batches
+                    self._stopped.wait(self.pause)
+        finally:
+            db.close_session()
+        return purged
+
+    def run_pass(self) -> dict:
+        """
+        Purges every expired alert and invite.
+
+        Returns:
+            dict: Number of "alerts" and "invites" deleted
+        """
+        alert_db = self._alert_db
+        stats = {"alerts": self._purge(
+            alert_db, alert_db.purge_alerts, alert_db.find_alert_types(),
+            self.alert_ttls, "alerts"
+        ), "invites": 0}
+        for invite_db in self._invite_dbs:
+            stats["invites"] += self._purge(
+                invite_db, invite_db.purge_invites, invite_db.find_invite_statuses(),
+                self.invite_ttls, "invites"
+            )
+        return stats
+
+    def run_forever(self):
+        """Runs a pass every `interval` seconds until the job stops."""
+        while not self._stopped.is_set():
+            started = time.monotonic()
+            try:
+                self.run_pass()
+            except (SQLAlchemyError, OSError) as e:
+                # TODO: Error would be logged using custom logger
+                print(f"Error purging expired rows: {e}")
+            self._stopped.wait(max(0.0, self.interval - (time.monotonic() - started)))
+
+    def start(self):
+        """Starts the retention thread, it stops at exit."""
+        if self._thread is None:
+            self._stopped.clear()
+            self._thread = threading.Thread(
+                target=self.run_forever, name="vaultshare-retention", daemon=True
+            )
+            self._thread.start()
+            atexit.register(self.stop)
+
+    def join(self, timeout: float = None):
+        """Waits for the retention thread to stop."""
+        thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+
+    def stop(self):
+        """Stops the retention thread after the batch it is deleting."""
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
@@ -0,0 +1,129 @@
+import json
+from flask import Blueprint, Response, request, jsonify, stream_with_context
+from vaultShare.db import AlertDB
+from vaultShare.exceptions import InvalidFieldType
+from vaultShare.notifications import broker
+from vaultShare.resources import get_resources, get_db
+from vaultShare.routes.utils import current_user, int_arg
+
+# Create an alert route blueprint
+alerts_bp = Blueprint('alerts', __name__)
+
+MAX_PAGE_SIZE = 100
+MAX_WAIT = 55 # seconds, kept under common proxy idle timeouts
+
+@alerts_bp.route('/', methods=['GET'])
+def alert_feed():
+    """
+    Paginated alert feed of the logged in user, newest first.
+
+    Query parameters: `limit`, `cursor` and `unread` ("1" for unread only).
+    """
+    user = current_user()
+    alert_db = get_db(AlertDB)
+    limit = int_arg('limit', 20, MAX_PAGE_SIZE) or 20
+    try:
+        alerts, next_cursor = alert_db.find_alerts(
+            user.id, limit=limit,
+            cursor=request.args.get('cursor'),
+            unread_only=request.args.get('unread') == "1"
+        )
+    except ValueError as e:
+        raise InvalidFieldType(str(e))
+    return jsonify({
+        "alerts": [alert_db.to_dict(alert) for alert in alerts],
+        "next_cursor": next_cursor
+    })
+
+@alerts_bp.route('/unread_count', methods=['GET'])
+def unread_count():
+    user = current_user()
+    alert_db = get_db(AlertDB)
+    return jsonify({"unread": alert_db.unread_count(user.id)})
+
+@alerts_bp.route('/read', methods=['PUT'])
+def mark_alerts_read():
+    """
+    Bulk mark alerts as read.
+
+    Takes a JSON body {"ids": [...]}, or no ids to mark every alert as read.
+    """
+    user = current_user()
+    alert_db = get_db(AlertDB)
+    payload = request.get_json(silent=True) or {}
+    alert_ids = payload.get("ids")
+    if alert_ids is None and request.form.getlist("ids"):
+        alert_ids = request.form.getlist("ids")
+    if alert_ids is not None and (
+        not isinstance(alert_ids, list) or not all(isinstance(i, str) for i in alert_ids)
+    ):
+        raise InvalidFieldType("ids must be a list of alert ids")
+
+    num_of_updates = alert_db.mark_read(user.id, alert_ids)
+    return jsonify({
+        "updated": num_of_updates,
+        "unread": alert_db.unread_count(user.id)
+    })
+
+@alerts_bp.route('/poll', methods=['GET'])
+def poll_alerts():
+    """
+    Long-poll for alert changes.
+
+    Blocks for up to `wait` seconds until an alert change newer than the
+    `since` version is published. Waiting runs no queries.
+    """
+    user = current_user()
+    since = int_arg('since', 0, 2**63)
+    wait = int_arg('wait', 30, MAX_WAIT)
+    # Hand pooled connections back before sleeping
+    get_resources().close_sessions()
+    version, messages, complete = broker.wait(AlertDB.topic(user.id), since, timeout=wait)
+    return jsonify({
+        "version": version,
+        "events": messages,
+        # Events fell out of the broker history, client should reload the feed
+        "resync": not complete
+    })
+
+@alerts_bp.route('/stream', methods=['GET'])
+def stream_alerts():
+    """
+    Server-sent events stream of the user's alert changes.
+
+    The unread count is sent once on connect, after which the stream only
+    wakes when the broker publishes to the user's topic.
+    """
+    user = current_user()
+    alert_db = get_db(AlertDB)
+    topic = AlertDB.topic(user.id)
+    since = broker.version(topic)
+    try:
+        # Reconnecting EventSource clients resume after their last event
+        since = min(int(request.headers.get("Last-Event-ID", since)), since)
+    except ValueError:
+        pass
+    unread = alert_db.unread_count(user.id)
+    get_resources().close_sessions()
+
+    def events():
+        version = since
+        yield f"event: unread\ndata: {json.dumps({'unread': unread})}\n\n"
+        while True:
+            new_version, messages, complete = broker.wait(topic, version, timeout=MAX_WAIT)
+            if new_version == version:
+                # Comment line keeps idle connections open through proxies
+                yield ": keep-alive\n\n"
+                continue
+            if not complete:
+                yield "event: resync\ndata: {}\n\n"
+            for i, message in enumerate(messages, start=new_version - len(messages) + 1):
+                event = "alert" if "alert" in message else "unread"
+                yield f"id: {i}\nevent: {event}\ndata: {json.dumps(message)}\n\n"
+            version = new_version
+
+    return Response(
+        stream_with_context(events()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
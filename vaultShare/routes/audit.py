@@ -0,0 +1,51 @@
+from datetime import datetime, timezone
+from flask import Blueprint, request, jsonify
+from vaultShare.db import AuditDB
+from vaultShare.exceptions import InvalidFieldType
+from vaultShare.resources import get_db
+from vaultShare.routes.utils import current_admin, int_arg
+
+# Create an audit log route blueprint
+audit_bp = Blueprint('audit', __name__)
+
+MAX_PAGE_SIZE = 1000
+
+def _time_arg(name):
+    """Reads an ISO 8601 time query parameter, as naive UTC."""
+    value = request.args.get(name)
+    if not value:
+        return None
+    try:
+        time = datetime.fromisoformat(value)
+    except ValueError:
+        raise InvalidFieldType(f"Invalid <{name}> time <{value}>, use ISO 8601")
+    if time.tzinfo is not None:
+        time = time.astimezone(timezone.utc).replace(tzinfo=None)
+    return time
+
+@audit_bp.route('/', methods=['GET'])
+def audit_events():
+    """
+    Paginated audit events, oldest first. Site admins only.
+
+    Query parameters: `since` and `until` (ISO 8601 times), `user_id`,
+    `event_type`, `workspace_id`, `limit` and `cursor`.
+    """
+    current_admin()
+    audit_db = get_db(AuditDB)
+    limit = int_arg('limit', 100, MAX_PAGE_SIZE) or 100
+    since, until = _time_arg('since'), _time_arg('until')
+    try:
+        events, next_cursor = audit_db.find_events(
+            since=since, until=until,
+            user_id=request.args.get('user_id'),
+            event_type=request.args.get('event_type'),
+            workspace_id=request.args.get('workspace_id'),
+            cursor=request.args.get('cursor'), limit=limit
+        )
+    except ValueError as e:
+        raise InvalidFieldType(str(e))
+    return jsonify({
+        "events": [audit_db.to_dict(event) for event in events],
+        "next_cursor": next_cursor
+    })
@@ -1,9 +1,10 @@
 from flask import Blueprint, request, jsonify
 from vaultShare.db import UserDB
+from vaultShare.resources import get_db
 from vaultShare.exceptions import NoUserFound
+from vaultShare.routes.utils import audit
 from sqlalchemy.exc import NoResultFound
 
-user_db = UserDB()
 # Create a user route blueprint
 users_bp = Blueprint('users', __name__)
 
@@ -21,6 +22,7 @@ def process_user_details(user_obj):
 
 @users_bp.route('/', methods=['GET'])
 def app_users_details():
+    user_db = get_db(UserDB)
     limit = request.args.get('limit')
     users_obj = user_db.find_all_users(limit=limit)
     users = [process_user_details(user.__dict__) for user in users_obj]
@@ -29,6 +31,7 @@ def app_users_details():
 
 @users_bp.route('/<username>', methods=['GET'])
 def app_user_detail(username: str):
+    user_db = get_db(UserDB)
     try:
         obj = user_db.find_user(username=username)
         user = process_user_details(obj.__dict__)
@@ -44,6 +47,7 @@ def update_user_details(username: str):
     Only details like username, and email can be updated using this
     route
     """
+    user_db = get_db(UserDB)
     new_username = request.form.get('username')
     new_email = request.form.get('email')
     
@@ -58,6 +62,8 @@ def update_user_details(username: str):
         fields_updated += user_db.update_user(update_filter, username=new_username)
     if new_email:
         fields_updated += user_db.update_user(update_filter, email=new_email)
+    if fields_updated:
+        audit("user_updated", user.id, username=new_username, email=new_email)
     
     message = {"message": f"{fields_updated} fields were updated" if fields_updated else "No field has been updated"}  
     return jsonify(message)
\ No newline at end of file
@@ -0,0 +1,115 @@
+from functools import wraps
+from flask import request, abort, g
+from sqlalchemy.exc import NoResultFound
+from vaultShare.auth.authz import Membership, MembershipCache
+from vaultShare.db import UserDB, WorkspaceDB
+from vaultShare.exceptions import NoWorkspaceFound
+from vaultShare.resources import get_resources, get_auth, get_audit_log, get_db
+
+def membership_cache() -> MembershipCache:
+    """Returns the app's membership cache, created on first use."""
+    resources = get_resources()
+
+    def load(user_id):
+        # Workspaces are spread over the shards, ask each of them
+        memberships = {}
+        for workspace_db in resources.dbs(WorkspaceDB):
+            memberships.update(
+                (workspace_id, Membership(*membership))
+                for workspace_id, membership in workspace_db.find_memberships(user_id).items()
+            )
+        return memberships
+
+    def factory():
+        return MembershipCache(
+            load,
+            max_users=resources.config["MEMBERSHIP_CACHE_USERS"],
+            ttl=resources.config["MEMBERSHIP_CACHE_TTL"]
+        )
+    return resources.get("membership_cache", factory)
+
+def current_user():
+    """Returns the user owning the request session, or aborts with 403."""
+    session_id = request.cookies.get("session_id")
+    user = get_auth().find_user_by_sessionid(session_id) if session_id else None
+    if not user:
+        abort(403)
+    return user
+
+def current_admin(required: bool = True):
+    """
+    Returns the site admin owning the request session.
+
+    The role is read from the users table, signed sessions only carry the
+    user id.
+
+    Args:
+        required (bool): Abort with 403 if the session is not a site admin's,
+        else return None. Defaults to True.
+    """
+    session_id = request.cookies.get("session_id")
+    user = get_auth().find_user_by_sessionid(session_id) if session_id else None
+    if user is not None:
+        try:
+            user = get_db(UserDB).find_user(id=user.id)
+        except NoResultFound:
+            user = None
+    if user is None or user.role != "admin":
+        if required:
+            abort(403)
+        return None
+    return user
+
+def audit(event_type: str, user_id: str = None, workspace_id: str = None, **detail):
+    """
+    Queues an audit event of the request, stamped with the client address.
+
+    Only an in-memory queue is touched, see `vaultShare.audit`. Keyword
+    arguments are kept as the event details.
+    """
+    get_audit_log().record(
+        event_type, user_id=user_id, workspace_id=workspace_id,
+        ip=request.remote_addr, detail=detail or None
+    )
+
+def workspace_member_required(role: str = None, not_found: bool = False):
+    """
+    Route decorator admitting members of the `<workspace_id>` in the URL.
+
+    Memberships come from the authorization cache, so the check is a memory
+    lookup once the user's memberships are loaded. The user and membership
+    are stored on `g.user` and `g.membership`.
+
+    Args:
+        role (str): Required workspace role, e.g. "admin". Defaults to None
+        for any member.
+        not_found (bool): Raise NoWorkspaceFound for an unknown workspace,
+        for routes documenting a 404, instead of aborting with 403. The
+        workspace is only looked up for users who are not members.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            user = current_user()
+            workspace_id = kwargs["workspace_id"]
+            membership = membership_cache().get(user.id, workspace_id)
+            if membership is None and not_found:
+                try:
+                    get_db(WorkspaceDB, workspace_id).find_workspace(id=workspace_id)
+                except NoResultFound:
+                    raise NoWorkspaceFound(f"No workspace {workspace_id} found.")
+            if membership is None or (role and membership.role != role):
+                abort(403)
+            g.user = user
+            g.membership = membership
+            return view(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def int_arg(name, default, maximum):
+    """Reads a bounded, non negative integer query parameter."""
+    try:
+        value = int(request.args.get(name, default))
+    except ValueError:
+        value = default
+    return max(0, min(value, maximum))
@@ -0,0 +1,357 @@
+import mimetypes
+import os
+import threading
+import uuid
+from flask import Blueprint, Response, request, jsonify, g, abort, redirect, send_file
+from vaultShare.auth import authz
+from vaultShare.db import (
+    InviteDB, SearchDB, FolderDB, FileDB, WorkspaceChangeDB, WorkspaceDB
+)
+from vaultShare.exceptions import (
+    MissingFieldError, InvalidFieldType, NoWorkspaceFound,
+    WorkspaceLimitExceeded, NoFolderFound, NoFileFound, NoExportFound,
+    FileVersionConflict
+)
+from vaultShare.file_mangager import (
+    SignatureCache, apply_delta, exports, file_checksum, iter_entries,
+    read_manifest, stream_zip
+)
+from vaultShare.notifications import broker
+from vaultShare.resources import get_db, get_resources, get_storage
+from vaultShare.routes.utils import workspace_member_required, int_arg, audit
+from sqlalchemy.exc import NoResultFound
+from werkzeug.wsgi import wrap_file
+
+# Create a workspace route blueprint
+workspaces_bp = Blueprint('workspaces', __name__)
+
+MAX_CHANGES = 1000
+MAX_WAIT = 55 # seconds, kept under common proxy idle timeouts
+
+# Striped locks serializing delta updates of a file within the process
+_file_locks = [threading.Lock() for _ in range(64)]
+
+def _stored_file(workspace_id: str, file_id: str):
+    """Returns a workspace file, checking its content is in storage."""
+    try:
+        file = get_db(FileDB, workspace_id).find_file(id=file_id, workspace_id=workspace_id)
+    except NoResultFound:
+        raise NoFileFound(f"No file {file_id} found.")
+    try:
+        get_storage().stat(file.path)
+    except FileNotFoundError:
+        raise NoFileFound(f"File {file_id} is missing from storage.")
+    return file
+
+def signature_cache() -> SignatureCache:
+    resources = get_resources()
+    return resources.get("signature_cache", lambda: SignatureCache(
+        max_blocks=resources.config["SIGNATURE_CACHE_BLOCKS"]
+    ))
+
+@workspaces_bp.route('/<workspace_id>/invites', methods=['POST'])
+@workspace_member_required(role="admin", not_found=True)
+def invite_users(workspace_id: str):
+    """
+    Invite a batch of emails to a workspace.
+
+    Takes a JSON body {"emails": [...]}, or repeated `emails` form fields.
+    """
+    payload = request.get_json(silent=True) or {}
+    emails = payload.get("emails") or request.form.getlist("emails")
+    if not emails or not isinstance(emails, list):
+        raise MissingFieldError("Fill in the <emails> to invite")
+    if len(emails) > InviteDB.MAX_BATCH:
+        raise InvalidFieldType(f"At most {InviteDB.MAX_BATCH} <emails> can be invited at once")
+
+    try:
+        result = get_db(InviteDB, workspace_id).add_invites(workspace_id, g.user.id, emails)
+    except NoResultFound:
+        raise NoWorkspaceFound(f"No workspace {workspace_id} found.")
+    except ValueError as e:
+        raise WorkspaceLimitExceeded(e.args[0])
+    audit("invites_sent", g.user.id, workspace_id, emails=len(emails))
+    return jsonify(result), 201
+
+@workspaces_bp.route('/<workspace_id>/clone', methods=['POST'])
+@workspace_member_required(role="admin")
+def clone_workspace(workspace_id: str):
+    """
+    Creates a copy of the workspace administered by the caller.
+
+    Takes a `name` for the copy. Folders and files are copied as rows only,
+    the copies share stored content with the originals until modified.
+    """
+    payload = request.get_json(silent=True) or {}
+    name = payload.get("name") or request.form.get("name")
+    if not name or not isinstance(name, str):
+        raise MissingFieldError("Fill in the <name> of the copy")
+
+    new_id = str(uuid.uuid4())
+    router = get_resources().router
+    # A workspace on another shard is read from its attached database
+    source_path = None
+    if router.engine_for(new_id) is not router.engine_for(workspace_id):
+        source_path = router.database_path(workspace_id)
+    try:
+        copied = get_db(WorkspaceDB, new_id).clone_workspace(
+            workspace_id, new_id, name, g.user.id, source_path=source_path
+        )
+    except NoResultFound:
+        raise NoWorkspaceFound(f"No workspace {workspace_id} found.")
+    authz.bump([g.user.id])
+    audit("workspace_cloned", g.user.id, new_id, source=workspace_id)
+    return jsonify({"workspace_id": new_id, **copied}), 201
+
+@workspaces_bp.route('/<workspace_id>/folders/<folder_id>/clone', methods=['POST'])
+@workspace_member_required()
+def clone_folder(workspace_id: str, folder_id: str):
+    """
+    Copies a folder subtree within the workspace.
+
+    Takes an optional `parent_folder_id` to place the copy in, and `name`.
+    """
+    payload = request.get_json(silent=True) or {}
+    parent_folder_id = payload.get("parent_folder_id") or request.form.get("parent_folder_id")
+    name = payload.get("name") or request.form.get("name")
+    try:
+        copied = get_db(FolderDB, workspace_id).clone_folder(
+            workspace_id, folder_id, parent_folder_id, name
+        )
+    except NoResultFound:
+        raise NoFolderFound(f"No folder {parent_folder_id or folder_id} found.")
+    audit("folder_cloned", g.user.id, workspace_id, source=folder_id, folder_id=copied["id"])
+    return jsonify(copied), 201
+
+@workspaces_bp.route('/<workspace_id>/search', methods=['GET'])
+@workspace_member_required()
+def search_workspace(workspace_id: str):
+    """
+    Search-as-you-type over a workspace's files, folders and members.
+
+    Query parameters: `q`, `type` ("files", "folders", "users" or "all"),
+    `limit` and `page`.
+    """
+    query = (request.args.get('q') or "").strip()
+    if not query:
+        raise MissingFieldError("Fill in the search query <q>")
+    kind = request.args.get('type', 'all')
+    search_db = get_db(SearchDB, workspace_id)
+    searches = {
+        "files": search_db.search_files,
+        "folders": search_db.search_folders,
+        "users": search_db.search_users,
+    }
+    if kind != "all" and kind not in searches:
+        raise InvalidFieldType(f"Invalid search type <{kind}>")
+
+    limit = int_arg('limit', 20, 50) or 20
+    page = int_arg('page', 1, 100) or 1
+    kinds = list(searches) if kind == "all" else [kind]
+    payload = {
+        name: searches[name](workspace_id, query, limit=limit, offset=(page - 1) * limit)
+        for name in kinds
+    }
+    payload["page"] = page
+    return jsonify(payload)
+
+@workspaces_bp.route('/<workspace_id>/export', methods=['GET'])
+@workspace_member_required(role="admin")
+def export_workspace(workspace_id: str):
+    """
+    Streams a ZIP archive of the workspace, or of the `folder_id` subtree.
+
+    Bytes are sent as they are produced and nothing is staged on disk. The
+    `X-Export-Id` header names the export for the progress and cancel
+    routes.
+    """
+    folder_id = request.args.get('folder_id')
+    try:
+        folder_paths = get_db(FolderDB, workspace_id).find_folder_paths(workspace_id, folder_id)
+    except NoResultFound:
+        raise NoFolderFound(f"No folder {folder_id} found.")
+    file_db = get_db(FileDB, workspace_id)
+    files_total, size_total = file_db.count_tree_files(workspace_id, folder_id)
+    job = exports.start(workspace_id, folder_id, files_total, size_total)
+    audit("workspace_exported", g.user.id, workspace_id, folder_id=folder_id,
+          files=files_total)
+
+    resources = get_resources()
+    config = resources.config
+    entries = iter_entries(
+        file_db, workspace_id, folder_id, folder_paths,
+        batch_size=config["EXPORT_BATCH_SIZE"]
+    )
+    # The archive is generated after the request returns, hand the
+    # connections back first
+    resources.close_sessions()
+    name = folder_paths[folder_id] if folder_id else workspace_id
+    response = Response(
+        stream_zip(job, get_storage(), entries, sorted(folder_paths.values()),
+                   chunk_size=config["EXPORT_CHUNK_SIZE"]),
+        mimetype="application/zip",
+        headers={"X-Export-Id": job.id, "X-Accel-Buffering": "no"}
+    )
+    response.headers.set("Content-Disposition", "attachment", filename=f"{name}.zip")
+    return response
+
+@workspaces_bp.route('/<workspace_id>/exports/<export_id>', methods=['GET', 'DELETE'])
+@workspace_member_required(role="admin")
+def export_progress(workspace_id: str, export_id: str):
+    """
+    Progress of an export, DELETE cancels it.
+    """
+    job = exports.get(export_id)
+    if job is None or job.workspace_id != workspace_id:
+        raise NoExportFound(f"No export {export_id} found.")
+    if request.method == 'DELETE':
+        job.cancel()
+        return jsonify(job.to_dict()), 202
+    return jsonify(job.to_dict())
+
+@workspaces_bp.route('/<workspace_id>/files/<file_id>/signature', methods=['GET'])
+@workspace_member_required()
+def file_signature(workspace_id: str, file_id: str):
+    """
+    Block signature of the stored version of a file, for delta sync.
+    """
+    file = _stored_file(workspace_id, file_id)
+    try:
+        return jsonify(signature_cache().get(get_storage(), file.path))
+    except FileNotFoundError:
+        raise NoFileFound(f"File {file_id} is missing from storage.")
+
+@workspaces_bp.route('/<workspace_id>/files/<file_id>/download', methods=['GET'])
+@workspace_member_required()
+def download_file(workspace_id: str, file_id: str):
+    """
+    Downloads a file.
+
+    Backends that can serve the bytes themselves answer with a redirect to
+    a short lived presigned URL, so the download never passes through the
+    app. Otherwise the file is streamed.
+    """
+    try:
+        file = get_db(FileDB, workspace_id).find_file(id=file_id, workspace_id=workspace_id)
+    except NoResultFound:
+        raise NoFileFound(f"No file {file_id} found.")
+    audit("file_downloaded", g.user.id, workspace_id, file_id=file_id)
+    storage = get_storage()
+    # The body is sent after the request returns, hand the connections back
+    get_resources().close_sessions()
+    try:
+        url = storage.presigned_url(
+            file.path, expires=get_resources().config["DOWNLOAD_URL_EXPIRES"],
+            filename=file.name
+        )
+        if url:
+            return redirect(url)
+        path = storage.local_path(file.path)
+        if path:
+            return send_file(path, download_name=file.name, as_attachment=True)
+        stat, source = storage.get(file.path)
+    except FileNotFoundError:
+        raise NoFileFound(f"File {file_id} is missing from storage.")
+    response = Response(
+        wrap_file(request.environ, source),
+        mimetype=mimetypes.guess_type(file.name)[0] or "application/octet-stream",
+        direct_passthrough=True
+    )
+    response.headers.set("Content-Disposition", "attachment", filename=file.name)
+    response.content_length = stat.size
+    response.set_etag(stat.version)
+    response.last_modified = stat.modified
+    # Range requests seek within the file, compressed files only decode
+    # the frames the range overlaps
+    return response.make_conditional(request, accept_ranges=True, complete_length=stat.size)
+
+@workspaces_bp.route('/<workspace_id>/files/<file_id>/delta', methods=['PATCH'])
+@workspace_member_required()
+def patch_file(workspace_id: str, file_id: str):
+    """
+    Updates a file from a delta against its stored version.
+
+    The body is a delta from `vaultShare.file_mangager.encode_delta`. Only
+    changed blocks travel, the rest is copied from the stored version while
+    the new one is rebuilt. Members may update their own files, workspace
+    admins any file.
+    """
+    storage = get_storage()
+    if g.membership.role != "admin" and (
+        _stored_file(workspace_id, file_id).user_id != g.user.id
+    ):
+        abort(403)
+    stream = request.stream
+    try:
+        manifest = read_manifest(stream)
+    except ValueError as e:
+        raise InvalidFieldType(str(e))
+    conflict = FileVersionConflict(
+        f"File {file_id} changed, fetch a new signature and retry"
+    )
+    # Locked by file, a copy on write moves the file to a new key. Other
+    # servers are kept out by the version check of update_file_content
+    with _file_locks[hash((workspace_id, file_id)) % len(_file_locks)]:
+        file = _stored_file(workspace_id, file_id)
+        key = file.path
+        try:
+            if manifest["version"] != storage.stat(key).version:
+                raise conflict
+            # Remote copies are pinned to the manifest version and fail
+            # if another server replaced the file meanwhile
+            stats = apply_delta(storage, key, stream, manifest)
+        except FileNotFoundError:
+            raise conflict
+        except FileVersionConflict:
+            raise
+        except ValueError as e:
+            # Truncated body, unknown op or size mismatch
+            raise InvalidFieldType(str(e))
+        temp_path = stats.pop("temp_path")
+        stored = []
+
+        def replace(path):
+            stored.append(storage.put_file(path, temp_path))
+            return stored[-1]
+        try:
+            updated = get_db(FileDB, workspace_id).update_file_content(
+                file_id, stats["size"] / 2**20, replace,
+                checksum=file_checksum(temp_path), updated_at=file.updated_at
+            )
+        except ValueError as e:
+            # Over the workspace memory or the owner's quota
+            raise WorkspaceLimitExceeded(e.args[0])
+        finally:
+            if os.path.exists(temp_path):
+                os.unlink(temp_path)
+        if not updated:
+            # Updated or deleted since it was read
+            raise conflict
+        stats["version"] = stored[-1].version
+    audit("file_updated", g.user.id, workspace_id, file_id=file_id, size=stats["size"])
+    return jsonify(stats)
+
+@workspaces_bp.route('/<workspace_id>/changes', methods=['GET'])
+@workspace_member_required()
+def workspace_changes(workspace_id: str):
+    """
+    Page of the workspace change log after the `since` seq.
+
+    Query parameters: `since`, `limit` and `wait`. With `wait`, an empty
+    page long-polls for up to `wait` seconds until a change is recorded.
+    """
+    since = int_arg('since', 0, 2**63)
+    limit = int_arg('limit', 100, MAX_CHANGES) or 100
+    wait = int_arg('wait', 0, MAX_WAIT)
+    change_db = get_db(WorkspaceChangeDB, workspace_id)
+    topic = change_db.topic(workspace_id)
+    # Read before the query, a change committed in between wakes the wait
+    version = broker.version(topic)
+    page = change_db.find_changes(workspace_id, since, limit)
+    if wait and not page["changes"] and not page["resync"]:
+        # Hand pooled connections back before sleeping
+        get_resources().close_sessions()
+        new_version, _, _ = broker.wait(topic, version, timeout=wait)
+        if new_version != version:
+            page = change_db.find_changes(workspace_id, since, limit)
+    return jsonify(page)